@@ -1,9 +1,9 @@
 /**
  * @module Feed
- * @description Displays the chronological list of bird sightings with auto-refresh capabilities.
+ * @description Displays the chronological list of bird sightings, kept current by a live event stream.
  */
 
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import SightingCard from './SightingCard';
 import { Bell, RefreshCw, LogOut, Bird } from 'lucide-react';
 import { IconButton } from './ui/IconButton';
@@ -11,9 +11,31 @@ import { Dialog } from './ui/Dialog';
 import { Input } from './ui/Input';
 import { Button } from './ui/Button';
 
+// Newest first, matching the server's (timestamp, id) order.
+const byRecency = (a, b) => (a.timestamp === b.timestamp ? b.id - a.id : (a.timestamp < b.timestamp ? 1 : -1));
+
+// Inserts or replaces rows by id; `{id, deleted: true}` tombstones remove them.
+const mergeSightings = (current, rows) => {
+    const merged = new Map(current.map(s => [s.id, s]));
+    rows.forEach(row => {
+        if (row.deleted) merged.delete(row.id);
+        else merged.set(row.id, { ...merged.get(row.id), ...row });
+    });
+    return [...merged.values()].sort(byRecency);
+};
+
+// Sync tokens are "<updated_at>:<id>"; streamed rows only need the time to be compared.
+const tokenTime = (token) => parseInt(token) || 0;
+const SYNC_PAGE = 100;
+
 const Feed = ({ onLogout, onSubscribe }) => {
     const [sightings, setSightings] = useState([]);
     const [loading, setLoading] = useState(true);
+    const [nextCursor, setNextCursor] = useState(null);
+    const [loadingMore, setLoadingMore] = useState(false);
+    // Sync token of the newest change we have seen; ?since= returns only what came after it.
+    const syncToken = useRef(null);
+    const streamOpen = useRef(false);
 
     // Dialog states
     const [editingSighting, setEditingSighting] = useState(null);
@@ -29,6 +51,8 @@ const Feed = ({ onLogout, onSubscribe }) => {
             if (res.ok) {
                 const data = await res.json();
                 setSightings(data);
+                setNextCursor(res.headers.get('X-Next-Cursor'));
+                syncToken.current = res.headers.get('X-Sync-Token');
             }
         } catch (err) {
             console.error(err);
@@ -37,10 +61,76 @@ const Feed = ({ onLogout, onSubscribe }) => {
         }
     };
 
+    // Catches up on rows created, changed or deleted since the last sync (after a reconnect, or when polling).
+    const fetchChanges = async () => {
+        if (syncToken.current === null) return fetchSightings();
+        try {
+            for (;;) {
+                const res = await fetch(`/api/sightings?limit=${SYNC_PAGE}&since=${encodeURIComponent(syncToken.current)}`);
+                // The token predates the deletions the server still remembers.
+                if (res.status === 410) return fetchSightings();
+                if (!res.ok) return;
+                const rows = await res.json();
+                if (rows.length) setSightings(current => mergeSightings(current, rows));
+                syncToken.current = res.headers.get('X-Sync-Token') || syncToken.current;
+                // A full page means more changes are waiting.
+                if (rows.length < SYNC_PAGE) return;
+            }
+        } catch (err) {
+            console.error(err);
+        }
+    };
+
+    const loadMore = async () => {
+        if (!nextCursor) return;
+        setLoadingMore(true);
+        try {
+            const res = await fetch(`/api/sightings?limit=20&cursor=${encodeURIComponent(nextCursor)}`);
+            if (res.ok) {
+                const rows = await res.json();
+                setSightings(current => mergeSightings(current, rows));
+                setNextCursor(res.headers.get('X-Next-Cursor'));
+            }
+        } catch (err) {
+            console.error(err);
+        } finally {
+            setLoadingMore(false);
+        }
+    };
+
     useEffect(() => {
         fetchSightings();
-        const interval = setInterval(fetchSightings, 30000);
-        return () => clearInterval(interval);
+
+        // New and finished sightings arrive as deltas; nothing is re-fetched while the stream is up.
+        const events = new EventSource('/api/sightings/stream');
+        const applyRow = (e) => {
+            const row = JSON.parse(e.data);
+            setSightings(current => mergeSightings(current, [row]));
+            if (row.updated_at > tokenTime(syncToken.current)) syncToken.current = `${row.updated_at}:${row.id}`;
+        };
+        events.addEventListener('created', applyRow);
+        events.addEventListener('updated', applyRow);
+        events.addEventListener('deleted', (e) => {
+            const { ids } = JSON.parse(e.data);
+            setSightings(current => current.filter(s => !ids.includes(s.id)));
+        });
+        events.onopen = () => {
+            // Anything that happened while disconnected was not streamed to us.
+            if (!streamOpen.current && syncToken.current !== null) fetchChanges();
+            streamOpen.current = true;
+        };
+        events.onerror = () => {
+            // EventSource reconnects by itself; poll for changes in the meantime.
+            streamOpen.current = false;
+        };
+
+        const interval = setInterval(() => {
+            if (!streamOpen.current) fetchChanges();
+        }, 30000);
+        return () => {
+            clearInterval(interval);
+            events.close();
+        };
     }, []);
 
     const handleEditClick = (sighting) => {
@@ -144,6 +234,13 @@ const Feed = ({ onLogout, onSubscribe }) => {
                         />
                     ))
                 )}
+                {nextCursor && (
+                    <div className="flex justify-center">
+                        <Button variant="secondary" onClick={loadMore} disabled={loadingMore}>
+                            {loadingMore ? 'Loading...' : 'Load older sightings'}
+                        </Button>
+                    </div>
+                )}
             </main>
 
             {/* 1. Edit Dialog */}
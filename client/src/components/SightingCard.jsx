@@ -10,14 +10,44 @@ import { Card } from './ui/Card';
 import { IconButton } from './ui/IconButton';
 import { cn } from '../lib/utils';
 
+// The card is at most max-w-xl (576px) wide; let the browser pick the smallest thumbnail that fits.
+const IMAGE_SIZES = '(max-width: 640px) 100vw, 576px';
+
+/**
+ * Parses the derivatives manifest (thumbnails, poster) the vision service registers for a sighting.
+ * @returns {{images: object[], poster?: string}}
+ */
+const parseDerivatives = (sighting) => {
+    try {
+        const manifest = JSON.parse(sighting.derivatives || '{}');
+        return { images: manifest.images || [], poster: manifest.poster };
+    } catch (e) {
+        return { images: [] };
+    }
+};
+
+// "a.webp 320w, b.webp 640w" for the entries that have the given format.
+const srcSet = (images, format) => images
+    .filter(image => image[format])
+    .map(image => `/static/${image[format]} ${image.width}w`)
+    .join(', ');
+
 const SightingCard = ({ sighting, onRefresh, onDelete, onEdit }) => {
     const isRecording = sighting.status === 'recording';
     const [currentSlide, setCurrentSlide] = useState(0); // 0: Image, 1: Video
 
     const hasVideo = !!sighting.hq_video_path;
+    const derivatives = parseDerivatives(sighting);
+    // `src` stays the full-resolution original, which is what Download saves. With a poster,
+    // the video is not downloaded at all until the user presses play.
     const slides = [
-        { type: 'image', src: sighting.hq_snapshot_path ? `/static/${sighting.hq_snapshot_path}` : `/static/${sighting.lq_crop_path}` },
-        ...(hasVideo ? [{ type: 'video', src: `/static/${sighting.hq_video_path}` }] : [])
+        {
+            type: 'image',
+            src: sighting.hq_snapshot_path ? `/static/${sighting.hq_snapshot_path}` : `/static/${sighting.lq_crop_path}`,
+            webpSrcSet: srcSet(derivatives.images, 'webp'),
+            jpgSrcSet: srcSet(derivatives.images, 'jpg')
+        },
+        ...(hasVideo ? [{ type: 'video', src: `/static/${sighting.hq_video_path}`, poster: derivatives.poster && `/static/${derivatives.poster}` }] : [])
     ];
 
     const nextSlide = () => {
@@ -97,7 +127,13 @@ const SightingCard = ({ sighting, onRefresh, onDelete, onEdit }) => {
 
                 {/* Row 2: Date (Left) & Count (Right) */}
                 <div className="flex justify-between items-center text-sm text-muted-foreground">
-                    <span className="font-medium bg-muted px-2 py-0.5 rounded-md border border-border/50">{dateStr}</span>
+                    <div className="flex items-center gap-2">
+                        <span className="font-medium bg-muted px-2 py-0.5 rounded-md border border-border/50">{dateStr}</span>
+                        {/* Camera name, only when several feeders report */}
+                        {sighting.camera_id && sighting.camera_id !== 'default' && (
+                            <span className="font-medium bg-muted px-2 py-0.5 rounded-md border border-border/50">{sighting.camera_id}</span>
+                        )}
+                    </div>
                     <span className="font-bold bg-tertiary text-foreground px-2.5 py-1 rounded-full text-[10px] uppercase tracking-wider border-2 border-foreground shadow-[2px_2px_0px_#1E293B]">
                         {sighting.sightings_count || 1} sighting{sighting.sightings_count !== 1 ? 's' : ''}
                     </span>
@@ -124,15 +160,22 @@ const SightingCard = ({ sighting, onRefresh, onDelete, onEdit }) => {
                         {slides.map((slide, idx) => (
                             <div key={idx} className="min-w-full h-full relative flex items-center justify-center bg-slate-100">
                                 {slide.type === 'image' ? (
-                                    <img
-                                        src={slide.src}
-                                        alt={sighting.species}
-                                        className="w-full h-full object-cover transition-transform duration-1000 group-hover/media:scale-105"
-                                        loading="lazy"
-                                    />
+                                    <picture className="w-full h-full">
+                                        {slide.webpSrcSet && <source type="image/webp" srcSet={slide.webpSrcSet} sizes={IMAGE_SIZES} />}
+                                        <img
+                                            src={slide.src}
+                                            srcSet={slide.jpgSrcSet || undefined}
+                                            sizes={slide.jpgSrcSet ? IMAGE_SIZES : undefined}
+                                            alt={sighting.species}
+                                            className="w-full h-full object-cover transition-transform duration-1000 group-hover/media:scale-105"
+                                            loading="lazy"
+                                        />
+                                    </picture>
                                 ) : (
                                     <video
                                         src={slide.src}
+                                        poster={slide.poster}
+                                        preload={slide.poster ? 'none' : 'metadata'}
                                         controls
                                         className="w-full h-full object-contain"
                                     />
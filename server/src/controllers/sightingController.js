@@ -4,84 +4,328 @@
  */
 
 const db = require('../db/database');
-const pushService = require('../services/pushService');
+const pushDispatcher = require('../services/pushDispatcher');
+const { getAssetBytes } = require('../services/cleanupService');
+const sightingEvents = require('../services/sightingEvents');
 
-// Lists sightings with pagination
-exports.listSightings = (req, res) => {
-    const limit = parseInt(req.query.limit) || 20;
-    const offset = parseInt(req.query.offset) || 0;
+// Promise wrappers so the batch webhook can process events strictly in order.
+const run = (sql, params) => new Promise((resolve, reject) => {
+    db.run(sql, params, function (err) {
+        if (err) return reject(err);
+        resolve(this);
+    });
+});
 
-    db.all('SELECT * FROM sightings ORDER BY timestamp DESC LIMIT ? OFFSET ?', [limit, offset], (err, rows) => {
-        if (err) {
-            return res.status(500).json({ error: err.message });
-        }
-        res.json(rows);
+const get = (sql, params) => new Promise((resolve, reject) => {
+    db.get(sql, params, (err, row) => {
+        if (err) return reject(err);
+        resolve(row);
+    });
+});
+
+const all = (sql, params) => new Promise((resolve, reject) => {
+    db.all(sql, params, (err, rows) => {
+        if (err) return reject(err);
+        resolve(rows);
     });
+});
+
+// Columns the feed needs; internal bookkeeping (client_ref, asset sizes) stays on the server.
+const LIST_COLUMNS = 'id, status, species, reason, timestamp, lq_crop_path, hq_snapshot_path, hq_video_path, derivatives, camera_id, created_at, updated_at';
+
+// Opaque page cursor: the (timestamp, id) of the last row of the previous page.
+const encodeCursor = (row) => Buffer.from(JSON.stringify([row.timestamp, row.id])).toString('base64url');
+const decodeCursor = (cursor) => {
+    try {
+        const [timestamp, id] = JSON.parse(Buffer.from(cursor, 'base64url').toString());
+        return { timestamp, id };
+    } catch (e) {
+        return null;
+    }
 };
 
-// Phase 1: Create a new sighting (Notify)
-exports.notifySighting = (req, res) => {
-    const { species, reason, timestamp, lq_crop_path, status } = req.body;
+// Sync token: "<updated_at>:<id>" of the last change a client has seen. Ids break ties between
+// changes in the same millisecond; a bare "<updated_at>" from older clients reads as id 0.
+const encodeSyncToken = (change) => `${change.updated_at}:${change.id}`;
+const decodeSyncToken = (token) => {
+    const [time, id] = String(token).split(':');
+    return { time: parseInt(time) || 0, id: parseInt(id) || 0 };
+};
 
-    const sql = `INSERT INTO sightings (status, species, reason, timestamp, lq_crop_path) VALUES (?, ?, ?, ?, ?)`;
+const byChange = (a, b) => (a.updated_at - b.updated_at) || (a.id - b.id);
 
-    db.run(sql, [status || 'recording', species, reason, timestamp, lq_crop_path], function (err) {
-        if (err) {
-            return res.status(500).json({ error: err.message });
-        }
+// Latest change of any kind, as a sync token for clients starting from a full listing.
+const latestSyncToken = async () => {
+    const [row, tombstone] = await Promise.all([
+        get('SELECT updated_at, id FROM sightings ORDER BY updated_at DESC, id DESC LIMIT 1', []),
+        get('SELECT deleted_at AS updated_at, id FROM sighting_tombstones ORDER BY deleted_at DESC, id DESC LIMIT 1', [])
+    ]);
+    const latest = [row, tombstone].filter(Boolean).sort(byChange).pop();
+    return latest ? encodeSyncToken(latest) : '0:0';
+};
+
+/**
+ * Changes after a sync token, oldest first: changed rows plus `{id, deleted: true, updated_at}`
+ * tombstones for deleted sightings.
+ * @param {{time: number, id: number}} since
+ * @param {string} [cameraId]
+ * @param {number} limit
+ * @returns {Promise<object[]>}
+ */
+const changesSince = async (since, cameraId, limit) => {
+    const camera = cameraId ? ' AND camera_id = ?' : '';
+    const cameraParams = cameraId ? [cameraId] : [];
+    const [rows, tombstones] = await Promise.all([
+        all(
+            `SELECT ${LIST_COLUMNS} FROM sightings WHERE (updated_at, id) > (?, ?)${camera} ORDER BY updated_at ASC, id ASC LIMIT ?`,
+            [since.time, since.id, ...cameraParams, limit]
+        ),
+        all(
+            `SELECT id, deleted_at FROM sighting_tombstones WHERE (deleted_at, id) > (?, ?)${camera} ORDER BY deleted_at ASC, id ASC LIMIT ?`,
+            [since.time, since.id, ...cameraParams, limit]
+        )
+    ]);
+    return [...rows, ...tombstones.map(t => ({ id: t.id, deleted: true, updated_at: t.deleted_at }))]
+        .sort(byChange)
+        .slice(0, limit);
+};
 
-        const sightingId = this.lastID;
+// Lists sightings, newest first, optionally for one camera.
+//   ?cursor=<X-Next-Cursor>  next page (keyset over the (timestamp, id) index)
+//   ?since=<X-Sync-Token>    only changes since a previous response, oldest first: created or changed
+//                            rows and {id, deleted: true} tombstones; a full page means there is more.
+//                            410 if the token is older than the kept tombstones.
+// Unchanged data is answered with 304 from the ETag, without touching the database.
+exports.listSightings = async (req, res) => {
+    const tag = sightingEvents.etag();
+    res.set('Cache-Control', 'private, no-cache');
+    res.set('ETag', tag);
+    if (req.get('If-None-Match') === tag) {
+        return res.status(304).end();
+    }
 
-        // Trigger Push Notification
-        const payload = {
-            title: `Bird Detected: ${species}`,
-            body: reason,
-            icon: '/static/icons/bird-icon-192.png',
-            image: `/static/${lq_crop_path}`, // Assumes path is relative to static root or handle accordingly
-            data: {
-                url: `/sighting/${sightingId}`
+    const limit = Math.min(parseInt(req.query.limit) || 20, 500);
+    const cameraId = req.query.camera_id;
+    const where = [];
+    const params = [];
+    if (cameraId) {
+        where.push('camera_id = ?');
+        params.push(cameraId);
+    }
+
+    try {
+        if (req.query.since !== undefined) {
+            const since = decodeSyncToken(req.query.since);
+            const pruned = await get(`SELECT value FROM sync_state WHERE key = 'tombstones_pruned_before'`, []);
+            if (pruned && since.time < pruned.value) {
+                return res.status(410).json({ error: 'Sync token expired, reload the list' });
             }
-        };
-
-        // Send to all subscribers
-        db.all('SELECT * FROM subscriptions', [], (err, subs) => {
-            if (err) return;
-            subs.forEach(sub => {
-                const subscription = {
-                    endpoint: sub.endpoint,
-                    keys: JSON.parse(sub.keys_json)
-                };
-                pushService.sendNotification(subscription, payload);
-            });
-        });
-
-        res.status(201).json({ id: sightingId, message: 'Notification sent' });
-    });
+            const changes = await changesSince(since, cameraId, limit);
+            res.set('X-Sync-Token', changes.length ? encodeSyncToken(changes[changes.length - 1]) : `${since.time}:${since.id}`);
+            return res.json(changes);
+        }
+
+        if (req.query.cursor) {
+            const cursor = decodeCursor(req.query.cursor);
+            if (!cursor) return res.status(400).json({ error: 'Invalid cursor' });
+            where.push('(timestamp, id) < (?, ?)');
+            params.push(cursor.timestamp, cursor.id);
+        }
+        let sql = `SELECT ${LIST_COLUMNS} FROM sightings ${where.length ? 'WHERE ' + where.join(' AND ') : ''} ORDER BY timestamp DESC, id DESC LIMIT ?`;
+        params.push(limit);
+        // OFFSET is kept for older clients; it scans every skipped row.
+        if (!req.query.cursor && req.query.offset) {
+            sql += ' OFFSET ?';
+            params.push(parseInt(req.query.offset) || 0);
+        }
+
+        const rows = await all(sql, params);
+        if (rows.length === limit) res.set('X-Next-Cursor', encodeCursor(rows[rows.length - 1]));
+        res.set('X-Sync-Token', await latestSyncToken());
+        res.json(rows);
+    } catch (err) {
+        res.status(500).json({ error: err.message });
+    }
 };
 
-// Phase 2: Update sighting with HQ assets
-exports.updateSighting = (req, res) => {
-    // Update based on timestamp or ID. Python sends 'original_timestamp'.
-    // Ideally we use ID, but let's use timestamp for now as per Python implementation
+/**
+ * Sends the new-sighting push notification to all subscribers.
+ * @param {number} sightingId
+ * @param {object} fields - species, reason, lq_crop_path, camera_id
+ */
+const notifySubscribers = (sightingId, fields) => {
+    const cameraId = fields.camera_id || 'default';
+    const payload = {
+        title: cameraId === 'default' ? `Bird Detected: ${fields.species}` : `Bird Detected: ${fields.species} (${cameraId})`,
+        body: fields.reason,
+        icon: '/static/icons/bird-icon-192.png',
+        image: `/static/${fields.lq_crop_path}`, // Assumes path is relative to static root or handle accordingly
+        data: {
+            url: `/sighting/${sightingId}`,
+            camera_id: cameraId
+        }
+    };
+
+    // Send to all subscribers (batched, retried and rate-bounded by the dispatcher)
+    pushDispatcher.notify(payload);
+};
+
+/**
+ * Creates a sighting and notifies subscribers.
+ * Idempotent on client_ref: a replayed notify returns the existing sighting and sends no second push.
+ * @param {object} fields - Notify payload from the vision service
+ * @returns {Promise<{id: number, created: boolean}>}
+ */
+const createSighting = async (fields) => {
+    const { species, reason, timestamp, lq_crop_path, status } = fields;
+    const cameraId = fields.camera_id || 'default';
+    const clientRef = fields.client_ref || null;
 
-    // NOTE: Best practice is to return ID from Notify and use it here.
-    // But given python script, we'll try to find the match by timestamp + status recording.
+    if (clientRef) {
+        const existing = await get('SELECT id FROM sightings WHERE client_ref = ?', [clientRef]);
+        if (existing) return { id: existing.id, created: false };
+    }
+
+    const lqBytes = await getAssetBytes([lq_crop_path]);
+    const result = await run(
+        `INSERT INTO sightings (status, species, reason, timestamp, lq_crop_path, camera_id, client_ref, lq_bytes, hq_bytes, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0, ?)`,
+        [status || 'recording', species, reason, timestamp, lq_crop_path, cameraId, clientRef, lqBytes, Date.now()]
+    );
+    notifySubscribers(result.lastID, fields);
+    sightingEvents.publish('created', await get(`SELECT ${LIST_COLUMNS} FROM sightings WHERE id = ?`, [result.lastID]));
+    return { id: result.lastID, created: true };
+};
 
-    const { original_timestamp, status, hq_snapshot_path, hq_video_path } = req.body;
+/**
+ * Applies a Phase 2 update. The sighting is addressed by id (returned from notify), else by
+ * client_ref, else by the legacy original_timestamp + camera_id match on a recording sighting.
+ * @param {object} fields - Update payload from the vision service
+ * @returns {Promise<number>} Number of updated rows
+ */
+const applyUpdate = async (fields) => {
+    const { id, client_ref, original_timestamp, status, hq_snapshot_path, hq_video_path } = fields;
 
-    const sql = `UPDATE sightings SET status = ?, hq_snapshot_path = ?, hq_video_path = ? WHERE timestamp = ? AND status = 'recording'`;
+    let row;
+    if (id) {
+        row = await get('SELECT id FROM sightings WHERE id = ?', [id]);
+    } else if (client_ref) {
+        row = await get('SELECT id FROM sightings WHERE client_ref = ?', [client_ref]);
+    } else {
+        // Two cameras can report at the same moment, so the camera is part of the match.
+        row = await get(
+            `SELECT id FROM sightings WHERE timestamp = ? AND camera_id = ? AND status = 'recording'`,
+            [original_timestamp, fields.camera_id || 'default']
+        );
+    }
+    if (!row) return 0;
 
-    db.run(sql, [status, hq_snapshot_path, hq_video_path, original_timestamp], function (err) {
-        if (err) {
-            return res.status(500).json({ error: err.message });
-        }
-        if (this.changes === 0) {
-            // Fallback: update most recent recording if timestamp mismatch slightly?
-            // For now, strict match.
+    const hqBytes = await getAssetBytes([hq_snapshot_path, hq_video_path]);
+    const result = await run(
+        'UPDATE sightings SET status = ?, hq_snapshot_path = ?, hq_video_path = ?, hq_bytes = ?, updated_at = ? WHERE id = ?',
+        [status, hq_snapshot_path, hq_video_path, hqBytes, Date.now(), row.id]
+    );
+    sightingEvents.publish('updated', await get(`SELECT ${LIST_COLUMNS} FROM sightings WHERE id = ?`, [row.id]));
+    return result.changes;
+};
+
+/**
+ * Stores the feed-sized assets (thumbnails, poster, faststart clip) the vision service made for a sighting.
+ * The clip may have been trimmed in place, so the HQ asset size is measured again.
+ * @param {object} fields - {id | client_ref, manifest}
+ * @returns {Promise<number>} Number of updated rows
+ */
+const applyDerivatives = async ({ id, client_ref, manifest }) => {
+    const row = id
+        ? await get('SELECT id, hq_snapshot_path, hq_video_path FROM sightings WHERE id = ?', [id])
+        : await get('SELECT id, hq_snapshot_path, hq_video_path FROM sightings WHERE client_ref = ?', [client_ref]);
+    if (!row) return 0;
+
+    const files = [
+        ...(manifest.images || []).flatMap(image => [image.webp, image.jpg]),
+        manifest.poster
+    ];
+    const bytes = await getAssetBytes(files);
+    const hqBytes = await getAssetBytes([row.hq_snapshot_path, row.hq_video_path]);
+    const result = await run(
+        'UPDATE sightings SET derivatives = ?, derivative_bytes = ?, hq_bytes = ?, updated_at = ? WHERE id = ?',
+        [JSON.stringify(manifest), bytes, hqBytes, Date.now(), row.id]
+    );
+    sightingEvents.publish('updated', await get(`SELECT ${LIST_COLUMNS} FROM sightings WHERE id = ?`, [row.id]));
+    return result.changes;
+};
+
+/**
+ * Records the new size of a clip the vision service re-encoded in place (storage tiering),
+ * so the disk cleanup does not count bytes that were already freed.
+ * @param {object} fields - {hq_video_path}
+ * @returns {Promise<number>} Number of updated rows
+ */
+const applyResize = async ({ hq_video_path }) => {
+    const rows = await all('SELECT id, hq_snapshot_path FROM sightings WHERE hq_video_path = ?', [hq_video_path]);
+    let changes = 0;
+    for (const row of rows) {
+        const hqBytes = await getAssetBytes([row.hq_snapshot_path, hq_video_path]);
+        changes += (await run('UPDATE sightings SET hq_bytes = ? WHERE id = ?', [hqBytes, row.id])).changes;
+    }
+    return changes;
+};
+
+// Phase 1: Create a new sighting (Notify)
+exports.notifySighting = async (req, res) => {
+    try {
+        const { id, created } = await createSighting(req.body);
+        res.status(created ? 201 : 200).json({ id, message: created ? 'Notification sent' : 'Already recorded' });
+    } catch (err) {
+        res.status(500).json({ error: err.message });
+    }
+};
+
+// Phase 2: Update sighting with HQ assets
+exports.updateSighting = async (req, res) => {
+    try {
+        const changes = await applyUpdate(req.body);
+        if (changes === 0) {
             return res.status(404).json({ message: 'No matching recording found' });
         }
         res.json({ message: 'Sighting updated' });
-    });
+    } catch (err) {
+        res.status(500).json({ error: err.message });
+    }
+};
+
+// Batched Phase 1/Phase 2 (and derivative/resize) events from the vision outbox, applied in order.
+// Each event gets a result: 'ok' (with the sighting id for notify), 'not_found', 'invalid' or 'error'.
+// Processing stops at the first error so the sender retries from there without reordering.
+exports.batchWebhook = async (req, res) => {
+    const events = Array.isArray(req.body.events) ? req.body.events : [];
+    const results = [];
+
+    for (const event of events) {
+        const payload = event.payload || {};
+        try {
+            if (event.type === 'notify') {
+                const { id } = await createSighting({ ...payload, client_ref: event.client_ref });
+                results.push({ seq: event.seq, status: 'ok', id });
+            } else if (event.type === 'update') {
+                const changes = await applyUpdate({ ...payload, id: event.sighting_id, client_ref: event.client_ref });
+                results.push({ seq: event.seq, status: changes > 0 ? 'ok' : 'not_found' });
+            } else if (event.type === 'derivatives') {
+                const changes = await applyDerivatives({ id: event.sighting_id, client_ref: event.client_ref, manifest: payload });
+                results.push({ seq: event.seq, status: changes > 0 ? 'ok' : 'not_found' });
+            } else if (event.type === 'resized') {
+                const changes = await applyResize(payload);
+                results.push({ seq: event.seq, status: changes > 0 ? 'ok' : 'not_found' });
+            } else {
+                results.push({ seq: event.seq, status: 'invalid' });
+            }
+        } catch (err) {
+            console.error('Batch webhook event failed:', err.message);
+            results.push({ seq: event.seq, status: 'error' });
+            break;
+        }
+    }
+
+    res.json({ results });
 };
 
 // Delete sighting
@@ -90,6 +334,10 @@ exports.deleteSighting = (req, res) => {
     // TODO: Also delete files from disk
     db.run('DELETE FROM sightings WHERE id = ?', id, function (err) {
         if (err) return res.status(500).json({ error: err.message });
+        sightingEvents.publish('deleted', { ids: [Number(id)] });
         res.json({ message: 'Deleted' });
     });
 };
+
+// Live feed: 'created', 'updated' and 'deleted' events as Server-Sent Events
+exports.streamSightings = sightingEvents.stream;
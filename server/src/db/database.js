@@ -26,9 +26,62 @@ db.serialize(() => {
     lq_crop_path TEXT,
     hq_snapshot_path TEXT,
     hq_video_path TEXT,
+    camera_id TEXT DEFAULT 'default',
+    client_ref TEXT,
+    lq_bytes INTEGER, -- asset sizes, recorded for disk cleanup
+    hq_bytes INTEGER,
+    updated_at INTEGER, -- ms since epoch of the last change, for ?since= sync
+    derivatives TEXT, -- JSON manifest of feed-sized assets (thumbnails, poster, faststart clip)
+    derivative_bytes INTEGER DEFAULT 0,
     created_at DATETIME DEFAULT CURRENT_TIMESTAMP
   )`);
 
+  // Databases created before multi-camera support lack camera_id; the error on
+  // databases that already have it ("duplicate column name") is expected and ignored.
+  db.run(`ALTER TABLE sightings ADD COLUMN camera_id TEXT DEFAULT 'default'`, () => {});
+  db.run(`CREATE INDEX IF NOT EXISTS idx_sightings_camera ON sightings (camera_id, timestamp)`);
+
+  // client_ref is the vision outbox's reference for a sighting; unique so replayed notifies are no-ops.
+  db.run(`ALTER TABLE sightings ADD COLUMN client_ref TEXT`, () => {});
+  db.run(`CREATE UNIQUE INDEX IF NOT EXISTS idx_sightings_client_ref ON sightings (client_ref)`);
+
+  // Asset sizes let the cleanup pick everything it has to evict in one pass; older rows stay NULL
+  // and are measured on disk when needed.
+  db.run(`ALTER TABLE sightings ADD COLUMN lq_bytes INTEGER`, () => {});
+  db.run(`ALTER TABLE sightings ADD COLUMN hq_bytes INTEGER`, () => {});
+  db.run(`DROP INDEX IF EXISTS idx_sightings_timestamp`);
+  db.run(`CREATE INDEX IF NOT EXISTS idx_sightings_timestamp_id ON sightings (timestamp, id)`);
+
+  // updated_at drives incremental sync; rows from before it existed count as changed when created.
+  db.run(`ALTER TABLE sightings ADD COLUMN updated_at INTEGER`, () => {});
+  db.run(`UPDATE sightings SET updated_at = CAST(strftime('%s', created_at) AS INTEGER) * 1000 WHERE updated_at IS NULL`);
+  // Sync pages are keyed on (updated_at, id), since many rows can share one millisecond.
+  db.run(`DROP INDEX IF EXISTS idx_sightings_updated`);
+  db.run(`CREATE INDEX IF NOT EXISTS idx_sightings_updated_id ON sightings (updated_at, id)`);
+
+  // Tombstones let ?since= sync report deletions. The trigger records every delete, whether
+  // it comes from the API or the disk cleanup; the cleanup also prunes old tombstones.
+  db.run(`CREATE TABLE IF NOT EXISTS sighting_tombstones (
+    id INTEGER PRIMARY KEY, -- id of the deleted sighting (AUTOINCREMENT ids are never reused)
+    camera_id TEXT,
+    deleted_at INTEGER -- ms since epoch, on the same clock as updated_at
+  )`);
+  db.run(`CREATE INDEX IF NOT EXISTS idx_sighting_tombstones_deleted ON sighting_tombstones (deleted_at, id)`);
+  // Sync tokens older than 'tombstones_pruned_before' may have missed deletions.
+  db.run(`CREATE TABLE IF NOT EXISTS sync_state (
+    key TEXT PRIMARY KEY,
+    value INTEGER
+  )`);
+  db.run(`CREATE TRIGGER IF NOT EXISTS sightings_tombstone AFTER DELETE ON sightings BEGIN
+    INSERT OR REPLACE INTO sighting_tombstones (id, camera_id, deleted_at)
+    VALUES (OLD.id, OLD.camera_id, CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER));
+  END`);
+
+  db.run(`ALTER TABLE sightings ADD COLUMN derivatives TEXT`, () => {});
+  db.run(`ALTER TABLE sightings ADD COLUMN derivative_bytes INTEGER DEFAULT 0`, () => {});
+  // Tiered clips are reported by path, since they outlive the vision service's client_refs.
+  db.run(`CREATE INDEX IF NOT EXISTS idx_sightings_hq_video ON sightings (hq_video_path)`);
+
   // Users Table (for session auth)
   db.run(`CREATE TABLE IF NOT EXISTS users (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -8,6 +8,7 @@ const router = express.Router();
 const sightingController = require('../controllers/sightingController');
 const authController = require('../controllers/authController');
 const db = require('../db/database');
+const pushDispatcher = require('../services/pushDispatcher');
 
 // Auth Middleware
 const requireAuth = (req, res, next) => {
@@ -30,12 +31,14 @@ router.post('/auth/register', authController.register); // Unprotected for setup
 
 // Sightings
 router.get('/sightings', requireAuth, sightingController.listSightings);
+router.get('/sightings/stream', requireAuth, sightingController.streamSightings);
 router.delete('/sightings/:id', requireAuth, sightingController.deleteSighting);
 
 // Webhooks (From Python - Protected by shared secret or just obscure port/network for now)
 // Ideally verify a secret header.
 router.post('/webhook/notify', sightingController.notifySighting);
 router.post('/webhook/update', sightingController.updateSighting);
+router.post('/webhook/batch', sightingController.batchWebhook);
 
 // Push Subscription
 router.post('/subscribe', (req, res) => {
@@ -44,6 +47,7 @@ router.post('/subscribe', (req, res) => {
         [subscription.endpoint, JSON.stringify(subscription.keys)],
         (err) => {
             if (err) return res.status(500).json({ error: err.message });
+            pushDispatcher.invalidate();
             res.status(201).json({});
         }
     );
@@ -5,9 +5,9 @@
 
 const fs = require('fs');
 const path = require('path');
-const { execSync } = require('child_process');
 const yaml = require('js-yaml');
 const db = require('../db/database');
+const sightingEvents = require('./sightingEvents');
 
 // Load configuration
 const configPath = path.resolve(__dirname, '../../../config/settings.yaml');
@@ -20,101 +20,214 @@ try {
     console.error('Failed to load settings.yaml in CleanupService:', e.message);
 }
 
+// Root the vision service writes assets to and app.js serves as /static.
+const staticRoot = path.join(__dirname, '../../../static');
+
+const run = (sql, params = []) => new Promise((resolve, reject) => {
+    db.run(sql, params, function (err) {
+        if (err) return reject(err);
+        resolve(this);
+    });
+});
+
+const all = (sql, params = []) => new Promise((resolve, reject) => {
+    db.all(sql, params, (err, rows) => {
+        if (err) return reject(err);
+        resolve(rows);
+    });
+});
+
 /**
- * Gets the current disk usage percentage of the filesystem containing the static folder.
- * @returns {number} Percentage (0-100)
+ * Reads the usage of the filesystem containing the static folder.
+ * Uses statfs instead of spawning `df`, so it is cheap enough to call per cleanup run.
+ * @returns {Promise<{percent: number, used: number, total: number}|null>} Bytes used and usable (used + available to us)
  */
-const getDiskUsage = () => {
+const getDiskUsage = async () => {
     try {
-        const statsPath = path.join(__dirname, '../../static');
-        // Ensure path exists for df
-        if (!fs.existsSync(statsPath)) fs.mkdirSync(statsPath, { recursive: true });
-
-        // Run df -k to get usage in kilobytes. Works on Mac and Linux.
-        const output = execSync(`df -k "${statsPath}"`).toString();
-        const lines = output.trim().split('\n');
-        if (lines.length < 2) return 0;
-
-        // Match the percentage (e.g., 45%)
-        const match = lines[1].match(/(\d+)%/);
-        return match ? parseInt(match[1], 10) : 0;
+        await fs.promises.mkdir(staticRoot, { recursive: true });
+        const stats = await fs.promises.statfs(staticRoot);
+        // Same definition as df: blocks reserved for root count neither as used nor as available.
+        const used = (stats.blocks - stats.bfree) * stats.bsize;
+        const total = used + stats.bavail * stats.bsize;
+        return { percent: total ? (100 * used) / total : 0, used, total };
     } catch (e) {
         console.error('Disk usage check failed:', e.message);
-        return 0;
+        return null;
     }
 };
 
 /**
- * Deletes a sighting and its associated files.
- * @param {object} sighting 
+ * Sums the on-disk size of asset files (paths relative to the static root). Missing files count as 0.
+ * @param {string[]} files
+ * @returns {Promise<number>} Bytes
+ */
+const getAssetBytes = async (files) => {
+    const sizes = await Promise.all(files.filter(Boolean).map(file =>
+        fs.promises.stat(path.join(staticRoot, file)).then(stat => stat.size, () => 0)
+    ));
+    return sizes.reduce((sum, size) => sum + size, 0);
+};
+
+/**
+ * All files belonging to a sighting: originals plus derivatives (thumbnails, poster).
+ * @param {object} sighting
+ * @returns {string[]} Paths relative to the static root
  */
-const deleteSightingAssets = (sighting) => {
-    const files = [
+const assetFiles = (sighting) => {
+    let derivatives = {};
+    try {
+        derivatives = JSON.parse(sighting.derivatives || '{}');
+    } catch (e) {
+        console.error(`Invalid derivatives manifest for sighting ${sighting.id}`);
+    }
+    return [
         sighting.lq_crop_path,
         sighting.hq_snapshot_path,
-        sighting.hq_video_path
-    ];
-
-    files.forEach(file => {
-        if (file) {
-            const fullPath = path.join(__dirname, '../../static', file);
-            if (fs.existsSync(fullPath)) {
-                try {
-                    fs.unlinkSync(fullPath);
-                    console.log(`Deleted: ${fullPath}`);
-                } catch (err) {
-                    console.error(`Failed to delete file ${fullPath}:`, err.message);
-                }
+        sighting.hq_video_path,
+        ...(derivatives.images || []).flatMap(image => [image.webp, image.jpg]),
+        derivatives.poster
+    ].filter(Boolean);
+};
+
+/**
+ * Bytes held by a sighting. Uses the sizes recorded at notify/update time; rows from before
+ * sizes were recorded are measured on disk.
+ * @param {object} sighting
+ * @returns {Promise<number>}
+ */
+const sightingBytes = async (sighting) => {
+    if (sighting.lq_bytes !== null && sighting.hq_bytes !== null) {
+        return sighting.lq_bytes + sighting.hq_bytes + (sighting.derivative_bytes || 0);
+    }
+    return getAssetBytes(assetFiles(sighting));
+};
+
+/**
+ * Walks sightings from the oldest (via the timestamp index) until their assets add up to `bytesToFree`.
+ * Sightings still recording are skipped: their clip is being written and their sizes are not final.
+ * @param {number} bytesToFree
+ * @returns {Promise<{sightings: object[], bytes: number}>}
+ */
+const selectEvictionSet = async (bytesToFree) => {
+    const pageSize = config.CLEANUP_SCAN_BATCH || 200;
+    const selected = [];
+    let bytes = 0;
+    let cursor = null;
+
+    while (bytes < bytesToFree) {
+        // Keyset pagination on (timestamp, id) keeps every page an index range scan.
+        const rows = cursor
+            ? await all(
+                `SELECT id, timestamp, lq_crop_path, hq_snapshot_path, hq_video_path, derivatives, lq_bytes, hq_bytes, derivative_bytes FROM sightings
+                 WHERE (timestamp, id) > (?, ?) AND status != 'recording' ORDER BY timestamp ASC, id ASC LIMIT ?`,
+                [cursor.timestamp, cursor.id, pageSize])
+            : await all(
+                `SELECT id, timestamp, lq_crop_path, hq_snapshot_path, hq_video_path, derivatives, lq_bytes, hq_bytes, derivative_bytes FROM sightings
+                 WHERE status != 'recording' ORDER BY timestamp ASC, id ASC LIMIT ?`,
+                [pageSize]);
+        if (rows.length === 0) break;
+
+        for (const row of rows) {
+            selected.push(row);
+            bytes += await sightingBytes(row);
+            if (bytes >= bytesToFree) break;
+        }
+        cursor = rows[rows.length - 1];
+    }
+    return { sightings: selected, bytes };
+};
+
+/**
+ * Deletes the DB records of the given sightings in a single statement, so it is atomic without
+ * opening a transaction on the connection the request handlers share.
+ * @param {number[]} ids
+ */
+const deleteRecords = async (ids) => {
+    // One JSON array parameter instead of one per id keeps clear of SQLite's bound-parameter limit.
+    await run('DELETE FROM sightings WHERE id IN (SELECT value FROM json_each(?))', [JSON.stringify(ids)]);
+};
+
+/**
+ * Unlinks the asset files of the given sightings, at most `concurrency` at a time.
+ * @param {object[]} sightings
+ * @param {number} concurrency
+ */
+const deleteSightingAssets = async (sightings, concurrency) => {
+    const files = sightings
+        .flatMap(assetFiles)
+        .map(file => path.join(staticRoot, file));
+
+    let next = 0;
+    const worker = async () => {
+        while (next < files.length) {
+            const fullPath = files[next++];
+            try {
+                await fs.promises.unlink(fullPath);
+            } catch (err) {
+                if (err.code !== 'ENOENT') console.error(`Failed to delete file ${fullPath}:`, err.message);
             }
         }
-    });
+    };
+    await Promise.all(Array.from({ length: Math.min(concurrency, files.length) }, worker));
+};
+
+/**
+ * Drops tombstones of sightings deleted longer ago than SYNC_TOMBSTONE_DAYS and records the cutoff,
+ * so ?since= can tell clients with an older sync token to reload instead of missing deletions.
+ */
+const pruneTombstones = async () => {
+    const cutoff = Date.now() - (config.SYNC_TOMBSTONE_DAYS || 30) * 24 * 60 * 60 * 1000;
+    try {
+        const { changes } = await run('DELETE FROM sighting_tombstones WHERE deleted_at < ?', [cutoff]);
+        if (changes > 0) {
+            await run(`INSERT OR REPLACE INTO sync_state (key, value) VALUES ('tombstones_pruned_before', ?)`, [cutoff]);
+        }
+    } catch (err) {
+        console.error('Tombstone pruning failed:', err.message);
+    }
 };
 
+let cleanupRunning = false;
+
 /**
- * Performs iterative cleanup of the oldest sightings until disk usage is below threshold.
+ * Frees enough space to get back below the threshold in one pass: computes the bytes to free,
+ * picks the oldest sightings covering them, deletes their records and then their files.
  */
 const runCleanup = async () => {
-    const threshold = config.MAX_DISK_USAGE_PERCENT || 85;
-    let currentUsage = getDiskUsage();
+    if (cleanupRunning) return;
+    cleanupRunning = true;
+    try {
+        await pruneTombstones();
+        const threshold = config.MAX_DISK_USAGE_PERCENT || 85;
+        const usage = await getDiskUsage();
+        if (!usage) return;
 
-    console.log(`Checking disk usage: ${currentUsage}% (Threshold: ${threshold}%)`);
+        console.log(`Checking disk usage: ${usage.percent.toFixed(1)}% (Threshold: ${threshold}%)`);
+        if (usage.percent <= threshold) return;
 
-    if (currentUsage > threshold) {
-        console.log('Starting cleanup due to high disk usage:', { currentUsage, threshold });
-    }
+        const bytesToFree = usage.used - (threshold / 100) * usage.total;
+        console.log('Starting cleanup due to high disk usage:', { currentUsage: usage.percent, threshold, bytesToFree });
 
-    while (currentUsage > threshold) {
-        // Get the oldest sighting
-        const oldestSighting = await new Promise((resolve) => {
-            db.get('SELECT * FROM sightings ORDER BY timestamp ASC LIMIT 1', (err, row) => {
-                if (err) {
-                    console.error('DB error during cleanup:', err.message);
-                    resolve(null);
-                }
-                resolve(row);
-            });
-        });
-
-        if (!oldestSighting) {
+        const { sightings, bytes } = await selectEvictionSet(bytesToFree);
+        if (sightings.length === 0) {
             console.warn('Disk full but no sightings found to delete.');
-            break;
+            return;
         }
 
-        console.log(`Purging oldest sighting: ${oldestSighting.species} (${oldestSighting.timestamp})`);
-
-        // 1. Delete Files
-        deleteSightingAssets(oldestSighting);
+        // Records first: a failed unlink leaves an orphaned file, never a sighting pointing at nothing.
+        await deleteRecords(sightings.map(s => s.id));
+        sightingEvents.publish('deleted', { ids: sightings.map(s => s.id) });
+        await deleteSightingAssets(sightings, config.CLEANUP_DELETE_CONCURRENCY || 8);
 
-        // 2. Delete DB record
-        await new Promise((resolve) => {
-            db.run('DELETE FROM sightings WHERE id = ?', [oldestSighting.id], (err) => {
-                if (err) console.error('Failed to delete DB record:', err.message);
-                resolve();
-            });
-        });
-
-        // Re-check usage
-        currentUsage = getDiskUsage();
+        const newest = sightings[sightings.length - 1];
+        console.log(`Purged ${sightings.length} sightings (${(bytes / 1048576).toFixed(1)} MB) up to ${newest.timestamp}`);
+        if (bytes < bytesToFree) {
+            console.warn('All sightings purged but disk usage is still above the threshold.');
+        }
+    } catch (err) {
+        console.error('Cleanup failed:', err.message);
+    } finally {
+        cleanupRunning = false;
     }
 };
 
@@ -129,4 +242,4 @@ const start = () => {
     setInterval(runCleanup, intervalHours * 60 * 60 * 1000);
 };
 
-module.exports = { start };
+module.exports = { start, getAssetBytes };
@@ -0,0 +1,191 @@
+/**
+ * @module PushDispatcher
+ * @description Fans push notifications out to all subscribers with bounded concurrency, retries,
+ * pruning of expired subscriptions and collapsing of bursts.
+ */
+
+const fs = require('fs');
+const path = require('path');
+const yaml = require('js-yaml');
+const db = require('../db/database');
+const pushService = require('./pushService');
+
+// Load configuration
+const configPath = path.resolve(__dirname, '../../../config/settings.yaml');
+let settings = {};
+
+try {
+    settings = yaml.load(fs.readFileSync(configPath, 'utf8')) || {};
+} catch (e) {
+    console.error('Failed to load settings.yaml in PushDispatcher:', e.message);
+}
+
+const sleep = (ms) => new Promise(resolve => setTimeout(resolve, ms));
+
+/**
+ * Creates a dispatcher. The app uses the default instance exported below; a custom `send`
+ * (or subscriptions pointing at a local stub endpoint) makes it testable without a push service.
+ * @param {object} [options]
+ * @param {function} [options.send] - (subscription, body, options) => Promise; rejects with {statusCode, headers}
+ * @param {object} [options.config] - settings.yaml values
+ */
+const createDispatcher = ({ send = pushService.send, config = settings } = {}) => {
+    const concurrency = config.PUSH_CONCURRENCY || 4;
+    const maxRetries = config.PUSH_MAX_RETRIES ?? 3;
+    const retryBaseMs = (config.PUSH_RETRY_BASE_SECONDS || 1) * 1000;
+    const collapseMs = (config.PUSH_COLLAPSE_SECONDS ?? 5) * 1000;
+    const pushOptions = {
+        TTL: config.PUSH_TTL_SECONDS || 3600,
+        urgency: config.PUSH_URGENCY || 'normal'
+    };
+
+    let subscriptions = null;
+    let pending = [];
+    let collapseTimer = null;
+    const jobs = [];
+    let active = 0;
+
+    /**
+     * Parsed subscriptions, read from the DB once and cached until `invalidate()`.
+     * @returns {Promise<object[]>}
+     */
+    const loadSubscriptions = () => {
+        if (!subscriptions) {
+            const loading = new Promise((resolve, reject) => {
+                db.all('SELECT endpoint, keys_json FROM subscriptions', [], (err, rows) => {
+                    if (err) return reject(err);
+                    resolve(rows.map(row => ({ endpoint: row.endpoint, keys: JSON.parse(row.keys_json) })));
+                });
+            });
+            subscriptions = loading;
+            // Do not cache a failed read, but leave a newer load started after an invalidate() alone.
+            loading.catch(() => {
+                if (subscriptions === loading) subscriptions = null;
+            });
+        }
+        return subscriptions;
+    };
+
+    /** Drops the cached subscription list; call after subscriptions change. */
+    const invalidate = () => {
+        subscriptions = null;
+    };
+
+    /**
+     * Removes a subscription the push service reports as gone (404/410).
+     * @param {string} endpoint
+     */
+    const removeSubscription = (endpoint) => {
+        invalidate();
+        db.run('DELETE FROM subscriptions WHERE endpoint = ?', [endpoint], (err) => {
+            if (err) console.error('Failed to delete expired subscription:', err.message);
+            else console.log(`Removed expired push subscription: ${endpoint}`);
+        });
+    };
+
+    /**
+     * Delivers one message to one endpoint, retrying rate limits and server errors.
+     * @param {object} subscription
+     * @param {string} body
+     */
+    const deliver = async (subscription, body) => {
+        for (let attempt = 0; ; attempt++) {
+            try {
+                await send(subscription, body, pushOptions);
+                return;
+            } catch (err) {
+                const status = err.statusCode;
+                if (status === 404 || status === 410) {
+                    removeSubscription(subscription.endpoint);
+                    return;
+                }
+                const retryable = status === 429 || status >= 500 || status === undefined;
+                if (!retryable || attempt >= maxRetries) {
+                    console.error(`Push to ${subscription.endpoint} failed (${status || err.message})`);
+                    return;
+                }
+                // Honour Retry-After (seconds) when the push service sends one.
+                const retryAfter = parseInt(err.headers && err.headers['retry-after'], 10);
+                const delay = retryAfter > 0
+                    ? retryAfter * 1000
+                    : retryBaseMs * (2 ** attempt) * (0.5 + Math.random());
+                await sleep(delay);
+            }
+        }
+    };
+
+    /** Starts queued deliveries up to the concurrency limit. */
+    const pump = () => {
+        while (active < concurrency && jobs.length > 0) {
+            const { subscription, body } = jobs.shift();
+            active++;
+            deliver(subscription, body).finally(() => {
+                active--;
+                pump();
+            });
+        }
+    };
+
+    /**
+     * Builds the payload for everything collected during one collapse window.
+     * @param {object[]} payloads
+     * @returns {object}
+     */
+    const collapse = (payloads) => {
+        if (payloads.length === 1) return payloads[0];
+        const latest = payloads[payloads.length - 1];
+        return {
+            ...latest,
+            title: `${payloads.length} Bird Sightings`,
+            body: payloads.map(p => p.title.replace(/^Bird Detected: /, '')).join(', '),
+            data: { ...latest.data, url: '/' }
+        };
+    };
+
+    /** Sends the collected payloads now, as one notification to every subscriber. */
+    const flush = async () => {
+        const payloads = pending;
+        pending = [];
+        if (payloads.length === 0) return;
+
+        let subs;
+        try {
+            subs = await loadSubscriptions();
+        } catch (err) {
+            console.error('Failed to load push subscriptions:', err.message);
+            return;
+        }
+        // Serialized once, not per subscriber.
+        const body = JSON.stringify(collapse(payloads));
+        subs.forEach(subscription => jobs.push({ subscription, body }));
+        pump();
+    };
+
+    /**
+     * Ends a collapse window: sends what arrived during it as one notification and, if anything
+     * did, opens the next window so a continuing burst stays at one notification per window.
+     */
+    const closeWindow = () => {
+        collapseTimer = null;
+        if (pending.length === 0) return;
+        collapseTimer = setTimeout(closeWindow, collapseMs);
+        flush();
+    };
+
+    /**
+     * Sends a notification to all subscribers. The first one goes out immediately; the ones
+     * following it within PUSH_COLLAPSE_SECONDS are collapsed into one sent when the window ends.
+     * @param {object} payload - {title, body, icon, image, data}
+     */
+    const notify = (payload) => {
+        pending.push(payload);
+        if (collapseMs === 0) return flush();
+        if (collapseTimer) return;
+        collapseTimer = setTimeout(closeWindow, collapseMs);
+        return flush();
+    };
+
+    return { notify, invalidate, flush, stats: () => ({ queued: jobs.length, active }) };
+};
+
+module.exports = { createDispatcher, ...createDispatcher() };
@@ -23,6 +23,14 @@ if (vapidPublicKey && vapidPrivateKey) {
     console.warn('VAPID keys not set. Push notifications will not work.');
 }
 
+/**
+ * Sends one push message and lets failures propagate (WebPushError carries `statusCode` and `headers`).
+ * @param {object} subscription - {endpoint, keys}
+ * @param {string} body - Serialized payload
+ * @param {object} options - web-push options (TTL, urgency, topic)
+ */
+const send = (subscription, body, options) => webpush.sendNotification(subscription, body, options);
+
 const sendNotification = async (subscription, payload) => {
     try {
         await webpush.sendNotification(subscription, JSON.stringify(payload));
@@ -34,6 +42,7 @@ const sendNotification = async (subscription, payload) => {
 };
 
 module.exports = {
+    send,
     sendNotification,
     vapidPublicKey
 };
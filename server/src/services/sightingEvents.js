@@ -0,0 +1,55 @@
+/**
+ * @module SightingEvents
+ * @description Tracks a change version for the sightings table (for ETags) and streams sighting
+ * changes to connected clients as Server-Sent Events.
+ */
+
+const crypto = require('crypto');
+
+// Distinguishes versions across restarts, so a client's ETag from a previous run never matches.
+const bootId = crypto.randomBytes(4).toString('hex');
+let version = 0;
+const clients = new Set();
+
+/**
+ * ETag for any sightings listing at the current version. Every write goes through `publish`,
+ * so an unchanged version means unchanged data and the listing can be answered with a 304.
+ * @returns {string}
+ */
+const etag = () => `W/"${bootId}-${version}"`;
+
+/**
+ * Records a change and sends it to every connected client.
+ * @param {string} type - 'created', 'updated' or 'deleted'
+ * @param {object} data - The sighting row, or {ids} for deletions
+ */
+const publish = (type, data) => {
+    version++;
+    const message = `id: ${version}\nevent: ${type}\ndata: ${JSON.stringify(data)}\n\n`;
+    clients.forEach(res => res.write(message));
+};
+
+/**
+ * Express handler holding an SSE connection open until the client goes away.
+ */
+const stream = (req, res) => {
+    res.set({
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        Connection: 'keep-alive',
+        // Keep reverse proxies from buffering the stream.
+        'X-Accel-Buffering': 'no'
+    });
+    res.flushHeaders();
+    res.write('retry: 5000\n\n');
+    clients.add(res);
+
+    // Comment lines keep idle connections from being closed by proxies and NAT.
+    const heartbeat = setInterval(() => res.write(': ping\n\n'), 25000);
+    req.on('close', () => {
+        clearInterval(heartbeat);
+        clients.delete(res);
+    });
+};
+
+module.exports = { etag, publish, stream };
@@ -0,0 +1,158 @@
+# -----------------------------------------------------------------------------
+# Module: AnalysisCache
+# Purpose: Remembers Gemini verdicts for near-identical crops using a perceptual hash of the crop and its region.
+# -----------------------------------------------------------------------------
+
+import time
+import threading
+from collections import OrderedDict
+import cv2
+import numpy as np
+
+def dhash(image):
+    """
+    Computes a 64-bit difference hash (dHash) of an image.
+
+    The image is shrunk to 9x8 grayscale and each bit records whether a pixel is
+    brighter than its right neighbour, so the hash survives compression noise,
+    small shifts and exposure changes but not a different subject.
+
+    Args:
+        image (numpy.ndarray): BGR or grayscale image.
+
+    Returns:
+        int: The 64-bit hash.
+    """
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = small[:, 1:] > small[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+class CacheEntry:
+    """
+    A cached verdict for one crop.
+    """
+
+    def __init__(self, crop_hash, cell, verdict, expires_at):
+        """
+        Initialize the CacheEntry.
+
+        Args:
+            crop_hash (int): dHash of the crop.
+            cell (tuple): (camera_id, column, row) of the crop's bounding box centre.
+            verdict (dict): The Gemini analysis result.
+            expires_at (float): `time.monotonic()` value after which the entry is ignored.
+        """
+        self.crop_hash = crop_hash
+        self.cell = cell
+        self.verdict = verdict
+        self.expires_at = expires_at
+
+
+class AnalysisCache:
+    """
+    LRU + TTL cache of analysis verdicts keyed by perceptual hash and frame region.
+
+    A lookup matches an entry from the same camera whose hash is within
+    `ANALYSIS_CACHE_MAX_DISTANCE` bits (Hamming distance) and whose region is the same
+    or an adjacent grid cell. Negative
+    verdicts are kept longer, since a swaying branch stays where it is.
+    """
+
+    def __init__(self, config):
+        """
+        Initialize the AnalysisCache.
+
+        Args:
+            config (dict): Configuration dictionary loaded from settings.yaml.
+        """
+        self.capacity = config.get('ANALYSIS_CACHE_SIZE', 256)
+        self.ttl = config.get('ANALYSIS_CACHE_TTL_SECONDS', 600)
+        self.negative_ttl = config.get('ANALYSIS_CACHE_NEGATIVE_TTL_SECONDS', 1800)
+        self.max_distance = config.get('ANALYSIS_CACHE_MAX_DISTANCE', 6)
+        self.grid = config.get('ANALYSIS_CACHE_REGION_GRID', 80)
+        self.entries = OrderedDict()
+        self.next_id = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def key(self, crop, bounds, camera_id=None):
+        """
+        Computes the cache key of a crop.
+
+        Args:
+            crop (numpy.ndarray): The crop.
+            bounds (tuple): (x, y, w, h) of the motion in the frame.
+            camera_id (str, optional): Camera the crop came from; verdicts never cross cameras.
+
+        Returns:
+            tuple: (crop_hash (int), cell (tuple of camera_id, column, row))
+        """
+        x, y, w, h = bounds
+        cell = (camera_id, (x + w // 2) // self.grid, (y + h // 2) // self.grid)
+        return dhash(crop), cell
+
+    def lookup(self, key):
+        """
+        Returns the verdict of the closest unexpired near-duplicate, if any.
+
+        Args:
+            key (tuple): As returned by `key()`.
+
+        Returns:
+            dict or None: A copy of the cached verdict, or None on a miss.
+        """
+        crop_hash, (camera_id, cx, cy) = key
+        now = time.monotonic()
+        with self.lock:
+            best_id, best_distance = None, self.max_distance + 1
+            for entry_id, entry in list(self.entries.items()):
+                if entry.expires_at <= now:
+                    del self.entries[entry_id]
+                    continue
+                if entry.cell[0] != camera_id or abs(entry.cell[1] - cx) > 1 or abs(entry.cell[2] - cy) > 1:
+                    continue
+                distance = bin(entry.crop_hash ^ crop_hash).count('1')
+                if distance < best_distance:
+                    best_id, best_distance = entry_id, distance
+
+            if best_id is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(best_id)
+            return dict(self.entries[best_id].verdict)
+
+    def store(self, key, verdict):
+        """
+        Caches a verdict, evicting the least recently used entry if full.
+
+        Args:
+            key (tuple): As returned by `key()`.
+            verdict (dict): The Gemini analysis result. Failed (None) results are not cached.
+        """
+        if not verdict:
+            return
+        crop_hash, cell = key
+        ttl = self.ttl if verdict.get('is_bird') else self.negative_ttl
+        with self.lock:
+            self.entries[self.next_id] = CacheEntry(crop_hash, cell, dict(verdict), time.monotonic() + ttl)
+            self.next_id += 1
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        """
+        Returns:
+            dict: Hit/miss counters, hit rate and current size.
+        """
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'size': len(self.entries)
+            }
@@ -0,0 +1,309 @@
+# -----------------------------------------------------------------------------
+# Module: AnalysisPipeline
+# Purpose: Decouples motion detection from Gemini calls with a bounded queue, worker pool and rate limiter.
+# -----------------------------------------------------------------------------
+
+import time
+import logging
+import threading
+from collections import deque, OrderedDict
+
+from metrics import metrics
+
+class TokenBucket:
+    """
+    Thread-safe token bucket rate limiter.
+    """
+
+    def __init__(self, rate, capacity):
+        """
+        Initialize the TokenBucket.
+
+        Args:
+            rate (float): Tokens added per second.
+            capacity (int): Maximum number of stored tokens (burst size).
+        """
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        """Adds the tokens accrued since the last update. Caller must hold the lock."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, timeout=None):
+        """
+        Takes one token, waiting for a refill if necessary.
+
+        Args:
+            timeout (float, optional): Maximum seconds to wait. None waits indefinitely.
+
+        Returns:
+            bool: True if a token was taken, False on timeout.
+        """
+        give_up = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+            if give_up is not None:
+                if now + wait > give_up:
+                    return False
+            time.sleep(wait)
+
+
+class Candidate:
+    """
+    A motion crop waiting to be analyzed.
+    """
+
+    def __init__(self, crops, bounds, detected_at, context, camera_id=None):
+        """
+        Initialize the Candidate.
+
+        Args:
+            crops (list): LQ crops of the subject, best first (one, or the pick of a burst).
+            bounds (tuple): (x, y, w, h) of the motion in the LQ frame.
+            detected_at (float): Unix time of the motion trigger.
+            context (dict): Location/time metadata for the prompt.
+            camera_id (str, optional): Camera the crops came from.
+        """
+        self.crops = crops
+        self.bounds = bounds
+        self.detected_at = detected_at
+        self.context = context
+        self.camera_id = camera_id
+        self.queued_at = time.monotonic()
+        self.cached = False
+
+    @property
+    def crop(self):
+        """
+        Returns:
+            numpy.ndarray: The best crop, used for caching, pre-filtering and the sighting preview.
+        """
+        return self.crops[0]
+
+
+class AnalysisPipeline:
+    """
+    Runs Gemini analysis off the capture thread.
+
+    Detection pushes candidates into a small bounded queue per camera. When a camera's
+    queue is full its oldest candidate is evicted, and workers drop candidates that are
+    older than `ANALYSIS_MAX_AGE_SECONDS` instead of analyzing a moment that has already
+    passed. Workers serve the cameras round-robin under one shared rate limit, so a busy
+    feeder cannot starve a quiet one.
+    """
+
+    def __init__(self, gemini_client, config, on_result, on_discard=None, cache=None, prefilter=None):
+        """
+        Initialize the AnalysisPipeline.
+
+        Args:
+            gemini_client (GeminiClient): Client used for the analysis calls.
+            config (dict): Configuration dictionary loaded from settings.yaml.
+            on_result (callable): Called as on_result(candidate, analysis) from a worker thread.
+                `analysis` is None if the call failed.
+            on_discard (callable, optional): Called as on_discard(candidate) for candidates
+                that are evicted or expire without being analyzed.
+            cache (AnalysisCache, optional): Verdict cache consulted before calling Gemini.
+            prefilter (PreFilter, optional): Local classifier that must pass a crop before Gemini sees it.
+        """
+        self.gemini_client = gemini_client
+        self.cache = cache
+        self.prefilter = prefilter
+        self.on_result = on_result
+        self.on_discard = on_discard
+        self.max_age = config.get('ANALYSIS_MAX_AGE_SECONDS', 8)
+        self.num_workers = config.get('ANALYSIS_WORKERS', 2)
+
+        # The old global analysis cooldown becomes the bucket refill interval.
+        interval = config.get('ANALYSIS_COOLDOWN_SECONDS', config.get('API_COOLDOWN_SECONDS', 30))
+        self.rate_limiter = TokenBucket(1.0 / max(interval, 0.001), config.get('ANALYSIS_BURST', 1))
+
+        self.queue_size = max(1, config.get('ANALYSIS_QUEUE_SIZE', 2))
+        # camera_id -> deque; the order doubles as the round-robin position.
+        self.queues = OrderedDict()
+        self.pending = 0
+        self.cond = threading.Condition()
+        self.stop_event = threading.Event()
+        self.workers = []
+        self.stats = {'submitted': 0, 'evicted': 0, 'expired': 0, 'analyzed': 0, 'cached': 0, 'prefiltered': 0, 'gemini_seconds': 0.0}
+        self.logger = logging.getLogger(__name__)
+        metrics.register_gauge('analysis.queue_depth', self.depth)
+
+    def start(self):
+        """Starts the worker threads."""
+        for i in range(self.num_workers):
+            worker = threading.Thread(target=self._worker, name=f"AnalysisWorker-{i}", daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def stop(self):
+        """Stops the workers after their current call and discards anything still queued."""
+        self.stop_event.set()
+        with self.cond:
+            self.cond.notify_all()
+        for worker in self.workers:
+            worker.join(timeout=1)
+        self.clear()
+
+    def submit(self, candidate):
+        """
+        Queues a candidate without blocking.
+
+        Args:
+            candidate (Candidate): The candidate to analyze.
+        """
+        evicted = None
+        with self.cond:
+            queue = self.queues.get(candidate.camera_id)
+            if queue is None:
+                queue = self.queues[candidate.camera_id] = deque()
+            if len(queue) >= self.queue_size:
+                evicted = queue.popleft()
+                self.pending -= 1
+                self.stats['evicted'] += 1
+            queue.append(candidate)
+            self.pending += 1
+            self.stats['submitted'] += 1
+            self.cond.notify()
+        metrics.incr('analysis.submitted')
+        if evicted is not None:
+            metrics.incr('analysis.evicted')
+            self._discard(evicted)
+
+    def clear(self, camera_id=None):
+        """
+        Discards queued candidates, e.g. once a sighting has been confirmed.
+
+        Args:
+            camera_id (str, optional): Only clear this camera's queue; all queues if None.
+        """
+        with self.cond:
+            queues = self.queues.values() if camera_id is None else [self.queues.get(camera_id, deque())]
+            pending = []
+            for queue in queues:
+                pending.extend(queue)
+                queue.clear()
+            self.pending -= len(pending)
+        for candidate in pending:
+            self._discard(candidate)
+
+    def depth(self):
+        """
+        Returns:
+            int: Number of queued candidates across all cameras.
+        """
+        with self.cond:
+            return self.pending
+
+    def _pop_next(self):
+        """
+        Takes the oldest candidate of the next camera in round-robin order.
+        Must be called with `cond` held and at least one candidate pending.
+
+        Returns:
+            Candidate: The candidate.
+        """
+        while True:
+            camera_id, queue = next(iter(self.queues.items()))
+            self.queues.move_to_end(camera_id)
+            if queue:
+                self.pending -= 1
+                return queue.popleft()
+
+    def summary(self):
+        """
+        Summarizes where candidates went and what each stage cost.
+
+        Returns:
+            dict: Pipeline counters, mean Gemini latency, and pre-filter/cache stats if enabled.
+        """
+        with self.cond:
+            summary = dict(self.stats)
+        summary['gemini_mean_latency_ms'] = 1000 * summary['gemini_seconds'] / summary['analyzed'] if summary['analyzed'] else 0.0
+        if self.prefilter is not None:
+            summary['prefilter'] = self.prefilter.stats()
+        if self.cache is not None:
+            summary['cache'] = self.cache.stats()
+        return summary
+
+    def _count(self, key):
+        """Increments a pipeline counter in `stats` and in the shared metrics registry."""
+        with self.cond:
+            self.stats[key] += 1
+        metrics.incr(f"analysis.{key}")
+
+    def _discard(self, candidate):
+        """Hands an unanalyzed candidate back to the owner for cleanup."""
+        if self.on_discard is not None:
+            self.on_discard(candidate)
+
+    def _worker(self):
+        """Worker loop: take the oldest candidate, check cache and pre-filter, wait for a token, analyze, report."""
+        while not self.stop_event.is_set():
+            with self.cond:
+                self.cond.wait_for(lambda: self.pending or self.stop_event.is_set())
+                if self.stop_event.is_set():
+                    return
+                candidate = self._pop_next()
+            metrics.observe('analysis.queue_wait', time.monotonic() - candidate.queued_at)
+
+            # A near-duplicate of something already analyzed needs neither a token nor an API call.
+            cache_key = None
+            if self.cache is not None:
+                cache_key = self.cache.key(candidate.crop, candidate.bounds, candidate.camera_id)
+                verdict = self.cache.lookup(cache_key)
+                if verdict is not None:
+                    candidate.cached = True
+                    self._count('cached')
+                    self._deliver(candidate, verdict)
+                    continue
+
+            # Cheap local gate: obvious leaves and shadows never cost a token or an API call.
+            if self.prefilter is not None:
+                escalate, score = self.prefilter.check(candidate.crop)
+                if not escalate:
+                    self._count('prefiltered')
+                    self._deliver(candidate, {
+                        'is_bird': False,
+                        'species': 'unknown',
+                        'confidence': 1.0 - score,
+                        'identification_reason': f"Rejected by on-device pre-filter (bird score {score:.2f})"
+                    })
+                    continue
+
+            # Only wait for a token as long as the candidate is still worth analyzing.
+            remaining = self.max_age - (time.monotonic() - candidate.queued_at)
+            if remaining <= 0 or not self.rate_limiter.acquire(timeout=remaining):
+                self._count('expired')
+                self._discard(candidate)
+                continue
+
+            deadline = candidate.queued_at + self.max_age + self.gemini_client.request_timeout
+            started = time.monotonic()
+            with metrics.timer('analysis'):
+                analysis = self.gemini_client.analyze_images(candidate.crops, context=candidate.context, deadline=deadline)
+            with self.cond:
+                self.stats['analyzed'] += 1
+                self.stats['gemini_seconds'] += time.monotonic() - started
+            metrics.incr('analysis.analyzed')
+            if cache_key is not None:
+                self.cache.store(cache_key, analysis)
+            self._deliver(candidate, analysis)
+
+    def _deliver(self, candidate, analysis):
+        """Passes a result to the owner without letting handler errors kill the worker."""
+        try:
+            self.on_result(candidate, analysis)
+        except Exception as e:
+            self.logger.error(f"Analysis result handler failed: {e}")
@@ -0,0 +1,490 @@
+# -----------------------------------------------------------------------------
+# Module: Benchmark
+# Purpose: Replays a local video or a synthetic scene through the vision loop offline and reports throughput,
+#          per-stage latency percentiles and resource usage as JSON.
+# -----------------------------------------------------------------------------
+
+import sys
+import json
+import time
+import types
+import tempfile
+import logging
+import argparse
+import threading
+import platform
+import resource
+import cv2
+import numpy as np
+import yaml
+
+import main as service
+from metrics import metrics, process_rss_bytes
+from motion_detector import MotionDetector
+from gemini_client import GeminiClient
+from recorder import Recorder
+
+def synthetic_bird(config, width, height):
+    """
+    Sizes the synthetic bird so the configured detector sees it and the tracker can follow it.
+
+    Args:
+        config (dict): Configuration dictionary loaded from settings.yaml.
+        width (int): Frame width.
+        height (int): Frame height.
+
+    Returns:
+        tuple: (axes (tuple), step (float)): ellipse half-axes in pixels, and the largest
+            per-frame movement that keeps consecutive analysed boxes within
+            `TRACK_MAX_CENTROID_DISTANCE` of each other.
+    """
+    # Twice MIN_AREA_PIXELS, so it stays above the limit while partly inside the background model.
+    area = 2 * config.get('MIN_AREA_PIXELS', 500)
+    # A 3:2 ellipse of that area, capped to a quarter of the frame width and a third of its height.
+    minor = min(np.sqrt(area / (1.5 * np.pi)), height / 6, width / 12)
+    axes = (int(round(1.5 * minor)), int(round(minor)))
+    # A quarter of the association distance per analysed frame (in units of the box's larger
+    # side), so a crossing spans enough analysed frames to confirm the track and fill a burst.
+    max_distance = config.get('TRACK_MAX_CENTROID_DISTANCE', 1.0)
+    frame_skip = max(1, int(config.get('ANALYSIS_FRAME_SKIP', 6)))
+    step = 0.25 * max_distance * 2 * axes[0] / frame_skip
+    return axes, step
+
+
+class SyntheticCapture:
+    """
+    VideoCapture-like source rendering a static, slightly noisy scene with a periodic "bird" crossing it.
+    """
+
+    def __init__(self, width, height, fps=15, visit_every=300, visit_frames=None, seed=0, bird_axes=(18, 12), step=None):
+        """
+        Initialize the SyntheticCapture.
+
+        Args:
+            width (int): Frame width.
+            height (int): Frame height.
+            fps (float): Frame rate to pace `grab()` at; 0 runs unpaced.
+            visit_every (int): Frames between the starts of two visits.
+            visit_frames (int, optional): Frames a visit lasts; by default one crossing at `step`.
+            seed (int): Random seed for the scene.
+            bird_axes (tuple): Half-axes of the bird ellipse in pixels.
+            step (float, optional): Largest distance in pixels the bird moves per frame; it
+                never crosses the frame more than once per visit.
+        """
+        rng = np.random.default_rng(seed)
+        # Smooth gradient plus fixed texture, then a handful of sensor-noise variants
+        # rendered up front so generating frames costs almost nothing.
+        base = np.linspace(60, 180, width, dtype=np.float32)[None, :, None].repeat(height, 0).repeat(3, 2)
+        base += cv2.GaussianBlur(rng.normal(0, 25, (height, width, 3)).astype(np.float32), (0, 0), 3)
+        self.backgrounds = [
+            np.clip(base + rng.normal(0, 2, base.shape), 0, 255).astype(np.uint8) for _ in range(8)
+        ]
+        self.frame = np.empty_like(self.backgrounds[0])
+        self.width = width
+        self.height = height
+        self.interval = 1.0 / fps if fps > 0 else 0.0
+        self.visit_every = visit_every
+        self.bird_axes = bird_axes
+        travel = width - 2 * bird_axes[0]
+        if not visit_frames:
+            visit_frames = int(np.ceil(travel / step)) if step else 60
+        self.visit_frames = min(visit_frames, visit_every)
+        # Never faster than one crossing per visit.
+        self.step = min(step, travel / visit_frames) if step else travel / visit_frames
+        self.index = -1
+        self.next_due = time.monotonic()
+        self.opened = True
+
+    def isOpened(self):
+        """Returns True until released."""
+        return self.opened
+
+    def grab(self):
+        """Advances to the next frame, sleeping to hold the configured frame rate."""
+        if self.interval:
+            delay = self.next_due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self.next_due = max(self.next_due + self.interval, time.monotonic() - self.interval)
+        self.index += 1
+        return self.opened
+
+    def retrieve(self):
+        """Renders the current frame into a reused buffer."""
+        np.copyto(self.frame, self.backgrounds[self.index % len(self.backgrounds)])
+        # Visits end each period, so the background model first learns the empty scene.
+        phase = self.index % self.visit_every - (self.visit_every - self.visit_frames)
+        if phase >= 0:
+            # A bird-sized ellipse hopping across the lower half of the frame.
+            x = int(self.bird_axes[0] + self.step * phase)
+            y = int(min(self.height * 0.6, self.height - self.bird_axes[1]) + 0.1 * self.bird_axes[1] * np.sin(phase / 3))
+            cv2.ellipse(self.frame, (x, y), self.bird_axes, 0, 0, 360, (20, 140, 230), -1)
+        return True, self.frame
+
+    def read(self):
+        """Grabs and renders the next frame."""
+        if not self.grab():
+            return False, None
+        return self.retrieve()
+
+    def release(self):
+        """Closes the source."""
+        self.opened = False
+
+
+class ReplayMotionDetector(MotionDetector):
+    """
+    MotionDetector reading from a SyntheticCapture instead of a stream.
+    """
+
+    def __init__(self, config, **scene):
+        """
+        Args:
+            config (dict): Configuration dictionary loaded from settings.yaml.
+            **scene: Keyword arguments for SyntheticCapture.
+        """
+        super().__init__('synthetic', config)
+        self.backend = 'synthetic'
+        self.pixel_format = 'bgr'
+        self.scene = scene
+
+    def _open_capture(self):
+        """
+        Returns:
+            SyntheticCapture: A new synthetic source.
+        """
+        return SyntheticCapture(**self.scene)
+
+
+class LoopingCapture:
+    """
+    Capture wrapper that reopens a local video when it ends, so a short clip can feed any number of frames.
+    """
+
+    def __init__(self, open_capture):
+        """
+        Args:
+            open_capture (callable): Returns a new, opened capture of the video.
+        """
+        self.open_capture = open_capture
+        self.cap = open_capture()
+        self.loops = 0
+
+    def isOpened(self):
+        """Returns True while the underlying capture is open."""
+        return self.cap.isOpened()
+
+    def grab(self):
+        """Advances to the next frame, rewinding to the start of the video at its end."""
+        if self.cap.grab():
+            return True
+        self.cap.release()
+        self.cap = self.open_capture()
+        self.loops += 1
+        return self.cap.grab()
+
+    def retrieve(self):
+        """Decodes the grabbed frame."""
+        return self.cap.retrieve()
+
+    def read(self):
+        """Grabs and decodes the next frame."""
+        if not self.grab():
+            return False, None
+        return self.retrieve()
+
+    def release(self):
+        """Closes the video."""
+        self.cap.release()
+
+
+class VideoReplayMotionDetector(MotionDetector):
+    """
+    MotionDetector replaying a local video in a loop, through the configured capture backend.
+    """
+
+    def _open_capture(self):
+        """
+        Returns:
+            LoopingCapture: The configured backend's capture of the video, reopened at its end.
+        """
+        return LoopingCapture(super()._open_capture)
+
+
+class StubGeminiClient(GeminiClient):
+    """
+    GeminiClient that builds the real request (encoding included) but answers locally after a fixed latency.
+    """
+
+    def __init__(self, config, latency):
+        """
+        Args:
+            config (dict): Configuration dictionary loaded from settings.yaml.
+            latency (float): Seconds each "API call" takes.
+        """
+        # The SDK client is created but never used; it does not contact the API on construction.
+        super().__init__('offline-benchmark', config)
+        self.latency = latency
+
+    def _generate_with_retry(self, contents, deadline=None):
+        """
+        Stands in for the API call.
+
+        Args:
+            contents (list): The request contents, built and encoded as for the real API.
+            deadline (float, optional): Ignored.
+
+        Returns:
+            types.SimpleNamespace: A response whose `text` is a "not a bird" verdict.
+        """
+        time.sleep(self.latency)
+        # Never a bird, so the loop is not paused by the sighting cooldown.
+        verdict = {"is_bird": False, "species": "unknown", "confidence": 1.0, "identification_reason": "Benchmark stub"}
+        return types.SimpleNamespace(text=json.dumps(verdict))
+
+
+class StubRecorder(Recorder):
+    """
+    Recorder that never touches the HQ stream.
+    """
+
+    def start_ring_buffer(self):
+        """Does nothing; there is no HQ stream to record."""
+        return None
+
+    def capture_sighting(self, snapshot_path, video_path, duration=30, snapshot_offset=0.0, trigger_time=None):
+        """
+        Pretends a sighting was captured, without writing any file.
+
+        Args:
+            snapshot_path (str): Ignored.
+            video_path (str): Ignored.
+            duration (int): Ignored.
+            snapshot_offset (float): Ignored.
+            trigger_time (float, optional): Ignored.
+
+        Returns:
+            dict: A successful capture result, as `Recorder.capture_sighting` returns it.
+        """
+        return {"snapshot": True, "video": True, "timings": {}, "clip_start": None}
+
+
+class MemoryProbe:
+    """
+    Samples the RSS while the replay runs; garbage collections are timed by the metrics registry.
+
+    The RSS after the warm-up (the first `warmup` grabbed frames, while buffers, models and
+    caches fill) is the baseline; growth beyond it over a long replay points to a per-frame leak.
+    """
+
+    def __init__(self, detector, warmup, interval=0.5):
+        """
+        Args:
+            detector (MotionDetector): Detector whose frame count marks the end of the warm-up.
+            warmup (int): Grabbed frames before the baseline is taken.
+            interval (float): Seconds between RSS samples.
+        """
+        self.detector = detector
+        self.warmup = warmup
+        self.interval = interval
+        self.baseline = None
+        self.peak = 0
+        # RSS samples taken after the baseline.
+        self.samples = 0
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._sample, name="MemoryProbe", daemon=True)
+
+    def start(self):
+        """Starts sampling."""
+        self.thread.start()
+
+    def stop(self):
+        """
+        Returns:
+            dict: Baseline, final and peak RSS after warm-up and the growth, in MB, and the
+                number of samples taken after the baseline.
+        """
+        self.stop_event.set()
+        self.thread.join()
+        final = process_rss_bytes()
+        baseline = self.baseline if self.baseline is not None else final
+        mb = 1024.0 * 1024.0
+        return {
+            'baseline_mb': baseline / mb,
+            'final_mb': final / mb,
+            'peak_after_warmup_mb': max(self.peak, final) / mb,
+            'growth_mb': (final - baseline) / mb,
+            'samples_after_warmup': self.samples
+        }
+
+    def _sample(self):
+        """Takes the baseline once the warm-up is over, then tracks the peak."""
+        while not self.stop_event.wait(self.interval):
+            rss = process_rss_bytes()
+            if self.baseline is None:
+                if self.detector.frame_count >= self.warmup:
+                    self.baseline = rss
+            else:
+                self.peak = max(self.peak, rss)
+                self.samples += 1
+
+
+def resource_usage():
+    """
+    Returns:
+        tuple: (cpu_seconds (float), peak_rss_mb (float)) of this process plus reaped children (ffmpeg).
+    """
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+    # ru_maxrss is in KiB on Linux.
+    return cpu, max(own.ru_maxrss, children.ru_maxrss) / 1024.0
+
+
+def parse_overrides(pairs):
+    """
+    Parses repeated KEY=VALUE arguments; values are YAML, so numbers and booleans keep their types.
+
+    Args:
+        pairs (list): "KEY=VALUE" strings.
+
+    Returns:
+        dict: The overrides.
+    """
+    overrides = {}
+    for pair in pairs:
+        key, sep, value = pair.partition('=')
+        if not sep:
+            raise argparse.ArgumentTypeError(f"Expected KEY=VALUE, got '{pair}'")
+        overrides[key] = yaml.safe_load(value)
+    return overrides
+
+
+def run(args):
+    """
+    Runs one replay and collects the results.
+
+    Args:
+        args (argparse.Namespace): Parsed command line.
+
+    Returns:
+        dict: The benchmark report.
+    """
+    config = service.CONFIG
+    # A fixed analysis rate keeps runs comparable whatever the time of day (--set can re-enable it).
+    config['ADAPTIVE_FRAME_SKIP'] = False
+    # An unpaced replay outruns a threaded grabber, which would drop nearly every frame.
+    config['CAPTURE_MODE'] = 'sync'
+    config.update(parse_overrides(args.set))
+    # Nothing is ever delivered to a server; keep the outbox off disk.
+    config['OUTBOX_PATH'] = ':memory:'
+    # Never re-encode or post-process the real captures directory during a replay.
+    config['TIERING_ENABLED'] = False
+    config['DERIVATIVES_ENABLED'] = False
+    # Sighting history starts empty and is kept away from the service's own file.
+    scratch = tempfile.TemporaryDirectory(prefix='vision_benchmark_')
+    config['ACTIVITY_HISTORY_PATH'] = f"{scratch.name}/activity.json"
+    # The service's metrics port may be in use by the service itself; the report has everything.
+    config['METRICS_PORT'] = 0
+
+    if args.video:
+        detector = VideoReplayMotionDetector(args.video, config)
+    else:
+        width, height = config.get('FFMPEG_FRAME_WIDTH', 640), config.get('FFMPEG_FRAME_HEIGHT', 360)
+        bird_axes, step = synthetic_bird(config, width, height)
+        detector = ReplayMotionDetector(
+            config,
+            width=width,
+            height=height,
+            fps=args.fps,
+            visit_every=args.visit_every,
+            visit_frames=args.visit_frames,
+            seed=args.seed,
+            bird_axes=bird_axes,
+            step=step
+        )
+
+    service.init_components(
+        detector=detector,
+        client=StubGeminiClient(config, args.gemini_latency),
+        hq_recorder=StubRecorder(None, config),
+        captures_dir=scratch.name
+    )
+
+    metrics.reset()
+    probe = MemoryProbe(detector, warmup=int(args.frames * args.warmup_fraction))
+    probe.start()
+    cpu_start, _ = resource_usage()
+    start = time.monotonic()
+    service.main(max_frames=args.frames, follow_daylight=False)
+    wall = time.monotonic() - start
+    cpu_end, peak_rss_mb = resource_usage()
+    memory = probe.stop()
+
+    stages = metrics.snapshot()['timers']
+    analysed = stages.get('detect.bg_subtract', {}).get('count', 0)
+    return {
+        'source': args.video or 'synthetic',
+        'frames': args.frames,
+        'config': {key: config.get(key) for key in (
+            'CAPTURE_MODE', 'CAPTURE_BACKEND', 'FFMPEG_FULL_RES_CROPS', 'ANALYSIS_FRAME_SKIP',
+            'MOG2_HISTORY', 'MOTION_DOWNSCALE', 'MIN_AREA_PIXELS', 'BURST_FRAMES', 'ANALYSIS_WORKERS'
+        )},
+        'gemini_latency_s': args.gemini_latency,
+        'wall_seconds': wall,
+        'frames_grabbed': service.motion_detector.frame_count,
+        'frames_analysed': analysed,
+        'grabbed_fps': service.motion_detector.frame_count / wall if wall else 0.0,
+        'analysed_fps': analysed / wall if wall else 0.0,
+        'cpu_percent': 100 * (cpu_end - cpu_start) / wall if wall else 0.0,
+        'peak_rss_mb': peak_rss_mb,
+        'memory': memory,
+        'stages': stages,
+        'pipeline': service.analysis_pipeline.summary(),
+        'platform': {
+            'machine': platform.machine(),
+            'python': platform.python_version(),
+            'opencv': cv2.__version__
+        }
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline replay benchmark for the vision pipeline.")
+    parser.add_argument('--video', help="Local video file to replay (default: synthetic scene)")
+    parser.add_argument('--frames', type=int, default=3000, help="Stream frames to replay (looping the video if needed)")
+    parser.add_argument('--fps', type=float, default=0, help="Pace the synthetic source at this rate (0 = as fast as possible)")
+    parser.add_argument('--visit-every', type=int, default=300, help="Synthetic frames between bird visits")
+    parser.add_argument('--visit-frames', type=int, help="Synthetic frames per bird visit (default: one crossing slow enough to track)")
+    parser.add_argument('--seed', type=int, default=0, help="Synthetic scene seed")
+    parser.add_argument('--gemini-latency', type=float, default=1.5, help="Seconds the stub Gemini call takes")
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE', help="Override a settings.yaml key")
+    parser.add_argument('--warmup-fraction', type=float, default=0.2, help="Share of the frames replayed before the RSS baseline is taken")
+    parser.add_argument('--max-rss-growth-mb', type=float, help="Exit with status 1 if RSS grows more than this after the warm-up")
+    parser.add_argument('--output', help="Write the JSON report here instead of stdout")
+    parser.add_argument('--verbose', action='store_true', help="Keep the service's INFO logging")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+
+    report = run(args)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+    if report['pipeline']['submitted'] == 0:
+        print("No candidate reached the analysis pipeline; the encode and analysis stages were not measured", file=sys.stderr)
+
+    growth = report['memory']['growth_mb']
+    if args.max_rss_growth_mb is not None and growth > args.max_rss_growth_mb:
+        print(f"RSS grew {growth:.1f} MB after warm-up (limit {args.max_rss_growth_mb} MB)", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,290 @@
+# -----------------------------------------------------------------------------
+# Module: CameraWorker
+# Purpose: Runs the capture -> detect -> burst loop for one camera, in the main process or in its own process.
+# -----------------------------------------------------------------------------
+
+import os
+import gc
+import time
+import queue
+import logging
+import datetime
+
+from motion_detector import MotionDetector
+from analysis_pipeline import Candidate
+from burst import BurstCollector
+from tracker import BlobTracker
+from metrics import metrics, MetricsExporter
+from scheduler import ActivityHistogram, DutyCycleScheduler
+
+# Camera id used when settings.yaml has no CAMERAS list (single camera from RTSP_URL_LQ/RTSP_URL_HQ).
+DEFAULT_CAMERA_ID = 'default'
+
+def load_cameras(config):
+    """
+    Reads the camera list from the configuration.
+
+    Each `CAMERAS` entry has an `id`, the LQ/HQ stream URLs (`rtsp_url_lq`/`rtsp_url_hq`,
+    or the names of environment variables holding them in `rtsp_url_lq_env`/`rtsp_url_hq_env`),
+    an optional `cpu` to pin its process to, and optional `settings` overriding settings.yaml keys.
+
+    Args:
+        config (dict): Configuration dictionary loaded from settings.yaml.
+
+    Returns:
+        list: Camera dicts with 'id', 'lq_url', 'hq_url', 'cpu' and 'settings'.
+    """
+    entries = config.get('CAMERAS')
+    if not entries:
+        return [{
+            'id': DEFAULT_CAMERA_ID,
+            'lq_url': os.getenv("RTSP_URL_LQ"),
+            'hq_url': os.getenv("RTSP_URL_HQ"),
+            'cpu': None,
+            'settings': {}
+        }]
+
+    cameras = []
+    for entry in entries:
+        cameras.append({
+            'id': str(entry['id']),
+            'lq_url': entry.get('rtsp_url_lq') or os.getenv(entry.get('rtsp_url_lq_env', '')),
+            'hq_url': entry.get('rtsp_url_hq') or os.getenv(entry.get('rtsp_url_hq_env', '')),
+            'cpu': entry.get('cpu'),
+            'settings': entry.get('settings') or {}
+        })
+    return cameras
+
+def camera_config(config, camera, shared_host=False):
+    """
+    Builds the effective configuration of one camera.
+
+    Args:
+        config (dict): Configuration dictionary loaded from settings.yaml.
+        camera (dict): Camera as returned by `load_cameras`.
+        shared_host (bool): True if several cameras run on this host; gives each its own pre-roll ring.
+
+    Returns:
+        dict: settings.yaml values with the camera's overrides applied.
+    """
+    merged = dict(config)
+    merged.update(camera['settings'])
+    if shared_host and 'PREROLL_DIR' not in camera['settings']:
+        merged['PREROLL_DIR'] = os.path.join(config.get('PREROLL_DIR', '/dev/shm/birdfeeder_ring'), camera['id'])
+    return merged
+
+def build_context():
+    """
+    Builds the prompt context for a detection happening now.
+
+    Returns:
+        dict: Location, time, date and setting for GeminiClient.
+    """
+    return {
+        "location": os.getenv("LOCATION_NAME", "Unknown"),
+        "time": datetime.datetime.now().strftime("%I:%M %p"),
+        "date": datetime.datetime.now().strftime("%Y-%m-%d"),
+        "setting": os.getenv("FEEDER_SETTING", "Bird Feeder")
+    }
+
+
+class CameraWorker:
+    """
+    Capture and motion detection loop of one camera.
+
+    Motion boxes are followed by a `BlobTracker`; a burst (and so one analysis) starts only
+    for a newly arrived track, not for every frame a known visitor keeps moving in.
+    Candidates are handed to `submit` (the analysis pipeline directly, or a queue to the
+    main process). The sighting cooldown is read from a shared `cooldown_until` value that
+    the analysis side sets when this camera's sighting is confirmed; in turn the worker
+    publishes when it last saw a visitor in `last_motion`, which the analysis side uses to
+    trim clips and to find idle periods.
+    """
+
+    def __init__(self, camera_id, detector, config, submit, cooldown_until, scheduler=None, last_motion=None):
+        """
+        Initialize the CameraWorker.
+
+        Args:
+            camera_id (str): Camera id attached to every candidate.
+            detector (MotionDetector): The camera's motion detector.
+            config (dict): The camera's effective configuration.
+            submit (callable): Called with each Candidate.
+            cooldown_until (multiprocessing.Value): Unix time until which the camera is in sighting cooldown.
+            scheduler (DutyCycleScheduler, optional): Day schedule and analysis rate; built from
+                the shared activity history file if omitted.
+            last_motion (multiprocessing.Value, optional): Set to the Unix time of every analysed
+                frame in which a visitor (confirmed track) is present.
+        """
+        self.camera_id = camera_id
+        self.detector = detector
+        self.config = config
+        self.submit = submit
+        self.cooldown_until = cooldown_until
+        self.cooldown_active = False
+        self.background_interval = config.get('COOLDOWN_BACKGROUND_INTERVAL_SECONDS', 1.0)
+        self.next_background_update = 0.0
+        self.scheduler = scheduler or DutyCycleScheduler(config, ActivityHistogram(config), camera_id)
+        self.rate_interval = config.get('FRAME_SKIP_UPDATE_SECONDS', 60)
+        self.next_rate_update = 0.0
+        self.tracker = BlobTracker(config)
+        self.burst_track = None
+        self.last_motion = last_motion
+        self.logger = logging.getLogger(f"{__name__}.{camera_id}")
+
+    def run(self, max_frames=None, follow_daylight=True):
+        """
+        Runs the loop.
+
+        Args:
+            max_frames (int, optional): Stop once this many stream frames have been grabbed
+                (used for offline replays). Runs forever if None.
+            follow_daylight (bool): Sleep through the night. Disabled for offline replays.
+        """
+        if not self.detector.connect():
+            self.logger.error("Could not connect to LQ Stream. Exiting.")
+            return
+
+        burst = BurstCollector(self.config)
+        # The detect path reuses its buffers, so the loop needs no forced collections. Objects
+        # alive by now (config, models, buffers) are moved out of the collector's generations,
+        # so the automatic collections that still happen only walk short-lived objects.
+        gc.freeze()
+
+        while max_frames is None or self.detector.frame_count < max_frames:
+            # Sleep straight through to sunrise, with the stream closed; read_frame reconnects.
+            if follow_daylight and not self.scheduler.is_daylight():
+                wait = self.scheduler.seconds_until_daylight()
+                self.logger.info(f"It is night time. Sleeping {wait / 3600:.1f}h until sunrise...")
+                burst.cancel()
+                self.tracker.clear()
+                self.detector.release()
+                time.sleep(wait)
+                continue
+
+            self._update_rate()
+
+            # Every iteration is paced by the stream itself: the loop blocks on the next
+            # frame, so detection resumes on the first frame after a cooldown ends.
+            if time.time() < self.cooldown_until.value:
+                if not self.cooldown_active:
+                    remaining = int(self.cooldown_until.value - time.time())
+                    self.logger.info(f"Cooldown active: Sighting({remaining}s remaining). Keeping the background model warm.")
+                    self.cooldown_active = True
+                    burst.cancel()
+                self._keep_warm()
+                continue
+
+            if self.cooldown_active:
+                self.logger.info("Cooldowns expired. Resuming motion detection.")
+                self.cooldown_active = False
+
+            frame = self.detector.read_frame()
+            if frame is None:
+                continue
+
+            now = time.time()
+            self._track(self.detector.detect(frame), now)
+
+            if burst.active:
+                # Keep following the subject's track; if it sat still, crop where the trigger was.
+                track = self.tracker.get(self.burst_track)
+                burst.add(self.detector.crop_region(frame, track.bounds if track and track.matched else burst.bounds))
+            else:
+                # Only a visitor that was not analysed yet starts a burst; the others stay queued
+                # on the tracker until this one is done.
+                track = self.tracker.next_arrival()
+                if track is not None:
+                    track.analysed = True
+                    self.burst_track = track.id
+                    self.logger.info(f"New arrival (track {track.id})! Collecting burst for Gemini analysis...")
+                    burst.start(self.detector.crop_region(frame, track.bounds), track.bounds, now)
+
+            if burst.complete:
+                crops, bounds, detected_at = burst.finish()
+                # Crops stay in memory; GeminiClient encodes them directly, nothing touches the disk yet.
+                self.submit(Candidate(crops, bounds, detected_at, build_context(), self.camera_id))
+
+        self.detector.release()
+
+    def _update_rate(self):
+        """Applies the scheduler's frame skip for the current hour, checked every `FRAME_SKIP_UPDATE_SECONDS`."""
+        now = time.monotonic()
+        if now < self.next_rate_update:
+            return
+        self.next_rate_update = now + self.rate_interval
+        frame_skip = self.scheduler.frame_skip()
+        if frame_skip != self.detector.frame_skip:
+            self.logger.info(f"Analysis rate: every {frame_skip}. frame (was {self.detector.frame_skip})")
+            self.detector.set_frame_skip(frame_skip)
+        metrics.set_gauge('analysis.frame_skip', frame_skip)
+
+    def _track(self, boxes, now):
+        """Updates the tracks with one frame's motion boxes and publishes whether a visitor is present."""
+        self.tracker.update(boxes, now)
+        if self.last_motion is not None and self.tracker.present():
+            self.last_motion.value = now
+
+    def _keep_warm(self):
+        """
+        One cooldown step: drain the stream, and every `COOLDOWN_BACKGROUND_INTERVAL_SECONDS`
+        decode a frame and feed it to the background model. While its mask still shows motion
+        (a pixel count, no contours) the visitor's tracks are held, so the visitor that caused
+        the sighting is still known when the cooldown ends.
+        """
+        now = time.monotonic()
+        if now < self.next_background_update:
+            self.detector.drain()
+            return
+
+        frame = self.detector.read_frame()
+        if frame is not None:
+            fg_mask = self.detector.update_background(frame)
+            if self.detector.has_motion(fg_mask):
+                self.tracker.hold(time.time())
+                if self.last_motion is not None:
+                    self.last_motion.value = time.time()
+            self.next_background_update = now + self.background_interval
+
+
+def run_camera_process(camera, config, candidates, cooldown_until, last_motion, metrics_port=0, metrics_dump_path=None):
+    """
+    Entry point of a camera process in multi-camera mode.
+
+    Args:
+        camera (dict): Camera as returned by `load_cameras`.
+        config (dict): The camera's effective configuration.
+        candidates (multiprocessing.Queue): Queue to the analysis service in the main process.
+        cooldown_until (multiprocessing.Value): Shared sighting cooldown of this camera.
+        last_motion (multiprocessing.Value): Shared time this camera last saw a visitor.
+        metrics_port (int): Port of this process's metrics endpoint (0 disables).
+        metrics_dump_path (str, optional): JSON dump file of this process's metrics.
+    """
+    logging.basicConfig(
+        level=logging.INFO,
+        format=f'%(asctime)s - [{camera["id"]}] %(name)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.StreamHandler()
+        ]
+    )
+    logger = logging.getLogger(__name__)
+
+    if camera['cpu'] is not None and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, {camera['cpu']})
+        logger.info(f"Camera {camera['id']} pinned to CPU {camera['cpu']}")
+
+    # Frame stage metrics live in this process, so it exports them itself.
+    exporter = MetricsExporter(metrics, dict(config, METRICS_PORT=metrics_port, METRICS_DUMP_PATH=metrics_dump_path))
+    exporter.start()
+
+    def submit(candidate):
+        try:
+            candidates.put_nowait(candidate)
+        except queue.Full:
+            # The analysis side is saturated; like the pipeline, prefer fresh candidates over old ones.
+            metrics.incr('candidates.dropped')
+            logger.warning("Analysis queue full, dropping candidate")
+
+    detector = MotionDetector(camera['lq_url'], config)
+    CameraWorker(camera['id'], detector, config, submit, cooldown_until, last_motion=last_motion).run()
+    exporter.stop()
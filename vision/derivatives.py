@@ -0,0 +1,320 @@
+# -----------------------------------------------------------------------------
+# Module: Derivatives
+# Purpose: Background post-processing of finished sightings into feed-sized assets
+#          (clip trimmed to the visit, thumbnails, poster frame, faststart clip).
+# -----------------------------------------------------------------------------
+
+import os
+import struct
+import logging
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+
+from metrics import metrics
+
+def is_faststart(path):
+    """
+    Checks whether an MP4's `moov` atom comes before its `mdat`, so playback can start
+    before the whole file is downloaded.
+
+    Args:
+        path (str): Path to the MP4 file.
+
+    Returns:
+        bool: True if `moov` precedes `mdat` (or the file has no `mdat`).
+    """
+    with open(path, 'rb') as f:
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                return True
+            size, kind = struct.unpack('>I4s', header)
+            if kind == b'moov':
+                return True
+            if kind == b'mdat':
+                return False
+            if size == 1:
+                # 64-bit box size follows the type.
+                size = struct.unpack('>Q', f.read(8))[0] - 8
+            elif size == 0:
+                # Box runs to the end of the file.
+                return True
+            f.seek(size - 8, os.SEEK_CUR)
+
+
+def keyframe_offsets(path):
+    """
+    Lists the keyframes of an MP4's first video stream from its packet index (nothing is decoded).
+
+    Args:
+        path (str): Path to the MP4 file.
+
+    Returns:
+        tuple: (keyframes (list of seconds from the start of the clip), length (float, seconds)).
+    """
+    cmd = [
+        'ffprobe',
+        '-v', 'error',
+        '-select_streams', 'v:0',
+        '-show_entries', 'packet=pts_time,flags',
+        '-of', 'csv=p=0',
+        path
+    ]
+    output = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=30, check=True).stdout
+    times, keyframes = [], []
+    for line in output.decode().splitlines():
+        pts, _, flags = line.partition(',')
+        try:
+            t = float(pts)
+        except ValueError:
+            continue
+        times.append(t)
+        if 'K' in flags:
+            keyframes.append(t)
+    if not times:
+        return [], 0.0
+    # Input seeking (-ss) is relative to the first timestamp, not to zero.
+    base = min(times)
+    return sorted(k - base for k in keyframes), max(times) - base
+
+
+class DerivativeWorker:
+    """
+    Turns a finished sighting's HQ snapshot and clip into the assets the feed actually loads:
+    resized WebP/JPEG thumbnails at `DERIVATIVE_WIDTHS`, a poster frame for the video, and
+    a faststart MP4 cut down to the part of the clip in which the bird was there. The result
+    is reported through `on_ready`, e.g. to the outbox.
+
+    Work runs on a single low-priority background thread so it never competes with detection.
+    """
+
+    def __init__(self, config, on_ready, static_root="../static"):
+        """
+        Initialize the DerivativeWorker.
+
+        Args:
+            config (dict): Configuration dictionary loaded from settings.yaml.
+            on_ready (callable): Called with (client_ref, manifest) once a sighting's assets exist.
+            static_root (str): Directory the asset paths in the manifest are relative to.
+        """
+        self.widths = sorted(config.get('DERIVATIVE_WIDTHS', [320, 640, 1280]))
+        self.webp_quality = config.get('DERIVATIVE_WEBP_QUALITY', 80)
+        self.jpeg_quality = config.get('DERIVATIVE_JPEG_QUALITY', 82)
+        self.poster_width = config.get('DERIVATIVE_POSTER_WIDTH', 1280)
+        self.nice = config.get('DERIVATIVES_NICE', 10)
+        self.trim = config.get('CLIP_TRIM_ENABLED', True)
+        self.trim_min_saving = config.get('CLIP_TRIM_MIN_SAVING_SECONDS', 3)
+        self.on_ready = on_ready
+        self.static_root = static_root
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="Derivatives", initializer=self._lower_priority)
+        self.logger = logging.getLogger(__name__)
+
+    def submit(self, client_ref, snapshot_path, video_path, active_span=None):
+        """
+        Queues a finished sighting for post-processing.
+
+        Args:
+            client_ref (str): Outbox reference of the sighting.
+            snapshot_path (str): HQ snapshot (may be missing if the capture failed).
+            video_path (str): HQ clip (may be missing if the capture failed).
+            active_span (tuple, optional): (start, end) seconds into the clip during which the
+                visitor was there; the clip is trimmed to it. Kept whole if None.
+        """
+        self.executor.submit(self._process, client_ref, snapshot_path, video_path, active_span)
+
+    def stop(self):
+        """Finishes queued work and stops the worker thread."""
+        self.executor.shutdown(wait=True)
+
+    def _lower_priority(self):
+        """Raises the niceness of the worker thread (per thread on Linux; ffmpeg children inherit it)."""
+        if self.nice and hasattr(os, 'setpriority'):
+            try:
+                os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), self.nice)
+            except OSError as e:
+                self.logger.warning(f"Could not lower derivative worker priority: {e}")
+
+    def _process(self, client_ref, snapshot_path, video_path, active_span=None):
+        """Builds all derivatives of one sighting and reports the manifest."""
+        with metrics.timer('derivatives'):
+            manifest = {}
+            if os.path.exists(snapshot_path):
+                manifest['images'] = self._thumbnails(snapshot_path)
+            if os.path.exists(video_path):
+                # Trimmed first, so the poster and the faststart check see the final clip.
+                if self.trim and active_span is not None:
+                    self._trim(video_path, *active_span)
+                poster = self._poster(video_path)
+                if poster:
+                    manifest['poster'] = poster
+                if self._faststart(video_path):
+                    manifest['video'] = self._relative(video_path)
+
+        if not manifest:
+            self.logger.warning(f"No derivatives produced for {snapshot_path}")
+            return
+        self.on_ready(client_ref, manifest)
+
+    def _relative(self, path):
+        """Path as stored on the server (relative to the static root)."""
+        return os.path.relpath(path, self.static_root)
+
+    def _thumbnails(self, snapshot_path):
+        """
+        Writes WebP and JPEG versions of the snapshot at each configured width.
+
+        Args:
+            snapshot_path (str): The HQ snapshot.
+
+        Returns:
+            list: {"width", "webp", "jpg"} per width that is smaller than the snapshot.
+        """
+        image = cv2.imread(snapshot_path)
+        if image is None:
+            self.logger.error(f"Could not read snapshot for thumbnails: {snapshot_path}")
+            return []
+
+        base = os.path.splitext(snapshot_path)[0]
+        h, w = image.shape[:2]
+        images = []
+        for width in self.widths:
+            if width >= w:
+                break
+            size = (width, max(1, round(h * width / w)))
+            resized = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+            entry = {'width': width}
+            webp_path = f"{base}_w{width}.webp"
+            if cv2.imwrite(webp_path, resized, [cv2.IMWRITE_WEBP_QUALITY, int(self.webp_quality)]):
+                entry['webp'] = self._relative(webp_path)
+            jpg_path = f"{base}_w{width}.jpg"
+            if cv2.imwrite(jpg_path, resized, [cv2.IMWRITE_JPEG_QUALITY, int(self.jpeg_quality)]):
+                entry['jpg'] = self._relative(jpg_path)
+            images.append(entry)
+        return images
+
+    def _poster(self, video_path):
+        """
+        Extracts the clip's first frame, scaled to `DERIVATIVE_POSTER_WIDTH`, as the video poster.
+
+        Args:
+            video_path (str): The HQ clip.
+
+        Returns:
+            str or None: Relative poster path, or None on failure.
+        """
+        poster_path = f"{os.path.splitext(video_path)[0]}_poster.jpg"
+        cmd = [
+            'ffmpeg',
+            '-y',
+            '-loglevel', 'error',
+            '-i', video_path,
+            '-frames:v', '1',
+            '-vf', f"scale='min(iw,{self.poster_width})':-2",
+            '-q:v', '4',
+            poster_path
+        ]
+        if not self._run(cmd, "Poster extraction"):
+            return None
+        return self._relative(poster_path)
+
+    def _trim(self, video_path, start, end):
+        """
+        Cuts the clip down to [start, end] in place, without re-encoding.
+
+        A stream copy can only start on a keyframe, so the cut starts at the last keyframe
+        at or before `start`; the end needs no keyframe. Nothing happens if that would save
+        less than `CLIP_TRIM_MIN_SAVING_SECONDS`.
+
+        Args:
+            video_path (str): The HQ clip.
+            start (float): Seconds into the clip the visit starts.
+            end (float): Seconds into the clip the visit ends.
+
+        Returns:
+            bool: True if the clip was trimmed.
+        """
+        try:
+            keyframes, length = keyframe_offsets(video_path)
+        except (OSError, subprocess.SubprocessError) as e:
+            self.logger.error(f"Could not read keyframes of {video_path}: {e}")
+            return False
+        if not keyframes:
+            return False
+
+        cut = max((k for k in keyframes if k <= start), default=keyframes[0])
+        end = min(max(end, cut), length)
+        if length - (end - cut) < self.trim_min_saving:
+            return False
+
+        tmp_path = f"{os.path.splitext(video_path)[0]}_trim.mp4"
+        cmd = [
+            'ffmpeg',
+            '-y',
+            '-loglevel', 'error',
+            '-ss', f"{cut:.3f}",
+            '-i', video_path,
+            '-t', f"{end - cut:.3f}",
+            '-map', '0',
+            '-c', 'copy',
+            '-avoid_negative_ts', 'make_zero',
+            '-movflags', '+faststart',
+            tmp_path
+        ]
+        if not self._run(cmd, "Clip trim"):
+            return False
+        os.replace(tmp_path, video_path)
+        metrics.incr('clips.trimmed')
+        self.logger.info(f"Trimmed {video_path} to {cut:.1f}-{end:.1f}s of {length:.1f}s")
+        return True
+
+    def _faststart(self, video_path):
+        """
+        Makes sure the clip starts with its `moov` atom, remuxing (stream copy) in place if not.
+
+        Args:
+            video_path (str): The HQ clip.
+
+        Returns:
+            bool: True if the clip is (now) faststart.
+        """
+        try:
+            if is_faststart(video_path):
+                return True
+        except (OSError, struct.error) as e:
+            self.logger.error(f"Could not inspect {video_path}: {e}")
+            return False
+
+        tmp_path = f"{os.path.splitext(video_path)[0]}_faststart.mp4"
+        cmd = [
+            'ffmpeg',
+            '-y',
+            '-loglevel', 'error',
+            '-i', video_path,
+            '-map', '0',
+            '-c', 'copy',
+            '-movflags', '+faststart',
+            tmp_path
+        ]
+        if not self._run(cmd, "Faststart remux"):
+            return False
+        os.replace(tmp_path, video_path)
+        return True
+
+    def _run(self, cmd, what):
+        """
+        Runs an ffmpeg command. It inherits the worker thread's niceness.
+
+        Returns:
+            bool: True on success.
+        """
+        try:
+            subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=60, check=True)
+            return True
+        except subprocess.TimeoutExpired:
+            self.logger.error(f"{what} timed out")
+        except (OSError, subprocess.CalledProcessError) as e:
+            stderr = getattr(e, 'stderr', None)
+            self.logger.error(f"{what} failed: {stderr.decode(errors='replace') if stderr else e}")
+        return False
@@ -0,0 +1,241 @@
+# -----------------------------------------------------------------------------
+# Module: FFmpegCapture
+# Purpose: Decodes the LQ RTSP stream with ffmpeg into a raw gray/yuv420p pipe read into a reusable buffer,
+#          optionally stacked under the full-resolution colour picture of the same frame.
+# -----------------------------------------------------------------------------
+
+import subprocess
+import logging
+import cv2
+import numpy as np
+
+def probe_video_size(url):
+    """
+    Reads the picture size of a stream's first video track with ffprobe.
+
+    Args:
+        url (str): RTSP URL or local file.
+
+    Returns:
+        tuple or None: (width, height), or None if the stream could not be probed.
+    """
+    cmd = ['ffprobe', '-v', 'error']
+    if url.startswith('rtsp://'):
+        cmd += ['-rtsp_transport', 'tcp']
+    cmd += ['-select_streams', 'v:0', '-show_entries', 'stream=width,height', '-of', 'csv=p=0', url]
+    try:
+        output = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, timeout=15, check=True).stdout
+        width, height = (int(v) for v in output.decode().strip().split(',')[:2])
+        return width, height
+    except (OSError, ValueError, subprocess.SubprocessError):
+        return None
+
+
+class FFmpegCapture:
+    """
+    A `cv2.VideoCapture`-compatible capture backend backed by an ffmpeg rawvideo pipe.
+
+    ffmpeg scales and converts the stream at decode time, so Python only receives a
+    small single-plane (`gray`) or planar (`yuv420p`) frame instead of full BGR. Each
+    frame is read straight into one preallocated buffer; no per-frame allocation occurs.
+
+    With `source_size`, every yuv420p frame holds two pictures of the same instant: the
+    stream at its own resolution on top and the scaled detection picture below it (padded
+    to the same width). Detection reads the small luma plane; crops are cut in colour from
+    the full-resolution picture, so they keep the stream's quality and timestamp.
+    """
+
+    def __init__(self, rtsp_url, width, height, pixel_format='yuv420p', source_size=None):
+        """
+        Initialize and start the ffmpeg decoder.
+
+        Args:
+            rtsp_url (str): The RTSP URL to decode.
+            width (int): Output frame width (ffmpeg scale filter).
+            height (int): Output frame height (ffmpeg scale filter).
+            pixel_format (str): 'gray' or 'yuv420p'.
+            source_size (tuple, optional): Even (width, height) of the stream; stacks the
+                full-resolution picture above the scaled one (yuv420p only).
+
+        Raises:
+            ValueError: If the pixel format is unsupported or yuv420p dimensions are odd.
+        """
+        if pixel_format not in ('gray', 'yuv420p'):
+            raise ValueError(f"Unsupported pixel format: {pixel_format}")
+        if pixel_format == 'yuv420p' and (width % 2 or height % 2):
+            raise ValueError("yuv420p output requires even frame dimensions")
+        if source_size is not None:
+            if pixel_format != 'yuv420p' or source_size[0] % 2 or source_size[1] % 2:
+                raise ValueError("Stacked full-resolution output requires yuv420p and an even source size")
+            if width > source_size[0]:
+                raise ValueError("Scaled frame cannot be wider than the source")
+
+        self.rtsp_url = rtsp_url
+        self.width = int(width)
+        self.height = int(height)
+        self.pixel_format = pixel_format
+        self.source_size = tuple(int(v) for v in source_size) if source_size is not None else None
+        self.logger = logging.getLogger(__name__)
+
+        # yuv420p stores a full-size Y plane followed by quarter-size U and V planes,
+        # which is the (H * 3/2, W) single-channel layout OpenCV calls I420.
+        frame_width, frame_height = self.width, self.height
+        if self.source_size is not None:
+            frame_width, frame_height = self.source_size[0], self.source_size[1] + self.height
+        rows = frame_height * 3 // 2 if pixel_format == 'yuv420p' else frame_height
+        self._frame = np.empty((rows, frame_width), dtype=np.uint8)
+        self._view = memoryview(self._frame).cast('B')
+        self.proc = self._spawn()
+
+    def _spawn(self):
+        """
+        Launches the ffmpeg decoder process.
+
+        Returns:
+            subprocess.Popen or None: The process, or None if ffmpeg could not be started.
+        """
+        cmd = ['ffmpeg', '-loglevel', 'error']
+        # The transport option only exists for RTSP; local files are used for benchmark replays.
+        if self.rtsp_url.startswith('rtsp://'):
+            cmd += ['-rtsp_transport', 'tcp']
+        cmd += [
+            # Do not let ffmpeg buffer frames; we want the newest one as soon as it is decoded.
+            '-fflags', 'nobuffer',
+            '-flags', 'low_delay',
+            '-i', self.rtsp_url,
+            '-an'
+        ]
+        if self.source_size is not None:
+            # One output frame per input frame, so both pictures always share a timestamp.
+            src_w, src_h = self.source_size
+            cmd += [
+                '-filter_complex',
+                f'[0:v]crop={src_w}:{src_h}:0:0,format=yuv420p,split=2[full][det];'
+                f'[det]scale={self.width}:{self.height},pad={src_w}:{self.height}:0:0[small];'
+                f'[full][small]vstack=inputs=2[out]',
+                '-map', '[out]'
+            ]
+        else:
+            cmd += ['-vf', f'scale={self.width}:{self.height}']
+        cmd += [
+            '-pix_fmt', self.pixel_format,
+            '-f', 'rawvideo',
+            'pipe:1'
+        ]
+        try:
+            # stderr is discarded: an unread stderr pipe would eventually block ffmpeg.
+            return subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        except OSError as e:
+            self.logger.error(f"Failed to start ffmpeg decoder: {e}")
+            return None
+
+    def isOpened(self):
+        """
+        Returns:
+            bool: True while the ffmpeg process is running.
+        """
+        return self.proc is not None and self.proc.poll() is None
+
+    def grab(self):
+        """
+        Reads the next frame from the pipe into the reusable buffer.
+
+        Returns:
+            bool: True if a complete frame was read, False on EOF or a dead process.
+        """
+        if self.proc is None:
+            return False
+        offset = 0
+        size = len(self._view)
+        # Pipe reads can return short; keep filling the same buffer until the frame is complete.
+        while offset < size:
+            n = self.proc.stdout.readinto(self._view[offset:])
+            if not n:
+                return False
+            offset += n
+        return True
+
+    def retrieve(self):
+        """
+        Returns the most recently grabbed frame.
+
+        The array is the capture's internal buffer and is overwritten by the next `grab()`.
+
+        Returns:
+            tuple: (True, numpy.ndarray)
+        """
+        return True, self._frame
+
+    def read(self):
+        """
+        Grabs and returns the next frame.
+
+        Returns:
+            tuple: (ok (bool), frame (numpy.ndarray or None))
+        """
+        if not self.grab():
+            return False, None
+        return self.retrieve()
+
+    def release(self):
+        """Stops the ffmpeg process."""
+        if self.proc is None:
+            return
+        if self.proc.poll() is None:
+            self.proc.terminate()
+            try:
+                self.proc.wait(timeout=2)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+        self.proc.stdout.close()
+        self.proc = None
+
+
+def i420_luma(frame, height):
+    """
+    Returns the Y (luma) plane of an I420 frame as a zero-copy view.
+
+    Args:
+        frame (numpy.ndarray): Frame in (H * 3/2, W) I420 layout.
+        height (int): Height of the picture (H).
+
+    Returns:
+        numpy.ndarray: The (H, W) grayscale view.
+    """
+    return frame[:height]
+
+
+def i420_crop_to_bgr(frame, width, height, x1, y1, x2, y2):
+    """
+    Cuts a region out of an I420 frame and converts only that region to BGR.
+
+    Args:
+        frame (numpy.ndarray): Frame in (H * 3/2, W) I420 layout.
+        width (int): Picture width (W).
+        height (int): Picture height (H).
+        x1, y1, x2, y2 (int): Region in luma coordinates.
+
+    Returns:
+        numpy.ndarray: The BGR crop.
+    """
+    # Chroma is subsampled 2x2, so snap the region to even coordinates to keep
+    # every luma pixel paired with its own chroma sample.
+    x1, y1 = x1 & ~1, y1 & ~1
+    x2, y2 = min(width, (x2 + 1) & ~1), min(height, (y2 + 1) & ~1)
+    cw, ch = x2 - x1, y2 - y1
+
+    flat = frame.reshape(-1)
+    plane = width * height
+    quarter = plane // 4
+    u = flat[plane:plane + quarter].reshape(height // 2, width // 2)
+    v = flat[plane + quarter:plane + 2 * quarter].reshape(height // 2, width // 2)
+
+    # Repack the region as its own contiguous I420 image so OpenCV can convert it.
+    out = np.empty((ch * 3 // 2, cw), dtype=np.uint8)
+    out[:ch] = frame[y1:y2, x1:x2]
+    out_flat = out.reshape(-1)
+    crop_plane = cw * ch
+    crop_quarter = crop_plane // 4
+    out_flat[crop_plane:crop_plane + crop_quarter] = u[y1 // 2:y2 // 2, x1 // 2:x2 // 2].reshape(-1)
+    out_flat[crop_plane + crop_quarter:] = v[y1 // 2:y2 // 2, x1 // 2:x2 // 2].reshape(-1)
+    return cv2.cvtColor(out, cv2.COLOR_YUV2BGR_I420)
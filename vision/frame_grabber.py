@@ -0,0 +1,135 @@
+# -----------------------------------------------------------------------------
+# Module: FrameGrabber
+# Purpose: Drains a capture source on a background thread and keeps only the latest analysis frame.
+# -----------------------------------------------------------------------------
+
+import threading
+import time
+import logging
+import numpy as np
+
+from metrics import metrics
+
+class FrameGrabber:
+    """
+    Background reader that keeps an RTSP capture drained while the main loop is busy.
+
+    Every frame is pulled off the socket with `grab()` so the decoder never falls
+    behind, but only every Nth frame is decoded with `retrieve()`. Decoded frames
+    land in a single "latest frame" slot; unconsumed frames are overwritten rather
+    than queued, so a consumer always receives the most recent analysis frame.
+    """
+
+    def __init__(self, cap, frame_skip=1):
+        """
+        Initialize the FrameGrabber.
+
+        Args:
+            cap: An opened capture object exposing `grab()` and `retrieve()` (e.g. cv2.VideoCapture).
+            frame_skip (int): Decode only every Nth grabbed frame.
+        """
+        self.cap = cap
+        self.frame_skip = max(1, int(frame_skip))
+        self.frames_grabbed = 0
+        self.frames_dropped = 0
+        self.failed = False
+        self.timestamp = None
+        self.logger = logging.getLogger(__name__)
+
+        # Two reusable buffers: one may be held by the consumer while the other
+        # is the latest slot being (over)written by the reader thread.
+        self._buffers = [None, None]
+        self._latest = None
+        self._held = None
+        self._seq = 0
+        self._read_seq = 0
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Starts the background reader thread."""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="FrameGrabber", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=2.0):
+        """
+        Signals the reader thread to stop and waits for it briefly.
+
+        Args:
+            timeout (float): Seconds to wait for the thread to exit. `grab()` may block on
+                a dead socket, so the thread is a daemon and we do not wait forever.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        """Reader loop: grab every frame, decode only the ones we will analyze."""
+        while not self._stop.is_set():
+            if not self.cap.grab():
+                self.logger.warning("Frame grabber lost the stream")
+                with self._cond:
+                    self.failed = True
+                    self._cond.notify_all()
+                return
+
+            self.frames_grabbed += 1
+            metrics.incr('frames.grabbed')
+            if self.frames_grabbed % self.frame_skip != 0:
+                continue
+
+            ret, frame = self.cap.retrieve()
+            if not ret or frame is None:
+                continue
+            self._publish(frame)
+
+    def _publish(self, frame):
+        """
+        Copies a decoded frame into the latest-frame slot.
+
+        Args:
+            frame (numpy.ndarray): The decoded frame.
+        """
+        with self._cond:
+            if self._seq > self._read_seq:
+                # The previous frame was never consumed; it is replaced, not queued.
+                self.frames_dropped += 1
+                metrics.incr('frames.dropped')
+
+            # Never write into the buffer the consumer is currently working on.
+            idx = 1 if self._held == 0 else 0
+            buf = self._buffers[idx]
+            if buf is None or buf.shape != frame.shape or buf.dtype != frame.dtype:
+                buf = self._buffers[idx] = np.empty_like(frame)
+            np.copyto(buf, frame)
+
+            self._latest = idx
+            self._seq += 1
+            self.timestamp = time.time()
+            self._cond.notify_all()
+
+    def read(self, timeout=5.0):
+        """
+        Returns the newest analysis frame that has not been returned before.
+
+        The returned array is only valid until the next call to `read()`, since its
+        buffer is recycled by the reader thread afterwards.
+
+        Args:
+            timeout (float): Maximum seconds to wait for a new frame.
+
+        Returns:
+            numpy.ndarray or None: The frame, or None on timeout or stream failure.
+        """
+        with self._cond:
+            # Calling read() again means the consumer is done with the previous frame.
+            self._held = None
+            self._cond.wait_for(lambda: self._seq > self._read_seq or self.failed, timeout)
+            if self._seq <= self._read_seq:
+                return None
+            self._read_seq = self._seq
+            self._held = self._latest
+            return self._buffers[self._held]
@@ -7,45 +7,80 @@ import os
 import json
 import logging
 import time
+import random
+import threading
+import cv2
+import httpx
+import numpy as np
 from google import genai
 from google.genai import types
+from google.genai import errors
+
+from metrics import metrics
 
 class GeminiClient:
     """
     Client for interacting with the Gemini API using the official google-genai SDK.
     """
 
-    def __init__(self, api_key):
+    def __init__(self, api_key, config=None):
         """
         Initialize the GeminiClient.
 
         Args:
             api_key (str): The Google Gemini API Key.
+            config (dict, optional): Configuration dictionary.
         """
         self.api_key = api_key
+        self.config = config or {}
+        self.request_timeout = self.config.get('GEMINI_TIMEOUT_SECONDS', 15)
+        self.max_retries = self.config.get('GEMINI_MAX_RETRIES', 2)
+        self.retry_base = self.config.get('GEMINI_RETRY_BASE_SECONDS', 1.0)
+        self.jpeg_quality = self.config.get('GEMINI_JPEG_QUALITY', 90)
+        self.max_dimension = self.config.get('GEMINI_MAX_IMAGE_DIMENSION', 512)
+        # Per-thread resize buffers; analysis workers call the client concurrently.
+        self._local = threading.local()
         # Using Gemini 2.5 Flash for speed and cost efficiency
         self.client = genai.Client(api_key=self.api_key)
         self.model_id = "gemini-2.5-flash"
         self.logger = logging.getLogger(__name__)
 
-    def analyze_image(self, image_path, context=None):
+    def analyze_image(self, image, context=None, deadline=None):
         """
         Sends an image to Gemini for analysis.
 
+        Transient failures (timeouts, 5xx, 429) are retried with jittered exponential
+        backoff until `GEMINI_MAX_RETRIES` or the deadline is reached.
+
         Args:
-            image_path (str): Path to the image file.
+            image (numpy.ndarray, bytes or str): A BGR crop, encoded JPEG bytes, or a path to a JPEG file.
             context (dict, optional): Metadata about the image (location, time, date, setting).
+            deadline (float, optional): `time.monotonic()` value after which no further attempt is made.
 
         Returns:
             dict: The JSON response with bird identification data or None if failed.
         """
-        try:
-            if not os.path.exists(image_path):
-                self.logger.error(f"Image not found: {image_path}")
-                return None
+        return self.analyze_images([image], context=context, deadline=deadline)
+
+    def analyze_images(self, images, context=None, deadline=None):
+        """
+        Sends several frames of the same moment to Gemini in a single request.
+
+        Args:
+            images (list): Crops (numpy.ndarray), encoded JPEG bytes or file paths, best frame first.
+            context (dict, optional): Metadata about the images (location, time, date, setting).
+            deadline (float, optional): `time.monotonic()` value after which no further attempt is made.
 
-            with open(image_path, "rb") as f:
-                image_bytes = f.read()
+        Returns:
+            dict: The JSON response with bird identification data or None if failed.
+        """
+        try:
+            image_parts = []
+            for image in images:
+                image_bytes = self._image_bytes(image)
+                if image_bytes is None:
+                    return None
+                image_parts.append(types.Part.from_bytes(data=image_bytes, mime_type="image/jpeg"))
 
             # Build context string
             ctx = context or {}
@@ -53,6 +88,13 @@ class GeminiClient:
             time_str = ctx.get("time", "Unknown Time")
             date_str = ctx.get("date", "Unknown Date")
             setting = ctx.get("setting", "Outdoor")
+
+            burst_note = ""
+            if len(image_parts) > 1:
+                burst_note = (
+                    f"- Burst: {len(image_parts)} crops of the same subject from consecutive frames, sharpest first. "
+                    "Combine the evidence from all of them and answer once for the subject.\n"
+                )
             
             prompt = (
                 "You are an expert ornithologist and avian biologist. "
@@ -64,6 +106,7 @@ class GeminiClient:
                 f"- Date & Time: {date_str} at {time_str}\n"
                 f"- Setting: {setting}\n"
                 "- Image Source: Cropped frame from a low-quality RTSP security camera (expect motion blur/compression).\n"
+                f"{burst_note}"
                 "\n\n"
                 "GUIDELINES:\n"
                 "- Use the provided location and date to filter for species likely to be present in this region and season.\n"
@@ -84,16 +127,9 @@ class GeminiClient:
 
             start_time = time.time()
             
-            # Using the official SDK
-            response = self.client.models.generate_content(
-                model=self.model_id,
-                contents=[
-                    prompt,
-                    types.Part.from_bytes(data=image_bytes, mime_type="image/jpeg")
-                ],
-                config=types.GenerateContentConfig(
-                    response_mime_type='application/json'
-                )
+            response = self._generate_with_retry(
+                [prompt] + image_parts,
+                deadline
             )
             
             elapsed = time.time() - start_time
@@ -115,3 +151,123 @@ class GeminiClient:
         except Exception as e:
             self.logger.error(f"Gemini Client SDK Exception: {e}")
             return None
+
+    def _image_bytes(self, image):
+        """
+        Turns an image argument into JPEG bytes for the request payload.
+
+        Args:
+            image (numpy.ndarray, bytes or str): A crop, encoded JPEG bytes, or a file path.
+
+        Returns:
+            bytes or None: The JPEG bytes, or None if the image could not be read or encoded.
+        """
+        if isinstance(image, (bytes, bytearray, memoryview)):
+            return bytes(image)
+        if isinstance(image, np.ndarray):
+            return self.encode_jpeg(image)
+
+        if not os.path.exists(image):
+            self.logger.error(f"Image not found: {image}")
+            return None
+        with open(image, "rb") as f:
+            return f.read()
+
+    def encode_jpeg(self, image):
+        """
+        Encodes a crop as JPEG in memory, downscaling it to `GEMINI_MAX_IMAGE_DIMENSION`.
+
+        Larger crops add upload time and tokens without helping identification.
+
+        Args:
+            image (numpy.ndarray): BGR or grayscale crop.
+
+        Returns:
+            bytes or None: The JPEG bytes, or None if encoding failed.
+        """
+        with metrics.timer('encode'):
+            return self._encode_jpeg(image)
+
+    def _encode_jpeg(self, image):
+        """Resizes and JPEG-encodes a crop (see `encode_jpeg`)."""
+        h, w = image.shape[:2]
+        scale = self.max_dimension / max(h, w)
+        if scale < 1:
+            size = (max(1, int(w * scale)), max(1, int(h * scale)))
+            shape = (size[1], size[0]) + image.shape[2:]
+            # Reuse this thread's resize buffer when the crop size repeats (e.g. a perched bird).
+            buf = getattr(self._local, 'resize_buf', None)
+            if buf is None or buf.shape != shape or buf.dtype != image.dtype:
+                buf = self._local.resize_buf = np.empty(shape, dtype=image.dtype)
+            image = cv2.resize(image, size, dst=buf, interpolation=cv2.INTER_AREA)
+
+        ok, encoded = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, int(self.jpeg_quality)])
+        if not ok:
+            self.logger.error("Failed to encode crop as JPEG")
+            return None
+        return encoded.tobytes()
+
+    def _generate_with_retry(self, contents, deadline=None):
+        """
+        Calls `generate_content` with a per-request timeout and retries transient errors.
+
+        Args:
+            contents (list): The prompt and image parts.
+            deadline (float, optional): `time.monotonic()` value bounding all attempts.
+
+        Returns:
+            The SDK response object.
+
+        Raises:
+            Exception: The last error if all attempts failed or the deadline passed.
+        """
+        attempt = 0
+        while True:
+            timeout = self.request_timeout
+            if deadline is not None:
+                timeout = min(timeout, deadline - time.monotonic())
+                if timeout <= 0:
+                    raise TimeoutError("Analysis deadline exceeded before request could be sent")
+
+            try:
+                metrics.incr('gemini.requests')
+                # Using the official SDK
+                return self.client.models.generate_content(
+                    model=self.model_id,
+                    contents=contents,
+                    config=types.GenerateContentConfig(
+                        response_mime_type='application/json',
+                        # The SDK expects the HTTP timeout in milliseconds.
+                        http_options=types.HttpOptions(timeout=int(timeout * 1000))
+                    )
+                )
+            except Exception as e:
+                metrics.incr('gemini.errors')
+                if attempt >= self.max_retries or not self._is_transient(e):
+                    raise
+                # Full jitter around an exponential step so parallel workers do not retry in lockstep.
+                delay = self.retry_base * (2 ** attempt) * random.uniform(0.5, 1.5)
+                if deadline is not None and time.monotonic() + delay >= deadline:
+                    raise
+                attempt += 1
+                metrics.incr('gemini.retries')
+                self.logger.warning(f"Gemini request failed ({e}), retry {attempt}/{self.max_retries} in {delay:.1f}s")
+                time.sleep(delay)
+
+    def _is_transient(self, error):
+        """
+        Decides whether a failed request is worth retrying.
+
+        Args:
+            error (Exception): The exception raised by the SDK.
+
+        Returns:
+            bool: True for rate limits, server errors and network/timeout errors.
+        """
+        if isinstance(error, errors.ClientError):
+            # 4xx means the request itself is wrong, except for timeouts and rate limiting.
+            return error.code in (408, 429)
+        if isinstance(error, errors.ServerError):
+            return True
+        # The SDK talks to the API through httpx; anything else (bad responses, bugs) is not retried.
+        return isinstance(error, (httpx.TimeoutException, httpx.TransportError, TimeoutError, ConnectionError))
@@ -6,18 +6,28 @@
 import os
 import time
 import yaml
+import queue
 import logging
 import threading
 import datetime
-import requests
-import gc
+import cv2
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from suntime import Sun
 from pathlib import Path
 
 from motion_detector import MotionDetector
 from gemini_client import GeminiClient
 from recorder import Recorder
+from analysis_pipeline import AnalysisPipeline
+from analysis_cache import AnalysisCache
+from prefilter import PreFilter
+from camera_worker import CameraWorker, DEFAULT_CAMERA_ID, load_cameras, camera_config, run_camera_process
+from metrics import metrics, MetricsExporter
+from outbox import Outbox
+from derivatives import DerivativeWorker
+from tiering import ClipTiering
+from scheduler import ActivityHistogram, DutyCycleScheduler
 
 # Load environment variables
 load_dotenv(dotenv_path="../.env")
@@ -40,54 +50,72 @@ def load_config():
 CONFIG = load_config()
 
 # Global State
-LAST_SIGHTING_TIME = 0
-LAST_ANALYSIS_TIME = 0
 SIGHTING_COOLDOWN = CONFIG.get('SIGHTING_COOLDOWN_MINUTES', CONFIG.get('GLOBAL_COOLDOWN_MINUTES', 5)) * 60
-ANALYSIS_COOLDOWN = CONFIG.get('ANALYSIS_COOLDOWN_SECONDS', CONFIG.get('API_COOLDOWN_SECONDS', 30))
-COOLDOWN_ACTIVE = False
+# Analysis results arrive on worker threads; this guards the sighting cooldown check-and-set.
+SIGHTING_LOCK = threading.Lock()
+# Camera processes are spawned, not forked: the main process already runs threads.
+MP_CONTEXT = multiprocessing.get_context('spawn')
 
-# Components
-motion_detector = MotionDetector(os.getenv("RTSP_URL_LQ"), CONFIG)
-gemini_client = GeminiClient(os.getenv("GEMINI_API_KEY"))
-recorder = Recorder(os.getenv("RTSP_URL_HQ"), CONFIG)
+# Components (created by init_components so offline tools can substitute stand-ins)
+CAMERAS = []
+motion_detector = None
+gemini_client = None
+recorders = {}
+# camera_id -> shared Value holding the Unix time the camera's sighting cooldown ends
+cooldowns = {}
+# camera_id -> shared Value holding the Unix time the camera last saw a visitor
+last_motion = {}
+analysis_cache = None
+prefilter = None
+analysis_pipeline = None
+outbox = None
+derivative_worker = None
+clip_tiering = None
+activity = None
+idle_schedule = None
 backend_url = f"http://localhost:{os.getenv('PORT', 3100)}/api"
 
-def check_daylight():
+def save_crop(crop, path):
     """
-    Checks if it is currently daylight at the configured location.
+    Writes an LQ crop to disk as JPEG.
+
+    Args:
+        crop (numpy.ndarray): The crop.
+        path (str): Destination path.
+
+    Returns:
+        bool: True if the file was written.
     """
-    lat = float(os.getenv("LOCATION_LAT", 40.7128))
-    lng = float(os.getenv("LOCATION_LNG", -74.0060))
-    sun = Sun(lat, lng)
-    
-    now = datetime.datetime.now(datetime.timezone.utc)
-    try:
-        sunrise = sun.get_sunrise_time()
-        sunset = sun.get_sunset_time()
-        
-        # Handle cases where sunrise/sunset might be tomorrow/yesterday depending on time
-        # This is a simplified check
-        if sunrise < sunset:
-            return sunrise < now < sunset
-        else:
-             # Polar night/day handling (simplified)
-            return True 
-    except Exception as e:
-        logger.warning(f"Suntime calculation failed: {e}. Defaulting to True.")
-        return True
+    quality = CONFIG.get('LQ_CROP_JPEG_QUALITY', 90)
+    if not cv2.imwrite(path, crop, [cv2.IMWRITE_JPEG_QUALITY, quality]):
+        logger.error(f"Failed to write crop {path}")
+        return False
+    return True
 
-def handle_sighting(crop, crop_path, species_data):
+def handle_sighting(crop, species_data, detected_at=None, camera_id=DEFAULT_CAMERA_ID):
     """
     Handles the sequence of actions when a bird is detected.
     Runs in a separate thread to not block motion detection (if we wanted continuous monitoring, 
     but here we want to record HQ so we might pause motion detection anyway).
+
+    Args:
+        crop (numpy.ndarray): The LQ crop that was analyzed; written to disk only now
+            that the sighting is confirmed.
+        species_data (dict): The Gemini analysis result.
+        detected_at (float, optional): Unix time of the motion trigger, used to place the
+            pre-roll when the ring buffer is enabled.
+        camera_id (str): Camera that saw the bird; selects its HQ recorder and tags the sighting.
     """
-    global LAST_SIGHTING_TIME
-    LAST_SIGHTING_TIME = time.time()
-    
     timestamp = datetime.datetime.now().isoformat()
     species = species_data.get('species', 'Unknown')
     reason = species_data.get('identification_reason', 'Detected by AI')
+    filename_base = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    if camera_id != DEFAULT_CAMERA_ID:
+        # Two feeders can confirm a bird within the same second.
+        filename_base = f"{filename_base}_{camera_id}"
+
+    crop_path = f"../static/captures/{filename_base}_lq.jpg"
+    save_crop(crop, crop_path)
     
     # Phase 1: Notify Backend
     payload = {
@@ -95,19 +123,18 @@ def handle_sighting(crop, crop_path, species_data):
         "species": species,
         "reason": reason,
         "timestamp": timestamp,
+        "camera_id": camera_id,
         "lq_crop_path": os.path.relpath(crop_path, "../static")
     }
     
-    try:
-        logger.info(f"Sending Phase 1 Notification: {species}")
-        # In a real scenario, you might want to retry this
-        requests.post(f"{backend_url}/webhook/notify", json=payload)
-    except Exception as e:
-        logger.error(f"Failed to send Phase 1 notification: {e}")
+    # Persisted first and delivered in order by the outbox, even across server or vision restarts.
+    logger.info(f"Queueing Phase 1 Notification: {species}")
+    client_ref = outbox.notify(payload)
+    if detected_at is not None:
+        metrics.observe('sighting.detection_to_notify', time.time() - detected_at)
 
     # Phase 2: Record HQ Assets
     # Generate filenames based on timestamp
-    filename_base = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
     hq_snap_path = f"../static/captures/{filename_base}_hq.jpg"
     hq_video_path = f"../static/captures/{filename_base}_hq.mp4"
     
@@ -115,122 +142,251 @@ def handle_sighting(crop, crop_path, species_data):
     # We'll use absolute paths for safety in the DB
     os.makedirs(os.path.dirname(hq_snap_path), exist_ok=True)
     
-    # Take Snapshot
-    recorder.take_snapshot(hq_snap_path)
-    
-    # Record Video
+    # Take Snapshot and Record Video from a single HQ session
     duration = CONFIG.get('VIDEO_DURATION_SECONDS', 30)
-    recorder.record_clip(hq_video_path, duration=duration)
+    capture = recorders[camera_id].capture_sighting(
+        hq_snap_path,
+        hq_video_path,
+        duration=duration,
+        snapshot_offset=CONFIG.get('SNAPSHOT_OFFSET_SECONDS', 0),
+        trigger_time=detected_at
+    )
+    if not capture['snapshot'] or not capture['video']:
+        logger.warning(f"HQ capture incomplete: snapshot={capture['snapshot']}, video={capture['video']}")
+
+    # The visit runs from the trigger to the last frame the camera still saw a visitor in;
+    # the rest of the fixed-length clip is trimmed off in post-processing.
+    active_span = None
+    if capture.get('clip_start') is not None and detected_at is not None:
+        last_seen = max(last_motion[camera_id].value, detected_at)
+        active_span = (
+            detected_at - CONFIG.get('CLIP_TRIM_LEAD_SECONDS', 5) - capture['clip_start'],
+            last_seen + CONFIG.get('CLIP_TRIM_TAIL_SECONDS', 3) - capture['clip_start']
+        )
     
-    # Send Phase 2 Update
+    # Send Phase 2 Update, addressed by the id the server returned for Phase 1
     update_payload = {
-        "timestamp": timestamp, # Use same timestamp to identify record? Or return ID from Phase 1?
-        # Better: Phase 1 returns an ID, here we assume backend can match by timestamp or we should keep ID.
-        # For simplicity, we'll assume the backend can match the most recent 'recording' status or we send enough data.
-        # Let's send the original timestamp to match.
-        "original_timestamp": timestamp,
         "status": "ready",
         "hq_snapshot_path": os.path.relpath(hq_snap_path, "../static"),
         "hq_video_path": os.path.relpath(hq_video_path, "../static")
     }
     
-    try:
-        logger.info("Sending Phase 2 Update")
-        requests.post(f"{backend_url}/webhook/update", json=update_payload)
-    except Exception as e:
-        logger.error(f"Failed to send Phase 2 update: {e}")
-        
-    # Cleanup memory
-    gc.collect()
-
-def main():
-    global LAST_ANALYSIS_TIME, COOLDOWN_ACTIVE
+    logger.info("Queueing Phase 2 Update")
+    outbox.update(client_ref, update_payload)
+    if derivative_worker is not None:
+        # Trimmed clip, thumbnails and poster follow as a separate event once ready.
+        derivative_worker.submit(client_ref, hq_snap_path, hq_video_path, active_span)
+    if detected_at is not None:
+        metrics.observe('sighting.detection_to_ready', time.time() - detected_at)
+    metrics.incr('sightings')
+    # Feeds the per-hour analysis rate of this camera (see scheduler.py).
+    activity.record(camera_id, detected_at)
+
+def clips_idle():
+    """
+    Tells the clip tiering when it may run.
+
+    Returns:
+        bool: True at night, or when no camera has seen a visitor for `TIERING_IDLE_MINUTES`.
+    """
+    if not idle_schedule.is_daylight():
+        return True
+    latest = max((value.value for value in last_motion.values()), default=0.0)
+    return time.time() - latest > CONFIG.get('TIERING_IDLE_MINUTES', 15) * 60
+
+def keep_rejected_crop(candidate):
+    """
+    Optionally keeps the crop of a candidate that was not a bird, for tuning.
+    The write happens on a background writer so the analysis worker is not held up.
+
+    Args:
+        candidate (Candidate): The rejected candidate.
+    """
+    if os.getenv("KEEP_LQ_SNAPSHOTS", "false").lower() == "true":
+        path = f"../static/captures/rejected_lq_{int(candidate.detected_at * 1000)}.jpg"
+        crop_writer.submit(save_crop, candidate.crop, path)
+
+def handle_analysis(candidate, analysis):
+    """
+    Receives an analysis result from the pipeline and starts a sighting if it is a bird.
+    Called from an analysis worker thread.
+
+    Args:
+        candidate (Candidate): The analyzed candidate.
+        analysis (dict or None): The Gemini result, None if the call failed.
+    """
+    if candidate.cached:
+        logger.info(f"Cached verdict for near-duplicate crop: {analysis} (cache: {analysis_cache.stats()})")
+    else:
+        logger.info(f"Gemini response: {analysis}")
+
+    if not analysis or not analysis.get('is_bird'):
+        logger.info(f"Not a bird or analysis failed. Pipeline: {analysis_pipeline.summary()}")
+        keep_rejected_crop(candidate)
+        return
+
+    # Several workers may confirm the same visit; only the first one starts a sighting.
+    # Each camera has its own cooldown, which also pauses that camera's detection loop.
+    cooldown_until = cooldowns[candidate.camera_id]
+    with SIGHTING_LOCK:
+        if time.time() < cooldown_until.value:
+            logger.info(f"Bird confirmed during sighting cooldown of camera {candidate.camera_id}, ignoring.")
+            return
+        cooldown_until.value = time.time() + SIGHTING_COOLDOWN
+
+    # Whatever is still queued from this camera shows the same visit.
+    analysis_pipeline.clear(candidate.camera_id)
+
+    # Check confidence if available
+    confidence = analysis.get('confidence', 1.0)
+    logger.info(f"Bird detected ({confidence:.2f}): {analysis.get('species')}")
+
+    # Start handling thread
+    t = threading.Thread(target=handle_sighting, args=(candidate.crop, analysis, candidate.detected_at, candidate.camera_id))
+    t.start()
+
+# Single background writer for optional rejected-crop snapshots; keeps SD card writes off hot threads.
+crop_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="CropWriter")
+
+def init_components(detector=None, client=None, hq_recorder=None, captures_dir="../static/captures"):
+    """
+    Creates the service components. Anything not passed in is built from the environment
+    and settings.yaml; the offline benchmark passes a replay detector and stub clients.
+
+    Args:
+        detector (MotionDetector, optional): Motion detector to use (single-camera mode).
+        client (GeminiClient, optional): Gemini client to use.
+        hq_recorder (Recorder, optional): HQ recorder to use for every camera.
+        captures_dir (str): Directory whose past sightings seed the activity histogram.
+    """
+    global CAMERAS, motion_detector, gemini_client, analysis_cache, prefilter, analysis_pipeline, outbox, derivative_worker, clip_tiering, activity, idle_schedule
+    CAMERAS = load_cameras(CONFIG)
+    shared_host = len(CAMERAS) > 1
+    if not shared_host:
+        motion_detector = detector or MotionDetector(CAMERAS[0]['lq_url'], camera_config(CONFIG, CAMERAS[0]))
+    gemini_client = client or GeminiClient(os.getenv("GEMINI_API_KEY"), CONFIG)
+    for camera in CAMERAS:
+        recorders[camera['id']] = hq_recorder or Recorder(camera['hq_url'], camera_config(CONFIG, camera, shared_host))
+        cooldowns[camera['id']] = MP_CONTEXT.Value('d', 0.0)
+        last_motion[camera['id']] = MP_CONTEXT.Value('d', 0.0)
+    outbox = Outbox(backend_url, CONFIG)
+    activity = ActivityHistogram(CONFIG)
+    activity.seed_from_captures(captures_dir, DEFAULT_CAMERA_ID)
+    idle_schedule = DutyCycleScheduler(CONFIG, activity, DEFAULT_CAMERA_ID)
+    if CONFIG.get('DERIVATIVES_ENABLED', True):
+        derivative_worker = DerivativeWorker(CONFIG, on_ready=outbox.derivatives)
+    if CONFIG.get('TIERING_ENABLED', True):
+        clip_tiering = ClipTiering(CONFIG, is_idle=clips_idle, on_resized=outbox.resized)
+    analysis_cache = AnalysisCache(CONFIG) if CONFIG.get('ANALYSIS_CACHE_ENABLED', True) else None
+    prefilter = PreFilter(CONFIG) if CONFIG.get('PREFILTER_ENABLED', False) else None
+    analysis_pipeline = AnalysisPipeline(
+        gemini_client, CONFIG,
+        on_result=handle_analysis,
+        cache=analysis_cache,
+        prefilter=prefilter
+    )
+
+def start_camera_process(index, camera, candidates):
+    """
+    Starts the capture/detection process of one camera.
+
+    Args:
+        index (int): Position of the camera in CAMERAS; picks its metrics port and default CPU.
+        camera (dict): Camera as returned by `load_cameras`.
+        candidates (multiprocessing.Queue): Queue the process submits candidates to.
+
+    Returns:
+        multiprocessing.Process: The started process.
+    """
+    config = camera_config(CONFIG, camera, shared_host=True)
+    if camera['cpu'] is None and CONFIG.get('CAMERA_PIN_CPUS', True) and hasattr(os, 'sched_getaffinity'):
+        # Leave the first core to the analysis/recording process when there are enough of them.
+        cpus = sorted(os.sched_getaffinity(0))
+        camera = dict(camera, cpu=cpus[(index + 1) % len(cpus)])
+    metrics_port = CONFIG.get('METRICS_PORT', 0)
+    dump_path = CONFIG.get('METRICS_DUMP_PATH')
+    process = MP_CONTEXT.Process(
+        target=run_camera_process,
+        args=(camera, config, candidates, cooldowns[camera['id']], last_motion[camera['id']],
+              metrics_port + index + 1 if metrics_port else 0,
+              f"{dump_path}.{camera['id']}" if dump_path else None),
+        name=f"Camera-{camera['id']}",
+        daemon=True
+    )
+    process.start()
+    return process
+
+def run_cameras():
+    """
+    Multi-camera mode: runs each camera in its own process and feeds their candidates
+    into the shared analysis pipeline. Camera processes that die are restarted.
+    """
+    candidates = MP_CONTEXT.Queue(maxsize=CONFIG.get('CAMERA_QUEUE_SIZE', 16))
+    processes = {camera['id']: start_camera_process(i, camera, candidates) for i, camera in enumerate(CAMERAS)}
+    logger.info(f"Started {len(processes)} camera processes: {', '.join(processes)}")
+
+    while True:
+        try:
+            analysis_pipeline.submit(candidates.get(timeout=5))
+        except queue.Empty:
+            pass
+
+        for i, camera in enumerate(CAMERAS):
+            process = processes[camera['id']]
+            if not process.is_alive():
+                logger.error(f"Camera process {camera['id']} exited ({process.exitcode}), restarting")
+                processes[camera['id']] = start_camera_process(i, camera, candidates)
+
+def main(max_frames=None, follow_daylight=True):
+    """
+    Runs the service. With one camera, capture and detection run in this process;
+    with a CAMERAS list, every camera gets its own process.
+
+    Args:
+        max_frames (int, optional): Stop once this many stream frames have been grabbed
+            (single-camera offline replays). Runs forever if None.
+        follow_daylight (bool): Sleep through the night. Disabled for offline replays.
+    """
     logger.info("Starting Vision Service...")
+
+    if analysis_pipeline is None:
+        init_components()
+
+    exporter = MetricsExporter(metrics, CONFIG)
+    exporter.start()
     
     # Create capture directory
     Path("../static/captures").mkdir(parents=True, exist_ok=True)
-    
-    if not motion_detector.connect():
-        logger.error("Could not connect to LQ Stream. Exiting.")
-        return
 
-    while True:
-        # Dynamic Sleep
-        if not check_daylight():
-            sleep_min = CONFIG.get('NIGHT_SLEEP_MINUTES', 15)
-            logger.info(f"It is night time. Sleeping for {sleep_min} minutes...")
-            time.sleep(sleep_min * 60)
-            continue
-            
-        # Efficient yield: check cooldowns before reading from the camera stream
-        now = time.time()
-        sighting_rem = max(0, int(SIGHTING_COOLDOWN - (now - LAST_SIGHTING_TIME)))
-        analysis_rem = max(0, int(ANALYSIS_COOLDOWN - (now - LAST_ANALYSIS_TIME)))
-        
-        if sighting_rem > 0 or analysis_rem > 0:
-            if not COOLDOWN_ACTIVE:
-                logger.info(f"Cooldown active: Sighting({sighting_rem}s remaining), Analysis({analysis_rem}s remaining)")
-                COOLDOWN_ACTIVE = True
-            time.sleep(1)
-            continue
-        
-        if COOLDOWN_ACTIVE:
-            logger.info("Cooldowns expired. Resuming motion detection.")
-            COOLDOWN_ACTIVE = False
-
-        frame = motion_detector.read_frame()
-        if frame is None:
-            continue
-
-        detected, crop, bounds = motion_detector.detect(frame)
-        
-        if detected:
-            logger.info("Motion detected! Analyze with Gemini...")
-            
-            # Save LQ Crop temporarily
-            temp_crop_path = f"../static/captures/temp_lq_{int(time.time())}.jpg"
-            import cv2
-            cv2.imwrite(temp_crop_path, crop)
-            
-            # Call Gemini
-            context = {
-                "location": os.getenv("LOCATION_NAME", "Unknown"),
-                "time": datetime.datetime.now().strftime("%I:%M %p"),
-                "date": datetime.datetime.now().strftime("%Y-%m-%d"),
-                "setting": os.getenv("FEEDER_SETTING", "Bird Feeder")
-            }
-            analysis = gemini_client.analyze_image(temp_crop_path, context=context)
-            logger.info(f"Gemini response: {analysis}")
-            LAST_ANALYSIS_TIME = time.time()
-            
-            if analysis and analysis.get('is_bird'):
-                # Check confidence if available
-                confidence = analysis.get('confidence', 1.0)
-                logger.info(f"Bird detected ({confidence:.2f}): {analysis.get('species')}")
-                    
-                # Start handling thread
-                t = threading.Thread(target=handle_sighting, args=(crop, temp_crop_path, analysis))
-                t.start()
-                    
-                # Wait a bit to prevent re-triggering immediately on the same bird
-                # Though the global cooldown covers this, adding a small sleep helps stability
-                time.sleep(CONFIG.get('STABILITY_SLEEP_SECONDS', 5))
-            else:
-                logger.info("Not a bird or analysis failed.")
-                # Clean up temp file if not needed (to save disk space)
-                if os.getenv("KEEP_LQ_SNAPSHOTS", "false").lower() != "true":
-                    try:
-                        os.remove(temp_crop_path)
-                    except Exception as e:
-                        logger.error(f"Failed to delete temp file {temp_crop_path}: {e}")
-        
-        # Free up memory periodically
-        gc_interval = CONFIG.get('GC_INTERVAL_FRAMES', 1000)
-        if motion_detector.frame_count > 0 and motion_detector.frame_count % gc_interval == 0:
-            collected = gc.collect()
-            logger.info(f"Garbage collection: {collected} objects collected (Frame: {motion_detector.frame_count})")
-            
-        # Small sleep to yield CPU if loop is too tight, but read_frame blocks so it's okay.
+    # Keep the HQ streams recording into rings so clips can start before the trigger
+    if CONFIG.get('PREROLL_ENABLED', False):
+        for recorder in recorders.values():
+            recorder.start_ring_buffer()
+
+    outbox.start()
+    analysis_pipeline.start()
+    if clip_tiering is not None:
+        clip_tiering.start()
+
+    if motion_detector is None:
+        run_cameras()
+    else:
+        camera_id = CAMERAS[0]['id']
+        config = camera_config(CONFIG, CAMERAS[0])
+        scheduler = DutyCycleScheduler(config, activity, camera_id)
+        worker = CameraWorker(camera_id, motion_detector, config, analysis_pipeline.submit, cooldowns[camera_id], scheduler,
+                              last_motion=last_motion[camera_id])
+        worker.run(max_frames=max_frames, follow_daylight=follow_daylight)
+
+    analysis_pipeline.stop()
+    if derivative_worker is not None:
+        derivative_worker.stop()
+    if clip_tiering is not None:
+        clip_tiering.stop()
+    outbox.stop()
+    for recorder in recorders.values():
+        recorder.stop_ring_buffer()
+    exporter.stop()
 
 if __name__ == "__main__":
     main()
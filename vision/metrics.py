@@ -0,0 +1,386 @@
+# -----------------------------------------------------------------------------
+# Module: Metrics
+# Purpose: Low-overhead per-stage timers and counters shared by the vision components.
+# -----------------------------------------------------------------------------
+
+import gc
+import os
+import re
+import json
+import time
+import logging
+import threading
+import functools
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Histogram bucket upper bounds in seconds, from sub-millisecond frame stages up to clip recordings.
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+class Metrics:
+    """
+    In-process registry of stage timings, counters and gauges.
+
+    Each timer keeps a count, a running total, fixed histogram buckets and a bounded
+    reservoir of the most recent samples for percentiles, so memory stays flat however
+    long the service runs. Gauges are either set directly or read from a callback at export.
+    """
+
+    def __init__(self, reservoir_size=2048):
+        """
+        Initialize the Metrics registry.
+
+        Args:
+            reservoir_size (int): Number of recent samples kept per timer for percentiles.
+        """
+        self.reservoir_size = reservoir_size
+        # Re-entrant: a garbage collection (recorded by `track_gc`) can start while this thread holds the lock.
+        self.lock = threading.RLock()
+        self.gauge_callbacks = {}
+        self._gc_started = None
+        self.reset()
+
+    def reset(self):
+        """Clears all recorded values; registered gauge callbacks are kept."""
+        with self.lock:
+            self.samples = {}
+            self.counts = {}
+            self.totals = {}
+            self.buckets = {}
+            self.counters = {}
+            self.gauges = {}
+
+    @contextmanager
+    def timer(self, name):
+        """
+        Times the enclosed block and records it under `name`.
+
+        Args:
+            name (str): Stage name, e.g. 'detect.bg_subtract'.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def timed(self, name):
+        """
+        Decorator that times every call of a function under `name`.
+
+        Args:
+            name (str): Stage name.
+        """
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def observe(self, name, seconds):
+        """
+        Records one duration sample.
+
+        Args:
+            name (str): Stage name.
+            seconds (float): Duration in seconds.
+        """
+        with self.lock:
+            reservoir = self.samples.get(name)
+            if reservoir is None:
+                reservoir = self.samples[name] = deque(maxlen=self.reservoir_size)
+                self.counts[name] = 0
+                self.totals[name] = 0.0
+                self.buckets[name] = [0] * (len(BUCKETS) + 1)
+            reservoir.append(seconds)
+            self.counts[name] += 1
+            self.totals[name] += seconds
+            self.buckets[name][bisect_left(BUCKETS, seconds)] += 1
+
+    def incr(self, name, amount=1):
+        """
+        Increments a counter.
+
+        Args:
+            name (str): Counter name, e.g. 'frames.dropped'.
+            amount (int): Increment.
+        """
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def set_gauge(self, name, value):
+        """
+        Sets a gauge to a value.
+
+        Args:
+            name (str): Gauge name, e.g. 'analysis.queue_depth'.
+            value (float): Current value.
+        """
+        with self.lock:
+            self.gauges[name] = value
+
+    def register_gauge(self, name, callback):
+        """
+        Registers a gauge whose value is read when metrics are exported.
+
+        Args:
+            name (str): Gauge name.
+            callback (callable): Returns the current value; must be cheap and thread-safe.
+        """
+        with self.lock:
+            self.gauge_callbacks[name] = callback
+
+    def track_gc(self):
+        """
+        Records every garbage collection as a `gc.gen<N>` timer (its count is the number of
+        collections, its samples the stop-the-world pause) and the objects it freed in the
+        `gc.collected` counter. Idempotent.
+        """
+        if self._on_gc in gc.callbacks:
+            return
+        gc.callbacks.append(self._on_gc)
+
+    def _on_gc(self, phase, info):
+        """
+        `gc.callbacks` hook timing each collection from its start to its stop phase.
+
+        Args:
+            phase (str): 'start' or 'stop'.
+            info (dict): Collector details; 'generation' and 'collected' are read on 'stop'.
+        """
+        # Collections never overlap: the collector is not re-entered while a callback runs.
+        if phase == 'start':
+            self._gc_started = time.perf_counter()
+        elif self._gc_started is not None:
+            self.observe(f"gc.gen{info['generation']}", time.perf_counter() - self._gc_started)
+            self.incr('gc.collected', info['collected'])
+            self._gc_started = None
+
+    def read_gauges(self):
+        """
+        Returns:
+            dict: Current value of every gauge, callbacks included.
+        """
+        with self.lock:
+            gauges = dict(self.gauges)
+            callbacks = dict(self.gauge_callbacks)
+        for name, callback in callbacks.items():
+            try:
+                gauges[name] = callback()
+            except Exception:
+                # A failing callback must not break the export of everything else.
+                continue
+        return gauges
+
+    def percentiles(self, name, quantiles=(50, 90, 99)):
+        """
+        Computes percentiles over the recent samples of a timer.
+
+        Args:
+            name (str): Stage name.
+            quantiles (tuple): Percentiles to compute (0-100).
+
+        Returns:
+            dict: {"p50": seconds, ...}, empty if the timer has no samples.
+        """
+        with self.lock:
+            ordered = sorted(self.samples.get(name, ()))
+        if not ordered:
+            return {}
+        # Nearest-rank percentile; exact enough for latency reporting.
+        return {f"p{q}": ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))] for q in quantiles}
+
+    def snapshot(self):
+        """
+        Returns:
+            dict: {"timers": {name: {count, total_s, mean_ms, p50_ms, p90_ms, p99_ms}},
+                "counters": {...}, "gauges": {...}}
+        """
+        with self.lock:
+            names = list(self.samples)
+            counts = dict(self.counts)
+            totals = dict(self.totals)
+            counters = dict(self.counters)
+
+        timers = {}
+        for name in names:
+            stats = {
+                'count': counts[name],
+                'total_s': totals[name],
+                'mean_ms': 1000 * totals[name] / counts[name]
+            }
+            for key, value in self.percentiles(name).items():
+                stats[f"{key}_ms"] = 1000 * value
+            timers[name] = stats
+        return {'timers': timers, 'counters': counters, 'gauges': self.read_gauges()}
+
+    def render_prometheus(self, prefix='birdfeeder'):
+        """
+        Renders all metrics in the Prometheus text exposition format.
+
+        Timers become `<prefix>_<name>_seconds` histograms, counters `<prefix>_<name>_total`.
+
+        Args:
+            prefix (str): Metric name prefix.
+
+        Returns:
+            str: The exposition text.
+        """
+        with self.lock:
+            timers = {name: (self.counts[name], self.totals[name], list(self.buckets[name])) for name in self.samples}
+            counters = dict(self.counters)
+        gauges = self.read_gauges()
+
+        lines = []
+        for name, (count, total, buckets) in sorted(timers.items()):
+            metric = f"{prefix}_{_metric_name(name)}_seconds"
+            lines.append(f"# TYPE {metric} histogram")
+            cumulative = 0
+            for bound, hits in zip(BUCKETS, buckets):
+                cumulative += hits
+                lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+            lines.append(f'{metric}_bucket{{le="+Inf"}} {count}')
+            lines.append(f"{metric}_sum {total}")
+            lines.append(f"{metric}_count {count}")
+        for name, value in sorted(counters.items()):
+            metric = f"{prefix}_{_metric_name(name)}_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric} {value}")
+        for name, value in sorted(gauges.items()):
+            metric = f"{prefix}_{_metric_name(name)}"
+            lines.append(f"# TYPE {metric} gauge")
+            lines.append(f"{metric} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _metric_name(name):
+    """Turns a dotted stage name into a valid Prometheus metric name fragment."""
+    return re.sub(r'[^a-zA-Z0-9_]', '_', name)
+
+
+def process_rss_bytes():
+    """
+    Returns:
+        int: Resident set size of this process in bytes (Linux), or 0 if unavailable.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+class MetricsExporter:
+    """
+    Exposes a Metrics registry on a local HTTP endpoint and/or dumps it to a JSON file periodically.
+    """
+
+    def __init__(self, registry, config):
+        """
+        Initialize the MetricsExporter.
+
+        Args:
+            registry (Metrics): The registry to export.
+            config (dict): Configuration dictionary loaded from settings.yaml.
+        """
+        self.registry = registry
+        self.host = config.get('METRICS_HOST', '127.0.0.1')
+        self.port = config.get('METRICS_PORT', 0)
+        self.dump_path = config.get('METRICS_DUMP_PATH')
+        self.dump_interval = config.get('METRICS_DUMP_INTERVAL_SECONDS', 60)
+        self.server = None
+        self.stop_event = threading.Event()
+        self.threads = []
+        self.logger = logging.getLogger(__name__)
+
+    def start(self):
+        """Starts the HTTP endpoint (if `METRICS_PORT` is set) and the JSON dump (if `METRICS_DUMP_PATH` is set)."""
+        if self.port:
+            registry = self.registry
+
+            class Handler(BaseHTTPRequestHandler):
+                """Serves the registry as Prometheus text or JSON."""
+
+                def do_GET(self):
+                    """Answers `/metrics` and `/metrics.json`; any other path is a 404."""
+                    if self.path == '/metrics':
+                        body = registry.render_prometheus().encode()
+                        content_type = 'text/plain; version=0.0.4'
+                    elif self.path == '/metrics.json':
+                        body = json.dumps(registry.snapshot()).encode()
+                        content_type = 'application/json'
+                    else:
+                        self.send_error(404)
+                        return
+                    self.send_response(200)
+                    self.send_header('Content-Type', content_type)
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, format, *args):
+                    """
+                    Silences the per-request access log.
+
+                    Args:
+                        format (str): printf-style message format.
+                        *args: Format arguments.
+                    """
+                    # Scrapes every few seconds would flood the service log.
+                    pass
+
+            try:
+                self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+            except OSError as e:
+                self.logger.error(f"Failed to start metrics endpoint on {self.host}:{self.port}: {e}")
+            else:
+                self._spawn(self.server.serve_forever, "MetricsHTTP")
+                self.logger.info(f"Metrics endpoint on http://{self.host}:{self.port}/metrics")
+
+        if self.dump_path:
+            self._spawn(self._dump_loop, "MetricsDump")
+
+    def stop(self):
+        """Stops the endpoint and the dump thread, writing a final dump."""
+        self.stop_event.set()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        for thread in self.threads:
+            thread.join(timeout=2)
+        self.threads = []
+
+    def _spawn(self, target, name):
+        """Runs `target` on a daemon thread."""
+        thread = threading.Thread(target=target, name=name, daemon=True)
+        thread.start()
+        self.threads.append(thread)
+
+    def _dump_loop(self):
+        """Writes the JSON snapshot every `METRICS_DUMP_INTERVAL_SECONDS` until stopped."""
+        while not self.stop_event.wait(self.dump_interval):
+            self._dump()
+        self._dump()
+
+    def _dump(self):
+        """Atomically replaces the dump file with the current snapshot."""
+        snapshot = self.registry.snapshot()
+        snapshot['time'] = time.time()
+        tmp_path = f"{self.dump_path}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, self.dump_path)
+        except OSError as e:
+            self.logger.warning(f"Failed to write metrics dump {self.dump_path}: {e}")
+
+
+# Shared registry; components record into it without having it passed around.
+metrics = Metrics()
+metrics.register_gauge('process.rss_bytes', process_rss_bytes)
+metrics.track_gc()
@@ -8,6 +8,48 @@ import time
 import numpy as np
 import logging
 
+from frame_grabber import FrameGrabber
+from ffmpeg_capture import FFmpegCapture, probe_video_size, i420_luma, i420_crop_to_bgr
+from metrics import metrics
+
+def contour_boxes(contours, min_area):
+    """
+    Areas and bounding boxes of all contours at once, from their concatenated points.
+
+    The area is the shoelace formula `cv2.contourArea` uses, summed per contour with
+    `np.add.reduceat`, so the result matches a `contourArea`/`boundingRect` loop without
+    running Python code per contour.
+
+    Args:
+        contours (sequence): Contours as returned by `cv2.findContours`.
+        min_area (float): Contours up to this area are dropped.
+
+    Returns:
+        numpy.ndarray: (N, 4) int32 bounds (x, y, w, h) of the remaining contours, largest first.
+    """
+    if not len(contours):
+        return np.empty((0, 4), dtype=np.int32)
+    # `map(len, ...)` runs the per-contour length lookup in C; no Python frame per contour.
+    lengths = np.fromiter(map(len, contours), dtype=np.intp, count=len(contours))
+    starts = np.zeros_like(lengths)
+    np.cumsum(lengths[:-1], out=starts[1:])
+    points = np.concatenate(contours).reshape(-1, 2).astype(np.int64)
+    x, y = points[:, 0], points[:, 1]
+
+    # Index of each point's successor, wrapping around at the end of its contour.
+    succ = np.arange(1, len(points) + 1)
+    succ[starts + lengths - 1] = starts
+    areas = np.abs(np.add.reduceat(x * y[succ] - x[succ] * y, starts)) / 2
+
+    keep = np.flatnonzero(areas > min_area)
+    keep = keep[np.argsort(areas[keep])[::-1]]
+    x0 = np.minimum.reduceat(x, starts)[keep]
+    y0 = np.minimum.reduceat(y, starts)[keep]
+    x1 = np.maximum.reduceat(x, starts)[keep]
+    y1 = np.maximum.reduceat(y, starts)[keep]
+    return np.stack([x0, y0, x1 - x0 + 1, y1 - y0 + 1], axis=1).astype(np.int32)
+
+
 class MotionDetector:
     """
     Handles motion detection on the Low Quality (LQ) RTSP stream.
@@ -25,100 +67,373 @@ class MotionDetector:
         self.config = config
         self.cap = None
         history = config.get('MOG2_HISTORY', 500)
+        self.history = history
         self.back_sub = cv2.createBackgroundSubtractorMOG2(history=history, varThreshold=config.get('MOTION_THRESHOLD', 25), detectShadows=False)
+        # MOG2 runs on a downscaled copy; detection and cooldown updates must use the same size.
+        self.scale = min(1.0, config.get('MOTION_DOWNSCALE', 1.0))
+        # Optional polygon ([x, y] as fractions of the frame) outside of which motion is ignored.
+        self.roi_polygon = config.get('ROI_POLYGON')
+        # Buffers reused for every analysed frame, (re)allocated when the frame size changes.
+        self._buffer_shape = None
+        self._roi = None
+        self._roi_mask = None
+        self._small = None
+        self._fg_mask = None
+        self._last_bg_frame = 0
         self.frame_count = 0
+        self.frame_skip = max(1, int(config.get('ANALYSIS_FRAME_SKIP', 6)))
+        self.base_frame_skip = self.frame_skip
+        # 'sync' reads on the caller's thread; 'threaded' drains the stream on a background thread.
+        self.capture_mode = config.get('CAPTURE_MODE', 'sync')
+        # 'opencv' decodes full BGR via cv2.VideoCapture; 'ffmpeg' pipes yuv420p frames whose luma
+        # plane is scaled for detection. Crops always feed Gemini, so the pipe is never gray.
+        self.backend = config.get('CAPTURE_BACKEND', 'opencv')
+        self.pixel_format = 'bgr' if self.backend != 'ffmpeg' else 'yuv420p'
+        self.ffmpeg_size = (config.get('FFMPEG_FRAME_WIDTH', 640), config.get('FFMPEG_FRAME_HEIGHT', 360))
+        # Stack the full-resolution picture above the scaled one, so crops keep the stream's quality.
+        self.full_res_crops = config.get('FFMPEG_FULL_RES_CROPS', True)
+        # Even (width, height) of the stacked full-resolution picture, or None for scaled crops.
+        self.source_size = None
+        self.grabber = None
         self.logger = logging.getLogger(__name__)
 
     def connect(self):
         """
         Establishes connection to the RTSP stream.
         """
-        if self.cap is not None and self.cap.isOpened():
-            self.cap.release()
+        self.release()
         
-        self.logger.info(f"Connecting to RTSP stream: {self.rtsp_url}")
-        self.cap = cv2.VideoCapture(self.rtsp_url)
+        self.logger.info(f"Connecting to RTSP stream: {self.rtsp_url} ({self.backend})")
+        metrics.incr('stream.connects')
+        self.cap = self._open_capture()
         if not self.cap.isOpened():
             self.logger.error("Failed to open RTSP stream")
             return False
+
+        if self.capture_mode == 'threaded':
+            self.grabber = FrameGrabber(self.cap, self.frame_skip)
+            self.grabber.start()
         return True
 
+    def _open_capture(self):
+        """
+        Creates the capture object for the configured backend.
+
+        Returns:
+            cv2.VideoCapture or FFmpegCapture: The capture object (may not be opened).
+        """
+        if self.backend == 'ffmpeg':
+            width, height = self.ffmpeg_size
+            self.source_size = self._probe_source_size() if self.full_res_crops else None
+            return FFmpegCapture(self.rtsp_url, width, height, self.pixel_format, self.source_size)
+        return cv2.VideoCapture(self.rtsp_url)
+
+    def _probe_source_size(self):
+        """
+        Reads the stream's resolution for full-resolution crops.
+
+        Returns:
+            tuple or None: Even (width, height), or None to crop from the scaled picture.
+        """
+        size = probe_video_size(self.rtsp_url)
+        if size is None or size[0] < self.ffmpeg_size[0]:
+            self.logger.warning(f"Could not use the stream resolution ({size}) for crops, "
+                                f"cropping from the {self.ffmpeg_size[0]}x{self.ffmpeg_size[1]} detection frame")
+            return None
+        return size[0] - size[0] % 2, size[1] - size[1] % 2
+
+    def set_frame_skip(self, frame_skip):
+        """
+        Changes how many stream frames go by per analysed frame (see `DutyCycleScheduler`).
+
+        Args:
+            frame_skip (int): New skip; takes effect with the next frame.
+        """
+        self.frame_skip = max(1, int(frame_skip))
+        if self.grabber is not None:
+            self.grabber.frame_skip = self.frame_skip
+
     def read_frame(self):
         """
-        Reads a frame from the stream.
+        Reads the next frame to analyze from the stream.
+
+        Only every `ANALYSIS_FRAME_SKIP`-th frame is decoded; the others are pulled off
+        the socket with `grab()` so they cost no decode time. In threaded mode the
+        returned frame is the most recent one and is only valid until the next call.
+
+        Returns:
+            numpy.ndarray or None: The frame, or None if the stream failed.
         """
         if self.cap is None or not self.cap.isOpened():
             if not self.connect():
                 time.sleep(5) # Wait before retry
                 return None
-        
+
+        with metrics.timer('read'):
+            return self._read_next()
+
+    def _read_next(self):
+        """
+        Pulls the next analysis frame from the open capture (see `read_frame`).
+
+        Returns:
+            numpy.ndarray or None: The frame, or None if the stream failed.
+        """
+        if self.grabber is not None:
+            frame = self.grabber.read()
+            self.frame_count = self.grabber.frames_grabbed
+            if frame is None:
+                self.logger.warning("No fresh frame from grabber, reconnecting...")
+                self.connect()
+            return frame
+
+        # Skipped frames are only grabbed (demuxed), never decoded.
+        for _ in range(self.frame_skip - 1):
+            if not self.cap.grab():
+                self.logger.warning("Failed to grab frame from stream, reconnecting...")
+                self.connect()
+                return None
+            self.frame_count += 1
+
         ret, frame = self.cap.read()
         if not ret:
             self.logger.warning("Failed to read frame from stream, reconnecting...")
             self.connect()
             return None
+        self.frame_count += 1
+        metrics.incr('frames.grabbed', self.frame_skip)
         return frame
 
+    def drain(self):
+        """
+        Keeps the stream flowing without analyzing anything.
+
+        In sync mode one frame is grabbed (demuxed, not decoded), so the socket and the
+        decoder never fall behind while detection is paused. In threaded mode the grabber
+        already drains the stream; this waits for its next frame and discards it.
+
+        Returns:
+            bool: False if the stream failed.
+        """
+        if self.grabber is not None or self.cap is None or not self.cap.isOpened():
+            return self.read_frame() is not None
+
+        if not self.cap.grab():
+            self.logger.warning("Failed to grab frame from stream, reconnecting...")
+            self.connect()
+            return False
+        self.frame_count += 1
+        metrics.incr('frames.grabbed')
+        return True
+
+    def update_background(self, frame):
+        """
+        Feeds a frame to the background model without looking for motion.
+
+        Used during cooldowns, when only a few frames are sampled: the learning rate
+        is scaled by the analysis frames that went by since the last update, so the
+        model tracks lighting changes in wall-clock time as it does in steady state.
+
+        Args:
+            frame (numpy.ndarray): A frame as returned by `read_frame`.
+
+        Returns:
+            numpy.ndarray: The foreground mask, for `has_motion`.
+        """
+        elapsed = max(1.0, (self.frame_count - self._last_bg_frame) / self.frame_skip)
+        with metrics.timer('detect.bg_update'):
+            return self._apply(frame, learning_rate=min(1.0, elapsed / self.history))
+
+    def _apply(self, frame, learning_rate=-1):
+        """
+        Runs MOG2 on the (downscaled) analysis image of a frame.
+
+        Args:
+            frame (numpy.ndarray): A frame as returned by `read_frame`.
+            learning_rate (float): MOG2 learning rate; -1 lets MOG2 pick it from the history.
+
+        Returns:
+            numpy.ndarray: The foreground mask at detection scale.
+        """
+        image = self._analysis_image(frame)
+        if image.shape != self._buffer_shape:
+            self._allocate(image)
+
+        # Only the ROI's bounding box is scaled and modelled; the rest of the frame is never touched.
+        x, y, w, h = self._roi
+        image = image[y:y + h, x:x + w]
+        if self._small is not None:
+            size = (self._small.shape[1], self._small.shape[0])
+            image = cv2.resize(image, size, dst=self._small, interpolation=cv2.INTER_AREA)
+        self._last_bg_frame = self.frame_count
+        return self.back_sub.apply(image, self._fg_mask, learning_rate)
+
+    def _allocate(self, image):
+        """
+        Sets up the ROI and the per-frame buffers for analysis images of this size.
+
+        Args:
+            image (numpy.ndarray): An analysis image (see `_analysis_image`).
+        """
+        h_frame, w_frame = image.shape[:2]
+        if self.roi_polygon:
+            polygon = np.array(self.roi_polygon, dtype=np.float32) * (w_frame, h_frame)
+            x0, y0 = np.clip(np.floor(polygon.min(axis=0)), 0, (w_frame, h_frame)).astype(int)
+            x1, y1 = np.clip(np.ceil(polygon.max(axis=0)), 0, (w_frame, h_frame)).astype(int)
+            self._roi = (int(x0), int(y0), max(1, int(x1 - x0)), max(1, int(y1 - y0)))
+        else:
+            self._roi = (0, 0, w_frame, h_frame)
+
+        _, _, w, h = self._roi
+        size = (max(1, int(w * self.scale)), max(1, int(h * self.scale))) if self.scale < 1 else (w, h)
+        self._small = np.empty((size[1], size[0]) + image.shape[2:], dtype=image.dtype) if self.scale < 1 else None
+        self._fg_mask = np.empty((size[1], size[0]), dtype=np.uint8)
+        self._roi_mask = None
+        if self.roi_polygon:
+            # Polygon in detection coordinates: relative to the ROI box and downscaled.
+            points = (polygon - self._roi[:2]) * (size[0] / w, size[1] / h)
+            self._roi_mask = np.zeros((size[1], size[0]), dtype=np.uint8)
+            cv2.fillPoly(self._roi_mask, [np.round(points).astype(np.int32)], 255)
+        self._buffer_shape = image.shape
+        self.logger.info(f"Motion analysis on {self._roi} of a {w_frame}x{h_frame} frame at {size[0]}x{size[1]}")
+
     def detect(self, frame):
         """
         Analyzes a frame for motion.
 
+        Frame throttling happens in `read_frame`, so every frame passed here is analyzed.
+
         Args:
             frame (numpy.ndarray): The frame to analyze.
 
         Returns:
-            tuple: (detected (bool), crop (numpy.ndarray or None), bounds (tuple or None))
+            numpy.ndarray: (N, 4) int bounds (x, y, w, h) of every moving region larger than
+                `MIN_AREA_PIXELS`, largest first, in analysis coordinates. Empty if nothing moved.
         """
-        self.frame_count += 1
-        
-        # Frame Throttling: Process only every Nth frame
-        frame_skip = self.config.get('ANALYSIS_FRAME_SKIP', 6)
-        if self.frame_count % frame_skip != 0:
-            return False, None, None
+        with metrics.timer('detect'):
+            # Apply background subtraction (on the luma plane only for the ffmpeg backend)
+            # MOG2_HISTORY is calibrated for ANALYSIS_FRAME_SKIP; at another rate the learning rate is
+            # scaled so the background still adapts over the same wall-clock time.
+            learning_rate = -1
+            if self.frame_skip != self.base_frame_skip:
+                learning_rate = min(1.0, self.frame_skip / (self.base_frame_skip * self.history))
+            with metrics.timer('detect.bg_subtract'):
+                fg_mask = self._apply(frame, learning_rate)
+            return self.regions(fg_mask)
 
-        min_area = self.config.get('MIN_AREA_PIXELS', 500)
+    def has_motion(self, fg_mask):
+        """
+        Cheap check for motion inside the ROI of a foreground mask: a pixel count, no contours.
+
+        Args:
+            fg_mask (numpy.ndarray): Mask from `update_background`; the ROI polygon is applied in place.
+
+        Returns:
+            bool: True if more than `MIN_AREA_PIXELS` (at detection scale) are foreground.
+        """
+        min_area = self.config.get('MIN_AREA_PIXELS', 500) * self.scale * self.scale
+        with metrics.timer('detect.count'):
+            # The ROI crop is the polygon's bounding box; its corners (sky, branches) must not count.
+            if self._roi_mask is not None:
+                cv2.bitwise_and(fg_mask, self._roi_mask, dst=fg_mask)
+            return cv2.countNonZero(fg_mask) > min_area
+
+    def regions(self, fg_mask):
+        """
+        Finds the moving regions in a foreground mask.
+
+        Args:
+            fg_mask (numpy.ndarray): Mask from `detect`'s background subtraction; it is thresholded in place.
+
+        Returns:
+            numpy.ndarray: (N, 4) int bounds (x, y, w, h), largest first, in analysis coordinates.
+        """
+        # MIN_AREA_PIXELS is in full analysis resolution; contours are found at detection scale.
+        min_area = self.config.get('MIN_AREA_PIXELS', 500) * self.scale * self.scale
 
-        # Apply background subtraction
-        fg_mask = self.back_sub.apply(frame)
-        
         # Threshold the mask to remove shadows/noise
         thresh_val = self.config.get('MOTION_THRESHOLD_BINARY', 244)
-        _, thresh = cv2.threshold(fg_mask, thresh_val, 255, cv2.THRESH_BINARY)
-        
+        with metrics.timer('detect.threshold'):
+            cv2.threshold(fg_mask, thresh_val, 255, cv2.THRESH_BINARY, dst=fg_mask)
+            if self._roi_mask is not None:
+                cv2.bitwise_and(fg_mask, self._roi_mask, dst=fg_mask)
+
         # Find contours
-        contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        
-        largest_contour = None
-        largest_area = 0
-
-        for contour in contours:
-            area = cv2.contourArea(contour)
-            if area > min_area:
-                if area > largest_area:
-                    largest_area = area
-                    largest_contour = contour
-        
-        if largest_contour is not None:
-             # Get bounding box
-            x, y, w, h = cv2.boundingRect(largest_contour)
-            
-            # Smart Crop: Expand the box slightly for context, but keep within bounds
-            h_frame, w_frame = frame.shape[:2]
-            padding = self.config.get('CROP_PADDING', 50)
-            
-            x1 = max(0, x - padding)
-            y1 = max(0, y - padding)
-            x2 = min(w_frame, x + w + padding)
-            y2 = min(h_frame, y + h + padding)
-            
-            crop = frame[y1:y2, x1:x2]
-            
-            return True, crop, (x, y, w, h)
-
-        return False, None, None
+        with metrics.timer('detect.contours'):
+            contours, _ = cv2.findContours(fg_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+            bounds = contour_boxes(contours, min_area)
+
+        if self.scale < 1:
+            bounds = (bounds / self.scale).astype(np.int32)
+        bounds[:, :2] += self._roi[:2]
+        return bounds
+
+    def _analysis_image(self, frame):
+        """
+        Returns the single image background subtraction runs on.
+
+        Args:
+            frame (numpy.ndarray): A frame as returned by `read_frame`.
+
+        Returns:
+            numpy.ndarray: BGR for the opencv backend, grayscale for the ffmpeg backend.
+        """
+        if self.pixel_format == 'yuv420p':
+            if self.source_size is not None:
+                # The scaled picture's luma rows sit below the full-resolution ones.
+                top = self.source_size[1]
+                return frame[top:top + self.ffmpeg_size[1], :self.ffmpeg_size[0]]
+            return i420_luma(frame, self.ffmpeg_size[1])
+        return frame
+
+    def crop_region(self, frame, bounds):
+        """
+        Cuts a padded crop around a bounding box out of a frame.
+
+        The crop always comes from the frame the motion was found in and is always
+        colour. With the ffmpeg backend it is cut from the full-resolution picture
+        stacked in that frame (or, if the stream could not be probed, from the scaled
+        one) and converted from yuv420p, so Gemini never receives a grayscale or
+        stale image.
+
+        Args:
+            frame (numpy.ndarray): A frame as returned by `read_frame`.
+            bounds (tuple): (x, y, w, h) in analysis coordinates.
+
+        Returns:
+            numpy.ndarray: The crop, owned by the caller.
+        """
+        x, y, w, h = bounds
+
+        # Smart Crop: Expand the box slightly for context, but keep within bounds
+        h_frame, w_frame = self._analysis_image(frame).shape[:2]
+        padding = self.config.get('CROP_PADDING', 50)
+
+        x1 = max(0, x - padding)
+        y1 = max(0, y - padding)
+        x2 = min(w_frame, x + w + padding)
+        y2 = min(h_frame, y + h + padding)
+
+        with metrics.timer('detect.crop'):
+            if self.pixel_format == 'yuv420p':
+                if self.source_size is not None:
+                    # Map the padded box onto the full-resolution picture at the top of the frame.
+                    src_w, src_h = self.source_size
+                    fx, fy = src_w / w_frame, src_h / h_frame
+                    x1, x2 = int(x1 * fx), min(src_w, int(round(x2 * fx)))
+                    y1, y2 = int(y1 * fy), min(src_h, int(round(y2 * fy)))
+                    return i420_crop_to_bgr(frame, src_w, src_h + h_frame, x1, y1, x2, y2)
+                return i420_crop_to_bgr(frame, w_frame, h_frame, x1, y1, x2, y2)
+
+            # Copy, because the frame buffer is recycled by the capture/grabber.
+            return frame[y1:y2, x1:x2].copy()
 
     def release(self):
         """Releases the video capture resource."""
+        if self.grabber is not None:
+            self.grabber.stop()
+            self.grabber = None
         if self.cap:
             self.cap.release()
+            self.cap = None
 
@@ -0,0 +1,279 @@
+# -----------------------------------------------------------------------------
+# Module: Outbox
+# Purpose: Durable, ordered delivery of vision -> server events through a local SQLite outbox and batched webhooks.
+# -----------------------------------------------------------------------------
+
+import json
+import time
+import uuid
+import random
+import sqlite3
+import logging
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import metrics
+
+class Outbox:
+    """
+    Persists sighting events before sending them and replays them in order until the server acknowledges them.
+
+    Events are written to a local SQLite file, so neither a server restart nor a vision
+    restart loses a Phase 1/Phase 2 message. A single sender thread posts the oldest
+    pending events as one batch to `/webhook/batch` over a keep-alive session and
+    backs off exponentially while the server is unreachable.
+
+    Each notify event carries a client reference (`client_ref`). The server returns
+    the sighting id for it, and later updates are sent with that id. If the id is not
+    known yet (same batch, or the ack was lost), the server resolves the reference,
+    and a replayed notify never creates a second row.
+    """
+
+    def __init__(self, backend_url, config):
+        """
+        Initialize the Outbox.
+
+        Args:
+            backend_url (str): Base URL of the server API, e.g. http://localhost:3100/api.
+            config (dict): Configuration dictionary loaded from settings.yaml.
+        """
+        self.url = f"{backend_url}/webhook/batch"
+        self.path = config.get('OUTBOX_PATH', '../vision_outbox.sqlite')
+        self.batch_size = config.get('OUTBOX_BATCH_SIZE', 20)
+        self.linger = config.get('OUTBOX_LINGER_SECONDS', 0.2)
+        self.timeout = (config.get('OUTBOX_CONNECT_TIMEOUT_SECONDS', 3), config.get('OUTBOX_READ_TIMEOUT_SECONDS', 10))
+        self.retry_base = config.get('OUTBOX_RETRY_BASE_SECONDS', 1)
+        self.max_backoff = config.get('OUTBOX_MAX_BACKOFF_SECONDS', 300)
+        self.ref_ttl = config.get('OUTBOX_REF_TTL_DAYS', 7) * 86400
+
+        # One keep-alive connection to the local server is all the sender thread needs.
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=2)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        # The connection is shared by the threads that enqueue and the sender; the lock serializes it.
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            client_ref TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            created_at REAL NOT NULL
+        )''')
+        # client_ref -> server sighting id, learned from notify acknowledgements.
+        self.db.execute('''CREATE TABLE IF NOT EXISTS refs (
+            client_ref TEXT PRIMARY KEY,
+            sighting_id INTEGER NOT NULL,
+            created_at REAL NOT NULL
+        )''')
+
+        self.wake = threading.Event()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.logger = logging.getLogger(__name__)
+        metrics.register_gauge('outbox.pending', self.pending)
+
+    def start(self):
+        """Starts the sender thread; anything left from a previous run is delivered first."""
+        pending = self.pending()
+        if pending:
+            self.logger.info(f"Outbox has {pending} undelivered events from a previous run")
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name="Outbox", daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=5.0):
+        """
+        Stops the sender thread. Undelivered events stay on disk for the next start.
+
+        Args:
+            timeout (float): Seconds to wait for an in-flight request.
+        """
+        self.stop_event.set()
+        self.wake.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+            self.thread = None
+
+    def notify(self, payload):
+        """
+        Queues a Phase 1 (new sighting) event.
+
+        Args:
+            payload (dict): The notify payload (species, reason, timestamp, camera_id, lq_crop_path, ...).
+
+        Returns:
+            str: The client reference used to address this sighting in later updates.
+        """
+        client_ref = uuid.uuid4().hex
+        self._enqueue('notify', client_ref, dict(payload, client_ref=client_ref))
+        return client_ref
+
+    def update(self, client_ref, payload):
+        """
+        Queues a Phase 2 (update) event for a sighting created with `notify`.
+
+        Args:
+            client_ref (str): As returned by `notify`.
+            payload (dict): Fields to update (status, hq_snapshot_path, hq_video_path, ...).
+        """
+        self._enqueue('update', client_ref, payload)
+
+    def derivatives(self, client_ref, manifest):
+        """
+        Queues the feed-sized assets of a sighting (thumbnails, poster, faststart clip).
+
+        Args:
+            client_ref (str): As returned by `notify`.
+            manifest (dict): As produced by `DerivativeWorker`.
+        """
+        self._enqueue('derivatives', client_ref, manifest)
+
+    def resized(self, video_path):
+        """
+        Queues a size change of a clip that was re-encoded in place (see `ClipTiering`).
+
+        Args:
+            video_path (str): The clip, relative to the static root; also the event's reference,
+                since tiered clips are usually older than any client_ref still known.
+        """
+        self._enqueue('resized', video_path, {'hq_video_path': video_path})
+
+    def pending(self):
+        """
+        Returns:
+            int: Number of events not yet acknowledged by the server.
+        """
+        with self.lock:
+            return self.db.execute('SELECT COUNT(*) FROM events').fetchone()[0]
+
+    def _enqueue(self, kind, client_ref, payload):
+        """Persists an event and wakes the sender."""
+        with self.lock:
+            self.db.execute(
+                'INSERT INTO events (kind, client_ref, payload, created_at) VALUES (?, ?, ?, ?)',
+                (kind, client_ref, json.dumps(payload), time.time())
+            )
+        self.wake.set()
+
+    def _run(self):
+        """Sender loop: post the oldest pending events, back off while the server is unreachable."""
+        failures = 0
+        while not self.stop_event.is_set():
+            # Clear before reading, so an event enqueued during delivery is never missed.
+            self.wake.clear()
+            try:
+                events = self._next_batch()
+            except sqlite3.Error as e:
+                # A failing or locked outbox file must not kill the sender; back off like a failed post.
+                self.logger.error(f"Outbox could not read pending events: {e}")
+                events = None
+            if events == []:
+                self.wake.wait()
+                # Let the rest of a burst (e.g. several cameras confirming at once) join the same request.
+                self.stop_event.wait(self.linger)
+                continue
+
+            if events and self._deliver(events):
+                failures = 0
+                continue
+
+            failures += 1
+            delay = min(self.max_backoff, self.retry_base * (2 ** (failures - 1))) * random.uniform(0.5, 1.5)
+            self.logger.warning(f"Outbox delivery failed ({failures}x), retrying in {delay:.1f}s")
+            self.stop_event.wait(delay)
+
+    def _next_batch(self):
+        """
+        Loads the oldest pending events, resolving known sighting ids.
+
+        Returns:
+            list: Event dicts in delivery order.
+        """
+        with self.lock:
+            rows = self.db.execute(
+                '''SELECT e.id, e.kind, e.client_ref, e.payload, e.created_at, r.sighting_id
+                   FROM events e LEFT JOIN refs r ON r.client_ref = e.client_ref
+                   ORDER BY e.id LIMIT ?''',
+                (self.batch_size,)
+            ).fetchall()
+        return [{
+            'seq': row[0],
+            'type': row[1],
+            'client_ref': row[2],
+            'payload': json.loads(row[3]),
+            'created_at': row[4],
+            'sighting_id': row[5]
+        } for row in rows]
+
+    def _deliver(self, events):
+        """
+        Posts one batch and removes every acknowledged event.
+
+        Args:
+            events (list): As returned by `_next_batch`.
+
+        Returns:
+            bool: True if the whole batch was acknowledged.
+        """
+        body = {'events': [
+            {key: event[key] for key in ('seq', 'type', 'client_ref', 'sighting_id', 'payload')}
+            for event in events
+        ]}
+        try:
+            response = self.session.post(self.url, json=body, timeout=self.timeout)
+            response.raise_for_status()
+            results = {result['seq']: result for result in response.json().get('results', [])}
+        except (requests.RequestException, ValueError) as e:
+            self.logger.warning(f"Outbox batch of {len(events)} events not delivered: {e}")
+            metrics.incr('outbox.failures')
+            return False
+
+        now = time.time()
+        complete = True
+        delivered = []
+        dropped = 0
+        with self.lock:
+            try:
+                # One transaction per acknowledged batch keeps SD card syncs to one per request.
+                self.db.execute('BEGIN')
+                for event in events:
+                    result = results.get(event['seq'])
+                    status = result.get('status') if result else None
+                    if status == 'ok':
+                        if event['type'] == 'notify' and result.get('id') is not None:
+                            self.db.execute(
+                                'INSERT OR REPLACE INTO refs (client_ref, sighting_id, created_at) VALUES (?, ?, ?)',
+                                (event['client_ref'], result['id'], now)
+                            )
+                        delivered.append(event)
+                    elif status in ('not_found', 'invalid'):
+                        # Retrying cannot help (e.g. the sighting was deleted meanwhile); drop it.
+                        self.logger.warning(f"Outbox dropped {event['type']} event {event['client_ref']}: {status}")
+                        dropped += 1
+                    else:
+                        # Server-side error or no result: keep this and every later event, in order.
+                        complete = False
+                        break
+                    self.db.execute('DELETE FROM events WHERE id = ?', (event['seq'],))
+                self.db.execute('DELETE FROM refs WHERE created_at < ?', (now - self.ref_ttl,))
+                self.db.execute('COMMIT')
+            except sqlite3.Error as e:
+                # Leave no transaction open on the shared connection; the server deduplicates the replay.
+                if self.db.in_transaction:
+                    self.db.execute('ROLLBACK')
+                self.logger.error(f"Outbox could not record acknowledgement of {len(events)} events: {e}")
+                metrics.incr('outbox.failures')
+                return False
+
+        for event in delivered:
+            metrics.observe('outbox.delivery_latency', now - event['created_at'])
+        if delivered:
+            metrics.incr('outbox.delivered', len(delivered))
+        if dropped:
+            metrics.incr('outbox.dropped', dropped)
+        return complete
@@ -0,0 +1,173 @@
+# -----------------------------------------------------------------------------
+# Module: PreFilter
+# Purpose: Scores motion crops with a small on-device CPU classifier so only likely birds reach Gemini.
+# -----------------------------------------------------------------------------
+
+import time
+import logging
+import threading
+import cv2
+import numpy as np
+
+# onnxruntime is optional; OpenCV DNN can load most ONNX classifiers on its own.
+try:
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
+
+# ImageNet-1k indices that are birds (cock..great grey owl, black grouse..black swan,
+# white stork..albatross). Used when the model is a stock ImageNet classifier.
+DEFAULT_BIRD_CLASS_RANGES = [[7, 24], [80, 100], [127, 146]]
+
+class FakeModel:
+    """
+    Stand-in model returning a fixed bird score, for validating the pipeline offline.
+    """
+
+    def __init__(self, score):
+        """
+        Args:
+            score (float): The bird score returned for every crop.
+        """
+        self.score = score
+
+    def bird_score(self, crop):
+        """
+        Returns:
+            float: The configured score.
+        """
+        return self.score
+
+
+class ClassifierModel:
+    """
+    ImageNet-style classifier run with OpenCV DNN or ONNX Runtime.
+    """
+
+    def __init__(self, model_path, input_size, bird_class_ranges, mean, std):
+        """
+        Load the model.
+
+        Args:
+            model_path (str): Path to an ONNX (or other OpenCV DNN supported) model.
+            input_size (int): Square input resolution of the model.
+            bird_class_ranges (list): Inclusive [start, end] class index ranges that are birds.
+            mean (list): Per-channel RGB mean for normalization (0-1 scale).
+            std (list): Per-channel RGB std for normalization (0-1 scale).
+        """
+        self.input_size = input_size
+        self.bird_ids = np.concatenate([np.arange(a, b + 1) for a, b in bird_class_ranges])
+        self.mean = np.array(mean, dtype=np.float32).reshape(1, 3, 1, 1)
+        self.std = np.array(std, dtype=np.float32).reshape(1, 3, 1, 1)
+
+        if model_path.endswith('.onnx') and onnxruntime is not None:
+            self.session = onnxruntime.InferenceSession(model_path, providers=['CPUExecutionProvider'])
+            self.input_name = self.session.get_inputs()[0].name
+            self.net = None
+        else:
+            self.session = None
+            self.net = cv2.dnn.readNet(model_path)
+
+    def bird_score(self, crop):
+        """
+        Computes the probability mass the model assigns to bird classes.
+
+        Args:
+            crop (numpy.ndarray): BGR (or grayscale) crop.
+
+        Returns:
+            float: Sum of softmax probabilities over the bird classes (0.0 to 1.0).
+        """
+        if crop.ndim == 2:
+            crop = cv2.cvtColor(crop, cv2.COLOR_GRAY2BGR)
+        blob = cv2.dnn.blobFromImage(crop, 1.0 / 255, (self.input_size, self.input_size), swapRB=True)
+        blob = (blob - self.mean) / self.std
+
+        if self.session is not None:
+            logits = self.session.run(None, {self.input_name: blob})[0]
+        else:
+            self.net.setInput(blob)
+            logits = self.net.forward()
+
+        logits = logits.reshape(-1).astype(np.float64)
+        # Numerically stable softmax.
+        exp = np.exp(logits - logits.max())
+        probs = exp / exp.sum()
+        return float(probs[self.bird_ids].sum())
+
+
+class PreFilter:
+    """
+    Gate between motion detection and the Gemini call.
+
+    Crops scoring below `PREFILTER_THRESHOLD` are rejected locally; the rest are
+    escalated to the cloud. Keeps counters and latency totals to show the savings.
+    """
+
+    def __init__(self, config):
+        """
+        Initialize the PreFilter.
+
+        Args:
+            config (dict): Configuration dictionary loaded from settings.yaml.
+
+        Raises:
+            ValueError: If `PREFILTER_MODEL_PATH` is not set.
+        """
+        self.threshold = config.get('PREFILTER_THRESHOLD', 0.3)
+        model_path = config.get('PREFILTER_MODEL_PATH')
+        if not model_path:
+            raise ValueError("PREFILTER_MODEL_PATH must be set when the pre-filter is enabled")
+
+        # "fake:<score>" selects a constant-score model for offline testing.
+        if model_path.startswith('fake:'):
+            self.model = FakeModel(float(model_path.split(':', 1)[1]))
+        else:
+            self.model = ClassifierModel(
+                model_path,
+                config.get('PREFILTER_INPUT_SIZE', 224),
+                config.get('PREFILTER_BIRD_CLASS_RANGES', DEFAULT_BIRD_CLASS_RANGES),
+                config.get('PREFILTER_MEAN', [0.485, 0.456, 0.406]),
+                config.get('PREFILTER_STD', [0.229, 0.224, 0.225])
+            )
+
+        # OpenCV DNN nets are not safe to run from several worker threads at once.
+        self.lock = threading.Lock()
+        self.evaluated = 0
+        self.escalated = 0
+        self.total_seconds = 0.0
+        self.logger = logging.getLogger(__name__)
+        self.logger.info(f"Pre-filter loaded: {model_path} (threshold {self.threshold})")
+
+    def check(self, crop):
+        """
+        Scores a crop and decides whether it should go to Gemini.
+
+        Args:
+            crop (numpy.ndarray): The motion crop.
+
+        Returns:
+            tuple: (escalate (bool), score (float))
+        """
+        with self.lock:
+            start = time.monotonic()
+            score = self.model.bird_score(crop)
+            self.total_seconds += time.monotonic() - start
+            self.evaluated += 1
+            escalate = score >= self.threshold
+            if escalate:
+                self.escalated += 1
+        return escalate, score
+
+    def stats(self):
+        """
+        Returns:
+            dict: Evaluated/escalated counts, escalation rate and mean latency in milliseconds.
+        """
+        with self.lock:
+            return {
+                'evaluated': self.evaluated,
+                'escalated': self.escalated,
+                'escalation_rate': self.escalated / self.evaluated if self.evaluated else 0.0,
+                'mean_latency_ms': 1000 * self.total_seconds / self.evaluated if self.evaluated else 0.0
+            }
@@ -5,12 +5,29 @@
 
 import subprocess
 import os
+import glob
 import time
+import datetime
 import logging
+import threading
+import itertools
+
+from metrics import metrics
+
+# Ring segments are named after the wall-clock time they were opened, which is how
+# a sighting's detection time is mapped onto the segments that cover it, followed by a
+# sequence number so segments opened within the same second never overwrite each other.
+SEGMENT_PREFIX = 'seg_'
+SEGMENT_TIME_FORMAT = '%Y%m%d_%H%M%S'
+SEGMENT_INDEX_DIGITS = 6
 
 class Recorder:
     """
     Handles recording of High Quality (HQ) video and snapshots using ffmpeg.
+
+    Clips are either recorded live (a fresh RTSP connection per clip) or, when the
+    pre-roll ring buffer is running, cut out of continuously recorded segments so
+    they can start before the moment of detection.
     """
 
     def __init__(self, rtsp_url, config=None):
@@ -25,6 +42,21 @@ class Recorder:
         self.config = config or {}
         self.logger = logging.getLogger(__name__)
 
+        # Pre-roll ring buffer
+        self.preroll_seconds = self.config.get('PREROLL_SECONDS', 10)
+        # ffmpeg can only cut on keyframes, so real segments are at least one GOP long.
+        self.segment_seconds = max(1, self.config.get('PREROLL_SEGMENT_SECONDS', 2))
+        self.ring_dir = self.config.get('PREROLL_DIR', '/dev/shm/birdfeeder_ring')
+        self.ring_max_bytes = self.config.get('PREROLL_MAX_MB', 64) * 1024 * 1024
+        self._ring_proc = None
+        self._ring_sequence = 0
+        self._ring_thread = None
+        self._ring_stop = threading.Event()
+        self._ring_lock = threading.Lock()
+        self._pins = {}
+        self._pin_ids = itertools.count()
+
+    @metrics.timed('recorder.snapshot')
     def take_snapshot(self, output_path):
         """
         Captures a single high-quality snapshot.
@@ -54,14 +86,22 @@ class Recorder:
             self.logger.error(f"Snapshot generation failed: {e.stderr.decode()}")
             return False
 
-    def record_clip(self, output_path, duration=30):
+    @metrics.timed('recorder.clip')
+    def record_clip(self, output_path, duration=30, trigger_time=None):
         """
         Records a video clip of specific duration.
 
+        If the pre-roll ring buffer is running and a trigger time is given, the clip
+        starts `PREROLL_SECONDS` before the trigger and is assembled from ring segments.
+
         Args:
             output_path (str): The path to save the video.
             duration (int): Duration in seconds.
+            trigger_time (float, optional): Unix time at which motion was detected.
         """
+        if trigger_time is not None and self.ring_running():
+            return self._export_from_ring(output_path, trigger_time - self.preroll_seconds, duration) is not None
+
         cmd = [
             'ffmpeg',
             '-y',
@@ -70,6 +110,7 @@ class Recorder:
             '-t', str(duration),
             '-c:v', 'copy',  # Copy video stream directly to save CPU
             '-c:a', 'aac',   # Re-encode audio to AAC for MP4 compatibility
+            '-movflags', '+faststart',  # moov first, so phones can start playing before the download ends
             output_path
         ]
 
@@ -85,3 +126,401 @@ class Recorder:
         except subprocess.CalledProcessError as e:
             self.logger.error(f"Recording failed: {e.stderr.decode()}")
             return False
+
+    def capture_sighting(self, snapshot_path, video_path, duration=30, snapshot_offset=0.0, trigger_time=None):
+        """
+        Captures the HQ snapshot and the HQ clip for one sighting from a single source.
+
+        Live mode opens one RTSP session and lets one ffmpeg process write both outputs:
+        a JPEG decoded `snapshot_offset` seconds in, and the stream-copied MP4. With the
+        ring buffer running, both are cut from the ring instead and no RTSP connect occurs.
+
+        Args:
+            snapshot_path (str): The path to save the snapshot.
+            video_path (str): The path to save the video.
+            duration (int): Clip duration in seconds.
+            snapshot_offset (float): Seconds into the stream (or after the trigger) to take the snapshot.
+            trigger_time (float, optional): Unix time at which motion was detected.
+
+        Returns:
+            dict: {"snapshot": bool, "video": bool, "timings": dict of seconds per stage,
+                "clip_start": Unix time of the clip's first frame (None without a clip)}.
+                Timings are measured from this call; `*_after_detection` keys from `trigger_time`.
+        """
+        start = time.time()
+        timings = {}
+
+        if trigger_time is not None and self.ring_running():
+            snapshot_ok = self._snapshot_from_ring(snapshot_path, trigger_time + snapshot_offset)
+            timings['snapshot'] = time.time() - start
+            clip_start = self._export_from_ring(video_path, trigger_time - self.preroll_seconds, duration)
+            video_ok = clip_start is not None
+        else:
+            snapshot_ok, video_ok = self._capture_live(snapshot_path, video_path, duration, snapshot_offset, start, timings)
+            # The MP4 appears once the stream is open, which is close to its first frame.
+            clip_start = start + timings.get('stream_open', 0.0) if video_ok else None
+
+        timings['total'] = time.time() - start
+        if trigger_time is not None and 'snapshot' in timings:
+            timings['snapshot_after_detection'] = start + timings['snapshot'] - trigger_time
+        for stage, seconds in timings.items():
+            metrics.observe(f"recorder.capture.{stage}", seconds)
+
+        self.logger.info("HQ capture timings: " + ", ".join(f"{k}={v:.2f}s" for k, v in timings.items()))
+        return {"snapshot": snapshot_ok, "video": video_ok, "timings": timings, "clip_start": clip_start}
+
+    def _capture_live(self, snapshot_path, video_path, duration, snapshot_offset, start, timings):
+        """
+        Runs one ffmpeg process with one RTSP input and two outputs (JPEG + MP4).
+
+        Stage times are recorded by watching the output files appear: the MP4 header is
+        written once the stream is connected and probed, the JPEG once its frame is encoded.
+
+        Args:
+            snapshot_path (str): The path to save the snapshot.
+            video_path (str): The path to save the video.
+            duration (int): Clip duration in seconds.
+            snapshot_offset (float): Seconds into the stream to take the snapshot.
+            start (float): Unix time the capture was requested.
+            timings (dict): Filled with 'stream_open' and 'snapshot' (seconds since start).
+
+        Returns:
+            tuple: (snapshot_ok (bool), video_ok (bool))
+        """
+        # Stale files would make the "file appeared" probes fire immediately.
+        for path in (snapshot_path, video_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+        cmd = [
+            'ffmpeg',
+            '-y',
+            '-rtsp_transport', 'tcp',
+            '-i', self.rtsp_url,
+            # Output 1: a single decoded frame. Output-side -ss decodes and drops frames up to the offset.
+            '-map', '0:v:0',
+            '-ss', f"{snapshot_offset:.2f}",
+            '-frames:v', '1',
+            '-q:v', str(self.config.get('SNAPSHOT_QUALITY', 2)),
+            snapshot_path,
+            # Output 2: the stream-copied clip from the same session.
+            '-map', '0:v:0',
+            '-map', '0:a:0?',
+            '-t', str(duration),
+            '-c:v', 'copy',
+            '-c:a', 'aac',
+            '-movflags', '+faststart',
+            video_path
+        ]
+
+        try:
+            self.logger.info(f"Capturing HQ snapshot + {duration}s clip in one session: {video_path}")
+            proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        except OSError as e:
+            self.logger.error(f"HQ capture failed to start: {e}")
+            return False, False
+
+        # Drain stderr on a thread; an unread pipe would block ffmpeg during a long clip.
+        stderr_chunks = []
+        drain = threading.Thread(target=lambda: stderr_chunks.append(proc.stderr.read()), daemon=True)
+        drain.start()
+
+        deadline = start + duration + 15
+        while proc.poll() is None:
+            now = time.time()
+            if 'stream_open' not in timings and os.path.exists(video_path):
+                timings['stream_open'] = now - start
+            if 'snapshot' not in timings and os.path.exists(snapshot_path) and os.path.getsize(snapshot_path) > 0:
+                timings['snapshot'] = now - start
+            if now > deadline:
+                self.logger.error("HQ capture timed out")
+                proc.kill()
+                break
+            time.sleep(0.1)
+        proc.wait()
+        drain.join(timeout=1)
+
+        snapshot_ok = os.path.exists(snapshot_path) and os.path.getsize(snapshot_path) > 0
+        video_ok = proc.returncode == 0 and os.path.exists(video_path)
+        if snapshot_ok and 'snapshot' not in timings:
+            timings['snapshot'] = time.time() - start
+        if proc.returncode != 0:
+            self.logger.error(f"HQ capture failed: {b''.join(stderr_chunks).decode(errors='replace')}")
+        return snapshot_ok, video_ok
+
+    def start_ring_buffer(self):
+        """
+        Starts continuous segment recording of the HQ stream into the ring directory.
+
+        One long-lived ffmpeg process stream-copies short MPEG-TS segments; a supervisor
+        thread restarts it if the camera drops the connection and keeps the ring under
+        `PREROLL_MAX_MB`.
+        """
+        if self._ring_thread is not None:
+            return
+        os.makedirs(self.ring_dir, exist_ok=True)
+        # Segments from a previous run have no relation to the current stream timeline.
+        for path in glob.glob(os.path.join(self.ring_dir, f"{SEGMENT_PREFIX}*.ts")):
+            os.remove(path)
+
+        self._ring_stop.clear()
+        self._ring_thread = threading.Thread(target=self._ring_supervisor, name="RingBuffer", daemon=True)
+        self._ring_thread.start()
+        self.logger.info(f"Pre-roll ring buffer started in {self.ring_dir}")
+
+    def stop_ring_buffer(self):
+        """Stops the segment recorder and its supervisor thread."""
+        self._ring_stop.set()
+        if self._ring_thread is not None:
+            self._ring_thread.join(timeout=5)
+            self._ring_thread = None
+        if self._ring_proc is not None and self._ring_proc.poll() is None:
+            self._ring_proc.terminate()
+            try:
+                self._ring_proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self._ring_proc.kill()
+        self._ring_proc = None
+
+    def ring_running(self):
+        """
+        Returns:
+            bool: True if the ring buffer segment recorder is currently running.
+        """
+        return self._ring_proc is not None and self._ring_proc.poll() is None
+
+    def _ring_supervisor(self):
+        """Keeps the segment recorder alive and prunes the ring once per segment."""
+        while not self._ring_stop.is_set():
+            if self._ring_proc is None or self._ring_proc.poll() is not None:
+                if self._ring_proc is not None:
+                    self.logger.warning("Ring buffer recorder exited, restarting...")
+                self._ring_proc = self._spawn_ring_recorder()
+            self._prune_ring()
+            self._ring_stop.wait(self.segment_seconds)
+
+    def _spawn_ring_recorder(self):
+        """
+        Launches the long-lived segmenting ffmpeg process.
+
+        The HLS muxer is used only for its segment naming: unlike the plain segment muxer
+        it can combine a strftime stamp with the segment's sequence number. Its short
+        playlist is ignored; the ring is pruned by `_prune_ring`.
+
+        Returns:
+            subprocess.Popen or None: The process, or None if it could not be started.
+        """
+        # Continue the numbering of a crashed recorder so a restart within the same second cannot reuse a name.
+        segments = self._list_segments(with_index=True)
+        self._ring_sequence = max(self._ring_sequence, segments[-1][1] + 1 if segments else 0)
+        cmd = [
+            'ffmpeg',
+            '-loglevel', 'error',
+            '-rtsp_transport', 'tcp',
+            '-i', self.rtsp_url,
+            '-map', '0',
+            '-c', 'copy',
+            '-f', 'hls',
+            '-hls_time', str(self.segment_seconds),
+            # MPEG-TS survives truncation and concatenates without remuxing headers.
+            '-hls_segment_type', 'mpegts',
+            '-hls_list_size', '5',
+            '-start_number', str(self._ring_sequence),
+            '-strftime', '1',
+            '-hls_flags', 'second_level_segment_index',
+            '-hls_segment_filename',
+            os.path.join(self.ring_dir, f"{SEGMENT_PREFIX}{SEGMENT_TIME_FORMAT}_%%0{SEGMENT_INDEX_DIGITS}d.ts"),
+            os.path.join(self.ring_dir, 'ring.m3u8')
+        ]
+        try:
+            return subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        except OSError as e:
+            self.logger.error(f"Failed to start ring buffer recorder: {e}")
+            return None
+
+    def _list_segments(self, with_index=False):
+        """
+        Lists ring segments in chronological order.
+
+        Args:
+            with_index (bool): Return the sequence number instead of the start time.
+
+        Returns:
+            list: (start_time (float), path (str)) tuples, oldest first, or (start_time,
+                index (int), path) tuples with `with_index`. The last entry is the segment
+                ffmpeg is still writing.
+        """
+        segments = []
+        for path in glob.glob(os.path.join(self.ring_dir, f"{SEGMENT_PREFIX}*.ts")):
+            stamp, _, index = os.path.basename(path)[len(SEGMENT_PREFIX):-len('.ts')].rpartition('_')
+            try:
+                start = datetime.datetime.strptime(stamp, SEGMENT_TIME_FORMAT).timestamp()
+                index = int(index)
+            except ValueError:
+                continue
+            segments.append((start, index, path))
+        # Segments opened in the same second are ordered by their sequence number.
+        segments.sort()
+        if with_index:
+            return segments
+        return [(start, path) for start, _, path in segments]
+
+    def _prune_ring(self):
+        """Deletes the oldest segments until the ring fits in `PREROLL_MAX_MB`."""
+        segments = self._list_segments()
+        sizes = []
+        for _, path in segments:
+            try:
+                sizes.append(os.path.getsize(path))
+            except OSError:
+                sizes.append(0)
+        total = sum(sizes)
+
+        with self._ring_lock:
+            oldest_pin = min(self._pins.values(), default=None)
+
+        # Always keep the segment being written and the one before it.
+        for i in range(len(segments) - 2):
+            if total <= self.ring_max_bytes:
+                break
+            # A segment ends where the next one starts; keep it if a pending export needs it.
+            seg_end = segments[i + 1][0]
+            if oldest_pin is not None and seg_end > oldest_pin:
+                self.logger.warning("Ring buffer over size limit but segments are pinned by an export")
+                break
+            try:
+                os.remove(segments[i][1])
+            except OSError:
+                pass
+            total -= sizes[i]
+
+    def _wait_for_segments(self, until_time):
+        """
+        Blocks until every ring segment covering times before `until_time` is closed.
+
+        Args:
+            until_time (float): Unix time that must be fully recorded.
+
+        Returns:
+            list: The segment list (see `_list_segments`) at the time waiting stopped.
+        """
+        # A segment is closed once a newer one has been opened after until_time.
+        # Allow a few segment lengths of slack for long GOPs before giving up.
+        give_up = until_time + self.segment_seconds * 3 + 10
+        while True:
+            segments = self._list_segments()
+            if segments and segments[-1][0] >= until_time:
+                return segments
+            if time.time() > give_up or not self.ring_running():
+                self.logger.warning("Ring buffer did not reach the requested time, using what is available")
+                return segments
+            time.sleep(0.5)
+
+    def _snapshot_from_ring(self, output_path, at_time):
+        """
+        Extracts one high-quality JPEG from the ring segment covering `at_time`.
+
+        Args:
+            output_path (str): The path to save the snapshot.
+            at_time (float): Unix time of the desired frame.
+
+        Returns:
+            bool: True on success.
+        """
+        pin = next(self._pin_ids)
+        with self._ring_lock:
+            self._pins[pin] = at_time
+        try:
+            segments = self._wait_for_segments(at_time)
+            covering = [(start, path) for start, path in segments[:-1] if start <= at_time]
+            if not covering:
+                self.logger.error("No ring segment covers the requested snapshot time")
+                return False
+            seg_start, seg_path = covering[-1]
+
+            cmd = [
+                'ffmpeg',
+                '-y',
+                # Input seeking inside a local segment; decodes from the preceding keyframe.
+                '-ss', f"{max(0.0, at_time - seg_start):.2f}",
+                '-i', seg_path,
+                '-frames:v', '1',
+                '-q:v', str(self.config.get('SNAPSHOT_QUALITY', 2)),
+                output_path
+            ]
+            try:
+                self.logger.info(f"Taking HQ snapshot from ring buffer: {output_path}")
+                subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=15, check=True)
+                return True
+            except subprocess.TimeoutExpired:
+                self.logger.error("Ring snapshot timed out")
+                return False
+            except subprocess.CalledProcessError as e:
+                self.logger.error(f"Ring snapshot failed: {e.stderr.decode()}")
+                return False
+        finally:
+            with self._ring_lock:
+                del self._pins[pin]
+
+    def _export_from_ring(self, output_path, start_time, duration):
+        """
+        Joins the ring segments covering [start_time, start_time + duration] into one MP4.
+
+        Segments are concatenated with stream copy, so the clip is rounded out to segment
+        (keyframe) boundaries rather than re-encoded for an exact cut.
+
+        Args:
+            output_path (str): The path to save the video.
+            start_time (float): Unix time at which the clip should start.
+            duration (int): Duration in seconds.
+
+        Returns:
+            float or None: Unix time the clip actually starts at (its first segment), or None on failure.
+        """
+        end_time = start_time + duration
+        pin = next(self._pin_ids)
+        with self._ring_lock:
+            self._pins[pin] = start_time
+
+        try:
+            segments = self._wait_for_segments(end_time)
+            closed = segments[:-1]
+            chosen = [
+                (seg_start, path) for i, (seg_start, path) in enumerate(closed)
+                if seg_start < end_time and segments[i + 1][0] > start_time
+            ]
+            if not chosen:
+                self.logger.error("No ring segments cover the requested clip window")
+                return None
+
+            list_path = os.path.join(self.ring_dir, f"concat_{pin}.txt")
+            with open(list_path, "w") as f:
+                for _, path in chosen:
+                    f.write(f"file '{path}'\n")
+
+            cmd = [
+                'ffmpeg',
+                '-y',
+                '-f', 'concat',
+                '-safe', '0',
+                '-i', list_path,
+                '-c:v', 'copy',
+                '-c:a', 'aac',
+                '-movflags', '+faststart',
+                output_path
+            ]
+            try:
+                self.logger.info(f"Exporting {len(chosen)} ring segments ({self.preroll_seconds}s pre-roll): {output_path}")
+                subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=60, check=True)
+                return chosen[0][0]
+            except subprocess.TimeoutExpired:
+                self.logger.error("Ring export timed out")
+                return None
+            except subprocess.CalledProcessError as e:
+                self.logger.error(f"Ring export failed: {e.stderr.decode()}")
+                return None
+            finally:
+                os.remove(list_path)
+        finally:
+            with self._ring_lock:
+                del self._pins[pin]
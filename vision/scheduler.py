@@ -0,0 +1,262 @@
+# -----------------------------------------------------------------------------
+# Module: Scheduler
+# Purpose: Solar day schedule and activity-driven analysis rate for the capture loop.
+# -----------------------------------------------------------------------------
+
+import os
+import re
+import json
+import time
+import logging
+import datetime
+import threading
+from suntime import Sun, MidnightSunException, PolarNightException
+
+# Sightings are written as YYYYmmdd_HHMMSS[_<camera>]_hq.jpg (see main.handle_sighting).
+CAPTURE_NAME = re.compile(r'^(\d{8}_\d{6})(?:_(.+))?_hq\.jpg$')
+
+class ActivityHistogram:
+    """
+    Per-camera, per-hour sighting counts with exponential decay, persisted as a small JSON file.
+
+    The main process records confirmed sightings; camera processes read the file, so the
+    histogram is shared without any IPC. Counts decay with `ACTIVITY_HALF_LIFE_DAYS`, so the
+    profile follows the seasons.
+    """
+
+    def __init__(self, config):
+        """
+        Initialize the ActivityHistogram.
+
+        Args:
+            config (dict): Configuration dictionary loaded from settings.yaml.
+        """
+        self.path = config.get('ACTIVITY_HISTORY_PATH', '../vision_activity.json')
+        self.half_life = config.get('ACTIVITY_HALF_LIFE_DAYS', 14) * 86400
+        self.lock = threading.Lock()
+        self.cameras = {}
+        self.mtime = None
+        self.logger = logging.getLogger(__name__)
+
+    def load(self):
+        """Reloads the file if another process changed it since the last load."""
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return
+        if mtime == self.mtime:
+            return
+        try:
+            with open(self.path) as f:
+                cameras = json.load(f).get('cameras', {})
+        except (OSError, ValueError) as e:
+            self.logger.warning(f"Could not read activity history {self.path}: {e}")
+            return
+        with self.lock:
+            self.cameras = cameras
+            self.mtime = mtime
+
+    def seed_from_captures(self, captures_dir, default_camera):
+        """
+        Builds the histogram from the HQ snapshots already on disk, if there is no history file yet.
+
+        Args:
+            captures_dir (str): Directory holding the `*_hq.jpg` snapshots.
+            default_camera (str): Camera id of snapshots without a camera suffix.
+        """
+        if os.path.exists(self.path):
+            return
+        try:
+            names = os.listdir(captures_dir)
+        except OSError:
+            return
+
+        count = 0
+        for name in names:
+            match = CAPTURE_NAME.match(name)
+            if not match:
+                continue
+            when = datetime.datetime.strptime(match.group(1), "%Y%m%d_%H%M%S").timestamp()
+            self._add(match.group(2) or default_camera, when)
+            count += 1
+        if count:
+            self.logger.info(f"Seeded activity history from {count} past sightings")
+            self._save()
+
+    def record(self, camera_id, when=None):
+        """
+        Adds a confirmed sighting.
+
+        Args:
+            camera_id (str): Camera that made the sighting.
+            when (float, optional): Unix time of the sighting; now if omitted.
+        """
+        self._add(camera_id, when or time.time())
+        self._save()
+
+    def hourly(self, camera_id):
+        """
+        Returns:
+            list: 24 decayed sighting counts by local hour, or None if the camera has no history.
+        """
+        with self.lock:
+            entry = self.cameras.get(camera_id)
+            if entry is None:
+                return None
+            factor = self._decay(time.time() - entry['updated_at'])
+            return [count * factor for count in entry['counts']]
+
+    def _decay(self, seconds):
+        """Decay factor for an age in seconds."""
+        return 0.5 ** (max(0.0, seconds) / self.half_life)
+
+    def _add(self, camera_id, when):
+        """Decays a camera's counts to `when` (if later) and adds one sighting at its local hour."""
+        with self.lock:
+            entry = self.cameras.setdefault(camera_id, {'counts': [0.0] * 24, 'updated_at': when})
+            if when >= entry['updated_at']:
+                factor = self._decay(when - entry['updated_at'])
+                entry['counts'] = [count * factor for count in entry['counts']]
+                entry['updated_at'] = when
+                weight = 1.0
+            else:
+                # An older sighting (seeding) counts as much as it would have decayed by now.
+                weight = self._decay(entry['updated_at'] - when)
+            entry['counts'][datetime.datetime.fromtimestamp(when).hour] += weight
+
+    def _save(self):
+        """Atomically rewrites the history file."""
+        with self.lock:
+            data = json.dumps({'cameras': self.cameras})
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                f.write(data)
+            os.replace(tmp_path, self.path)
+            self.mtime = os.path.getmtime(self.path)
+        except OSError as e:
+            self.logger.warning(f"Failed to write activity history {self.path}: {e}")
+
+
+class DutyCycleScheduler:
+    """
+    Decides when a camera runs and how often it analyses frames.
+
+    Sunrise and sunset are computed once per day. At night the loop sleeps until the next
+    sunrise. During the day the frame skip follows the camera's activity histogram: hours
+    with many past sightings are analysed more often than `ANALYSIS_FRAME_SKIP`, quiet hours
+    less often.
+    """
+
+    def __init__(self, config, histogram, camera_id):
+        """
+        Initialize the DutyCycleScheduler.
+
+        Args:
+            config (dict): The camera's effective configuration.
+            histogram (ActivityHistogram): Shared sighting history.
+            camera_id (str): Camera whose history drives the analysis rate.
+        """
+        lat = float(os.getenv("LOCATION_LAT", 40.7128))
+        lng = float(os.getenv("LOCATION_LNG", -74.0060))
+        self.sun = Sun(lat, lng)
+        self.histogram = histogram
+        self.camera_id = camera_id
+        self.enabled = config.get('ADAPTIVE_FRAME_SKIP', True)
+        self.base_skip = max(1, int(config.get('ANALYSIS_FRAME_SKIP', 6)))
+        self.min_skip = max(1, int(config.get('ANALYSIS_FRAME_SKIP_MIN', 3)))
+        self.max_skip = max(self.base_skip, int(config.get('ANALYSIS_FRAME_SKIP_MAX', 18)))
+        self.min_sightings = config.get('ACTIVITY_MIN_SIGHTINGS', 20)
+        self.margin = datetime.timedelta(minutes=config.get('DAYLIGHT_MARGIN_MINUTES', 0))
+        self._days = {}
+        self.logger = logging.getLogger(__name__)
+
+    def _day(self, date):
+        """
+        Daylight interval of one UTC date, computed once and cached.
+
+        Returns:
+            tuple or None: (sunrise, sunset) as aware UTC datetimes, or None during polar night.
+        """
+        if date not in self._days:
+            start = datetime.datetime.combine(date, datetime.time(), tzinfo=datetime.timezone.utc)
+            try:
+                sunrise = self.sun.get_sunrise_time(date)
+                sunset = self.sun.get_sunset_time(date)
+                interval = (sunrise - self.margin, sunset + self.margin)
+            except MidnightSunException:
+                interval = (start, start + datetime.timedelta(days=1))
+            except PolarNightException:
+                interval = None
+            except Exception as e:
+                self.logger.warning(f"Suntime calculation failed: {e}. Treating the day as daylight.")
+                interval = (start, start + datetime.timedelta(days=1))
+            self._days[date] = interval
+            # Only yesterday, today and tomorrow are ever needed.
+            for old in [d for d in self._days if d < date - datetime.timedelta(days=2)]:
+                del self._days[old]
+        return self._days[date]
+
+    def _intervals(self, now):
+        """Daylight intervals of the UTC days around `now`."""
+        today = now.date()
+        days = (today - datetime.timedelta(days=1), today, today + datetime.timedelta(days=1))
+        return [interval for interval in (self._day(day) for day in days) if interval]
+
+    def is_daylight(self, now=None):
+        """
+        Args:
+            now (datetime, optional): Aware UTC time; defaults to now.
+
+        Returns:
+            bool: True if `now` is between sunrise and sunset.
+        """
+        now = now or datetime.datetime.now(datetime.timezone.utc)
+        return any(start <= now < end for start, end in self._intervals(now))
+
+    def seconds_until_daylight(self, now=None):
+        """
+        Args:
+            now (datetime, optional): Aware UTC time; defaults to now.
+
+        Returns:
+            float: Seconds until the next sunrise (0 if it is daylight).
+        """
+        now = now or datetime.datetime.now(datetime.timezone.utc)
+        if self.is_daylight(now):
+            return 0.0
+        upcoming = [start for start, _ in self._intervals(now) if start > now]
+        if not upcoming:
+            # Polar night: look again tomorrow.
+            return 86400.0
+        return (min(upcoming) - now).total_seconds()
+
+    def frame_skip(self, now=None):
+        """
+        Analysis frame skip for the current hour.
+
+        The hour's activity (smoothed with its neighbours) is compared to the average
+        over the active hours; the base skip is divided by that ratio and clamped to
+        [ANALYSIS_FRAME_SKIP_MIN, ANALYSIS_FRAME_SKIP_MAX].
+
+        Args:
+            now (float, optional): Unix time; defaults to now.
+
+        Returns:
+            int: Frames per analysed frame.
+        """
+        if not self.enabled:
+            return self.base_skip
+        self.histogram.load()
+        counts = self.histogram.hourly(self.camera_id)
+        if counts is None or sum(counts) < self.min_sightings:
+            return self.base_skip
+
+        # Smooth with the neighbouring hours so sparse history does not make the rate jump.
+        smoothed = [0.25 * counts[h - 1] + 0.5 * counts[h] + 0.25 * counts[(h + 1) % 24] for h in range(24)]
+        active = [count for count in smoothed if count > 0]
+        mean = sum(active) / len(active)
+        current = smoothed[datetime.datetime.fromtimestamp(now or time.time()).hour]
+        if current <= 0:
+            return self.max_skip
+        return max(self.min_skip, min(self.max_skip, round(self.base_skip * mean / current)))
@@ -0,0 +1,232 @@
+# -----------------------------------------------------------------------------
+# Module: Tiering
+# Purpose: Re-encodes older sighting clips at a lower bitrate while the feeder is idle,
+#          so the disk holds more days of footage before the server has to evict any.
+# -----------------------------------------------------------------------------
+
+import os
+import glob
+import time
+import shutil
+import logging
+import threading
+import subprocess
+
+from metrics import metrics
+
+def clip_bitrate(path):
+    """
+    Reads the overall bitrate of a clip from its container header.
+
+    Args:
+        path (str): Path to the MP4 file.
+
+    Returns:
+        int or None: Bits per second, or None if ffprobe cannot tell.
+    """
+    cmd = [
+        'ffprobe',
+        '-v', 'error',
+        '-show_entries', 'format=bit_rate',
+        '-of', 'csv=p=0',
+        path
+    ]
+    try:
+        output = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=30, check=True).stdout
+        return int(output.decode().strip())
+    except (OSError, ValueError, subprocess.SubprocessError):
+        return None
+
+
+class ClipTiering:
+    """
+    Background storage tiering of recorded clips.
+
+    Clips older than `TIERING_AGE_DAYS` are transcoded to `TIERING_VIDEO_KBPS` (and at most
+    `TIERING_MAX_WIDTH` pixels wide), oldest first. The work only runs while `is_idle()` says
+    no bird is around, e.g. at night, unless the disk is above `TIERING_DISK_USAGE_PERCENT`;
+    then clips of any age are tiered so space is won back before the server's cleanup starts
+    deleting sightings. A clip is replaced only if the new file is smaller, and keeps its
+    name and modification time.
+    """
+
+    def __init__(self, config, is_idle, on_resized, captures_dir="../static/captures", static_root="../static"):
+        """
+        Initialize the ClipTiering.
+
+        Args:
+            config (dict): Configuration dictionary loaded from settings.yaml.
+            is_idle (callable): Returns True while transcoding cannot compete with detection.
+            on_resized (callable): Called with a clip's path relative to `static_root` once it shrank.
+            captures_dir (str): Directory holding the `*_hq.mp4` clips.
+            static_root (str): Directory the paths reported to `on_resized` are relative to.
+        """
+        self.age = config.get('TIERING_AGE_DAYS', 3) * 86400
+        self.kbps = config.get('TIERING_VIDEO_KBPS', 600)
+        self.max_width = config.get('TIERING_MAX_WIDTH', 1280)
+        self.disk_percent = config.get('TIERING_DISK_USAGE_PERCENT', 75)
+        self.interval = config.get('TIERING_INTERVAL_MINUTES', 10) * 60
+        self.nice = config.get('TIERING_NICE', 15)
+        self.is_idle = is_idle
+        self.on_resized = on_resized
+        self.captures_dir = captures_dir
+        self.static_root = static_root
+        # Clips already at or below the target bitrate; probed once per run.
+        self.done = set()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.logger = logging.getLogger(__name__)
+
+    def start(self):
+        """Starts the background thread."""
+        if self.thread is not None:
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name="ClipTiering", daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=5.0):
+        """
+        Stops the background thread after the clip in progress.
+
+        Args:
+            timeout (float): Seconds to wait for the thread.
+        """
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+            self.thread = None
+
+    def _run(self):
+        """Checks for work every `TIERING_INTERVAL_MINUTES`."""
+        self._lower_priority()
+        while not self.stop_event.wait(self.interval):
+            try:
+                self._pass()
+            except Exception as e:
+                self.logger.error(f"Tiering pass failed: {e}")
+
+    def _lower_priority(self):
+        """Raises the niceness of the tiering thread; its ffmpeg children inherit it."""
+        if self.nice and hasattr(os, 'setpriority'):
+            try:
+                os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), self.nice)
+            except OSError as e:
+                self.logger.warning(f"Could not lower tiering priority: {e}")
+
+    def _disk_usage_percent(self):
+        """Used share of the captures filesystem, as `df` reports it."""
+        try:
+            usage = shutil.disk_usage(self.captures_dir)
+        except OSError:
+            return 0.0
+        return 100.0 * usage.used / (usage.used + usage.free) if usage.used + usage.free else 0.0
+
+    def _pass(self):
+        """Tiers eligible clips, oldest first, for as long as the feeder stays idle (or the disk full)."""
+        paths = glob.glob(os.path.join(self.captures_dir, '*_hq.mp4'))
+        # Forget clips the server's cleanup has deleted, so the set does not grow for ever.
+        self.done.intersection_update(paths)
+
+        pressure = self._disk_usage_percent() > self.disk_percent
+        if not pressure and not self.is_idle():
+            return
+
+        now = time.time()
+        clips = []
+        for path in paths:
+            try:
+                mtime = os.path.getmtime(path)
+            except OSError:
+                continue
+            # Under disk pressure only clips still being written or post-processed are left alone.
+            min_age = 3600 if pressure else self.age
+            if now - mtime >= min_age and path not in self.done:
+                clips.append((mtime, path))
+        clips.sort()
+
+        for _, path in clips:
+            if self.stop_event.is_set():
+                return
+            if not pressure and not self.is_idle():
+                self.logger.info("Feeder active again, pausing clip tiering")
+                return
+            self._tier(path)
+            pressure = pressure and self._disk_usage_percent() > self.disk_percent
+
+    def _tier(self, path):
+        """
+        Transcodes one clip to the lower tier, unless it is already there.
+
+        Args:
+            path (str): The clip.
+
+        Returns:
+            bool: True if the clip was replaced by a smaller one.
+        """
+        bitrate = clip_bitrate(path)
+        if bitrate is not None and bitrate <= self.kbps * 1000 * 1.25:
+            self.done.add(path)
+            return False
+
+        tmp_path = f"{os.path.splitext(path)[0]}_tier.mp4"
+        cmd = [
+            'ffmpeg',
+            '-y',
+            '-loglevel', 'error',
+            '-i', path,
+            '-map', '0:v:0',
+            '-map', '0:a:0?',
+            '-vf', f"scale='min(iw,{self.max_width})':-2",
+            '-c:v', 'libx264',
+            '-preset', 'veryfast',
+            '-b:v', f"{self.kbps}k",
+            '-maxrate', f"{self.kbps}k",
+            '-bufsize', f"{2 * self.kbps}k",
+            '-c:a', 'aac',
+            '-b:a', '64k',
+            '-movflags', '+faststart',
+            tmp_path
+        ]
+        try:
+            with metrics.timer('tiering'):
+                subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=600, check=True)
+        except subprocess.TimeoutExpired:
+            self.logger.error(f"Tiering {path} timed out")
+            self._discard(tmp_path)
+            return False
+        except (OSError, subprocess.CalledProcessError) as e:
+            stderr = getattr(e, 'stderr', None)
+            self.logger.error(f"Tiering {path} failed: {stderr.decode(errors='replace') if stderr else e}")
+            self._discard(tmp_path)
+            # Not retried on every pass; it is probed again after a restart.
+            self.done.add(path)
+            return False
+
+        self.done.add(path)
+        try:
+            stat = os.stat(path)
+            saved = stat.st_size - os.path.getsize(tmp_path)
+            if saved <= 0:
+                self._discard(tmp_path)
+                return False
+            os.replace(tmp_path, path)
+            # Keep the original time, so age ordering and the server's view of the clip stay put.
+            os.utime(path, (stat.st_atime, stat.st_mtime))
+        except OSError as e:
+            self.logger.error(f"Could not replace {path} with its tiered version: {e}")
+            self._discard(tmp_path)
+            return False
+
+        metrics.incr('tiering.clips')
+        metrics.incr('tiering.bytes_saved', saved)
+        self.logger.info(f"Tiered {os.path.basename(path)} to {self.kbps} kbit/s, saved {saved / 1048576:.1f} MB")
+        self.on_resized(os.path.relpath(path, self.static_root))
+        return True
+
+    def _discard(self, path):
+        """Removes a temporary file, if it exists."""
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,213 @@
+# -----------------------------------------------------------------------------
+# Module: Tracker
+# Purpose: Follows motion blobs across analysed frames so each visitor is analysed once.
+# -----------------------------------------------------------------------------
+
+import logging
+import numpy as np
+
+from metrics import metrics
+
+def iou_matrix(a, b):
+    """
+    Intersection over union of every box in `a` with every box in `b`.
+
+    Args:
+        a (numpy.ndarray): (N, 4) boxes as (x, y, w, h).
+        b (numpy.ndarray): (M, 4) boxes as (x, y, w, h).
+
+    Returns:
+        numpy.ndarray: (N, M) IoU values.
+    """
+    a = a.astype(np.float32)[:, None, :]
+    b = b.astype(np.float32)[None, :, :]
+    ix = np.clip(np.minimum(a[..., 0] + a[..., 2], b[..., 0] + b[..., 2]) - np.maximum(a[..., 0], b[..., 0]), 0, None)
+    iy = np.clip(np.minimum(a[..., 1] + a[..., 3], b[..., 1] + b[..., 3]) - np.maximum(a[..., 1], b[..., 1]), 0, None)
+    inter = ix * iy
+    union = a[..., 2] * a[..., 3] + b[..., 2] * b[..., 3] - inter
+    return inter / np.maximum(union, 1.0)
+
+def centroid_distances(a, b):
+    """
+    Distance between the centres of every box in `a` and every box in `b`, in units of
+    the larger side of the `a` box.
+
+    Args:
+        a (numpy.ndarray): (N, 4) boxes as (x, y, w, h).
+        b (numpy.ndarray): (M, 4) boxes as (x, y, w, h).
+
+    Returns:
+        numpy.ndarray: (N, M) relative distances.
+    """
+    a = a.astype(np.float32)
+    b = b.astype(np.float32)
+    ca = a[:, :2] + a[:, 2:] / 2
+    cb = b[:, :2] + b[:, 2:] / 2
+    dist = np.linalg.norm(ca[:, None, :] - cb[None, :, :], axis=2)
+    return dist / np.maximum(a[:, 2:].max(axis=1), 1.0)[:, None]
+
+
+class Track:
+    """
+    One motion blob followed across analysed frames.
+    """
+
+    def __init__(self, track_id, bounds, now):
+        """
+        Initialize the Track.
+
+        Args:
+            track_id (int): Id, unique per tracker.
+            bounds (tuple): (x, y, w, h) of the first detection.
+            now (float): Unix time of the first detection.
+        """
+        self.id = track_id
+        self.bounds = bounds
+        self.first_seen = now
+        self.last_seen = now
+        self.hits = 1
+        self.matched = True
+        self.confirmed = False
+        self.analysed = False
+
+    @property
+    def dwell(self):
+        """
+        Returns:
+            float: Seconds between the first and the latest detection.
+        """
+        return self.last_seen - self.first_seen
+
+
+class BlobTracker:
+    """
+    Associates the motion boxes of consecutive analysed frames into tracks.
+
+    Boxes are matched to tracks greedily, best IoU first, with a centroid-distance
+    fallback for small fast blobs that do not overlap between frames. A track is
+    confirmed (an arrival) after `TRACK_MIN_HITS` detections and ends (an exit) once
+    it has not been seen for `TRACK_MAX_AGE_SECONDS`. The age is wall-clock, so tracks
+    survive a changing frame skip and the sparse sampling of a sighting cooldown.
+    """
+
+    def __init__(self, config):
+        """
+        Initialize the BlobTracker.
+
+        Args:
+            config (dict): Configuration dictionary loaded from settings.yaml.
+        """
+        self.iou_threshold = config.get('TRACK_IOU_THRESHOLD', 0.2)
+        self.max_distance = config.get('TRACK_MAX_CENTROID_DISTANCE', 1.0)
+        self.max_age = config.get('TRACK_MAX_AGE_SECONDS', 5)
+        self.min_hits = max(1, config.get('TRACK_MIN_HITS', 2))
+        self.tracks = []
+        self.next_id = 1
+        self.logger = logging.getLogger(__name__)
+
+    def update(self, boxes, now):
+        """
+        Matches the boxes of one analysed frame to the live tracks.
+
+        Args:
+            boxes (numpy.ndarray): (N, 4) motion boxes as (x, y, w, h).
+            now (float): Unix time of the frame.
+
+        Returns:
+            tuple: (entered (list), exited (list)) tracks confirmed or ended by this frame.
+        """
+        for track in self.tracks:
+            track.matched = False
+
+        unmatched = set(range(len(boxes)))
+        if self.tracks and len(boxes):
+            previous = np.array([track.bounds for track in self.tracks])
+            iou = iou_matrix(previous, boxes)
+            dist = centroid_distances(previous, boxes)
+            rows, cols = np.nonzero((iou >= self.iou_threshold) | (dist <= self.max_distance))
+            # Best overlap first, nearest centre breaking ties (and ordering the non-overlapping pairs).
+            order = np.lexsort((dist[rows, cols], -iou[rows, cols]))
+            for r, c in zip(rows[order], cols[order]):
+                track = self.tracks[r]
+                if track.matched or c not in unmatched:
+                    continue
+                track.bounds = tuple(int(v) for v in boxes[c])
+                track.last_seen = now
+                track.hits += 1
+                track.matched = True
+                unmatched.discard(c)
+
+        for c in sorted(unmatched):
+            self.tracks.append(Track(self.next_id, tuple(int(v) for v in boxes[c]), now))
+            self.next_id += 1
+
+        entered = []
+        for track in self.tracks:
+            if track.matched and not track.confirmed and track.hits >= self.min_hits:
+                track.confirmed = True
+                entered.append(track)
+                metrics.incr('tracks.entered')
+                self.logger.info(f"Track {track.id} entered at {track.bounds}")
+
+        exited = [track for track in self.tracks if now - track.last_seen > self.max_age]
+        if exited:
+            self.tracks = [track for track in self.tracks if now - track.last_seen <= self.max_age]
+            self._exit(exited)
+
+        metrics.set_gauge('tracks.active', sum(1 for track in self.tracks if track.confirmed))
+        return entered, exited
+
+    def hold(self, now):
+        """
+        Keeps the confirmed tracks alive without locating them, e.g. while a sighting cooldown
+        only samples the background and something is still moving.
+
+        Args:
+            now (float): Unix time of the frame.
+        """
+        for track in self.tracks:
+            if track.confirmed:
+                track.last_seen = now
+
+    def next_arrival(self):
+        """
+        Returns:
+            Track or None: The largest confirmed track in the latest frame that has not been analysed.
+        """
+        pending = [t for t in self.tracks if t.confirmed and t.matched and not t.analysed]
+        if not pending:
+            return None
+        return max(pending, key=lambda t: t.bounds[2] * t.bounds[3])
+
+    def present(self):
+        """
+        Returns:
+            bool: True if a confirmed track was seen in the latest frame, i.e. a visitor is there.
+        """
+        return any(track.confirmed and track.matched for track in self.tracks)
+
+    def get(self, track_id):
+        """
+        Returns:
+            Track or None: The live track with this id.
+        """
+        for track in self.tracks:
+            if track.id == track_id:
+                return track
+        return None
+
+    def clear(self):
+        """Ends all tracks, e.g. when the camera stops for the night."""
+        tracks, self.tracks = self.tracks, []
+        self._exit(tracks)
+        metrics.set_gauge('tracks.active', 0)
+
+    def _exit(self, tracks):
+        """Records the exit of confirmed tracks; unconfirmed ones were flicker and vanish silently."""
+        for track in tracks:
+            if not track.confirmed:
+                continue
+            metrics.incr('tracks.exited')
+            metrics.observe('track.dwell', track.dwell)
+            self.logger.info(f"Track {track.id} left after {track.dwell:.1f}s"
+                             f"{'' if track.analysed else ' (not analysed)'}")